@@ -9,12 +9,15 @@ Home-Assistant Device Tracker using a Non-Mesh Setup of FritzBox and FritzRepeat
 # -----------------------------------------------------------------------------
 # Module Import
 # -----------------------------------------------------------------------------
+from multiprocessing import freeze_support
+
 from multi_ap_tracker.command import ha_multi_ap_tracker
 
 # -----------------------------------------------------------------------------
 # Main Entry Point
 # -----------------------------------------------------------------------------
 if __name__ == "__main__":
+    freeze_support()
     ha_multi_ap_tracker()
 
 
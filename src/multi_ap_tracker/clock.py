@@ -0,0 +1,54 @@
+"""
+Clock abstraction of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import time
+from threading import Event
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+class Clock:
+    """The clock used by the DeviceMonitor and the Tracker.
+
+    This implementation uses the system clocks. It is replaced by the clock of
+    a trace replay to run the tracker on recorded router responses.
+    """
+
+    def time(self) -> float:
+        """Get the current time in seconds since the epoch."""
+        return time.time()
+
+    def monotonic(self) -> float:
+        """Get the current value of a monotonic clock in seconds."""
+        return time.monotonic()
+
+    def sleep(self, seconds: float) -> None:
+        """Sleep for the given number of seconds."""
+        time.sleep(seconds)
+
+    def wait(self, event: Event, timeout: float) -> bool:
+        """Wait for the event up to the given number of seconds and return True if it was set."""
+        return event.wait(timeout)
+
+
+SYSTEM_CLOCK = Clock()
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
@@ -17,13 +17,20 @@ Copyright:
 # -----------------------------------------------------------------------------
 import argparse
 import logging
-import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Union
 
 from tabulate import tabulate
 
 from .config import Config
-from .fritz_ifc import DeviceMonitor
+from .fritz_ifc import Device, DeviceMonitor
+from .history import HistoryReader, get_history_directory
+from .mac import format_mac
+from .output import DEVICE_FIELDS, OUTPUT_FORMATS, RecordWriter, get_device_record
+from .profiling import CycleProfiler
+from .sites import SiteSupervisor, get_site_device_stati
 from .state import State
+from .trace import TraceFinished, get_recorder, get_replay
 
 # -----------------------------------------------------------------------------
 # Module Variables
@@ -42,7 +49,9 @@ DESCRIPTION_SHOW = """
 =====================
 
 Show the current status of all found devices. It shows the aggregated data for
-each device identified by its MAC address.
+each device identified by its MAC address. Use the `--format` option to get the
+data as JSON, JSON lines or CSV instead of a table. If the configuration
+contains sites, the devices of all sites are shown.
 """
 
 DESCRIPTION_MONITOR = """
@@ -51,31 +60,73 @@ DESCRIPTION_MONITOR = """
 
 Show the current status of all found hosts and print detected changes
 at a pre-defined interval specified by the `--interval` option (default 300s).
+If the configuration contains sites, the hosts of all sites are monitored.
+
+With the `--format` option set to `jsonl` (or `json`) or `csv`, the initial
+state and every detected change are written as a stream of events to stdout,
+one line per event. Each event contains the event type (`initial`, `online` or
+`offline`), the timestamp and the data of the host.
+"""
+
+DESCRIPTION_HISTORY = """
+'status history' command
+========================
+
+Show the hosts that were home between the times given by the `--from` and `--to`
+options (default: the last 24 hours) according to the presence history written
+by the `track` command. If a host is given by the `--host` option, all presence
+transitions of this host in that period are shown instead. The routers are not
+queried.
 """
 
 
 # -----------------------------------------------------------------------------
 # Commands
 # -----------------------------------------------------------------------------
+def _use_sites(args, config: Config) -> bool:
+    """Returns True if the sites of the configuration are queried instead of the fritzbox entry."""
+    if config.sites and (args.record or args.replay):
+        LOGGER.warning("Recording and replaying traces is not supported for sites, using the fritzbox entry.")
+        return False
+    return bool(config.sites)
+
+
 def show_status(args) -> None:
     """Show the current status of all found devices."""
     config = Config()
     config.load(args.config_file)
-    state = State(args.state_file)
-    monitor = DeviceMonitor(config, state)
-    device_states = monitor.get_device_stati()
+    state = State(args.state_file, read_only=bool(args.replay))
+    devices: List[Device]
+    if _use_sites(args, config):
+        with CycleProfiler.from_args(args).cycle():
+            devices = get_site_device_stati(config, state)
+    else:
+        recorder = get_recorder(args)
+        monitor = DeviceMonitor(config, state, recorder=recorder, replay=get_replay(args))
+        with CycleProfiler.from_args(args).cycle():
+            devices = list(monitor.get_device_stati().values())
+        if recorder:
+            recorder.close()
+
+    if args.format != "table":
+        writer = RecordWriter(args.format, DEVICE_FIELDS)
+        for device in devices:
+            writer.write(get_device_record(device))
+        writer.close()
+        return
+
     table_headers = ["Name", "MAC", "IP", "Interface", "Connected To", "Status", "Seen by"]
     table_data = [
         [
             state.name,
-            state.mac,
+            format_mac(state.mac),
             state.ip,
             state.interface_type,
             state.connected_to,
             state.status,
             "\n".join(state.seen_by),
         ]
-        for state in device_states.values()
+        for state in devices
     ]
     table_data.sort(key=lambda row: row[0])  # type: ignore
     print(tabulate(table_data, headers=table_headers, tablefmt="fancy_grid"))
@@ -85,48 +136,87 @@ def monitor_status(args) -> None:
     """Show the current status of all found devices followed by a monitoring mode."""
     config = Config()
     config.load(args.config_file)
-    state = State(args.state_file)
-    monitor = DeviceMonitor(config, state)
+    state = State(args.state_file, read_only=bool(args.replay))
+    recorder = None
+    monitor: Union[DeviceMonitor, SiteSupervisor]
+    if _use_sites(args, config):
+        monitor = SiteSupervisor(config, state)
+    else:
+        recorder = get_recorder(args)
+        monitor = DeviceMonitor(config, state, recorder=recorder, replay=get_replay(args))
+    profiler = CycleProfiler.from_args(args)
+    try:
+        _monitor_status(args, monitor, profiler)
+    except TraceFinished:
+        LOGGER.info("End of the trace reached.")
+    finally:
+        if recorder:
+            recorder.close()
+        if isinstance(monitor, SiteSupervisor):
+            monitor.close()
+
+
+def _write_event(
+    writer: RecordWriter, event: str, device: Device, monitor: Union[DeviceMonitor, SiteSupervisor]
+) -> None:
+    """Write a single event of the 'status monitor' command."""
+    record = {
+        "event": event,
+        "timestamp": datetime.fromtimestamp(monitor.clock.time()).astimezone().isoformat("T", "seconds"),
+    }
+    record.update(get_device_record(device))
+    writer.write(record)
 
-    host_states = monitor.get_host_stati()
+
+def _monitor_status(args, monitor: Union[DeviceMonitor, SiteSupervisor], profiler: CycleProfiler) -> None:
+    """The main loop of the 'status monitor' command."""
+    writer = None
+    if args.format != "table":
+        # A stream of events can't be a single JSON document, so json is written as JSON lines
+        writer = RecordWriter("jsonl" if args.format == "json" else args.format, ["event", "timestamp"] + DEVICE_FIELDS)
+
+    with profiler.cycle():
+        host_states = monitor.get_host_stati()
     last_online_hosts = {hostname: device for hostname, device in host_states.items() if device.status}
     last_online_hostnames = set(last_online_hosts.keys())
-    table_headers = ["Name", "MAC", "IP", "Interface", "Connected To"]
-    table_data = [
-        [state.name, state.mac, state.ip, state.interface_type, state.connected_to]
-        for state in last_online_hosts.values()
-    ]
-    table_data.sort(key=lambda row: row[0])
-    print("-" * 80)
-    print("  INITIAL STATE")
-    print("-" * 80)
-    print(tabulate(table_data, headers=table_headers, tablefmt="rounded_outline"))
+    if writer:
+        for hostname in sorted(last_online_hostnames):
+            _write_event(writer, "initial", last_online_hosts[hostname], monitor)
+    else:
+        _print_initial_state(last_online_hosts)
 
     while True:
         LOGGER.debug("Sleeping for %d seconds.", args.interval)
-        time.sleep(args.interval)
+        monitor.clock.sleep(args.interval)
 
-        host_states = monitor.get_host_stati()
+        with profiler.cycle():
+            host_states = monitor.get_host_stati()
         curr_online_hosts = {hostname: device for hostname, device in host_states.items() if device.status}
         curr_online_hostnames = set(curr_online_hosts.keys())
 
-        for new_online_hostname in curr_online_hostnames - last_online_hostnames:
+        for new_online_hostname in sorted(curr_online_hostnames - last_online_hostnames):
             device = curr_online_hosts[new_online_hostname]
+            if writer:
+                _write_event(writer, "online", device, monitor)
+                continue
             LOGGER.info(
                 "New online device found: Name=%s, MAC=%s, IP=%s, Interface=%s, Connected To=%s",
                 device.name,
-                device.mac,
+                format_mac(device.mac),
                 device.ip,
                 device.interface_type,
                 device.connected_to,
             )
 
-        for offline_hostname in last_online_hostnames - curr_online_hostnames:
-            device = last_online_hosts[offline_hostname]
+        for offline_hostname in sorted(last_online_hostnames - curr_online_hostnames):
+            device = host_states.get(offline_hostname, last_online_hosts[offline_hostname])
+            if writer:
+                _write_event(writer, "offline", device, monitor)
+                continue
             LOGGER.info(
                 "Device gone offline: Name=%s, MAC=%s, IP=%s, Interface=%s, Connected To=%s",
                 device.name,
-                device.mac,
+                format_mac(device.mac),
                 device.ip,
                 device.interface_type,
                 device.connected_to,
@@ -136,6 +226,48 @@ def monitor_status(args) -> None:
         last_online_hostnames = curr_online_hostnames
 
 
+def _print_initial_state(last_online_hosts: Dict[str, Device]) -> None:
+    """Print the table of the initial state of the 'status monitor' command."""
+    table_headers = ["Name", "MAC", "IP", "Interface", "Connected To"]
+    table_data = [
+        [state.name, format_mac(state.mac), state.ip, state.interface_type, state.connected_to]
+        for state in last_online_hosts.values()
+    ]
+    table_data.sort(key=lambda row: row[0])
+    print("-" * 80)
+    print("  INITIAL STATE")
+    print("-" * 80)
+    print(tabulate(table_data, headers=table_headers, tablefmt="rounded_outline"))
+
+
+def show_history(args) -> None:
+    """Show the presence history."""
+    config = Config()
+    config.load(args.config_file)
+    state = State(args.state_file)
+    reader = HistoryReader(get_history_directory(config, state.filepath))
+    end = args.to_time or datetime.now().astimezone()
+    start = args.from_time or end - timedelta(days=1)
+
+    if args.host:
+        table_headers = ["Time", "Status", "Connected To"]
+        table_data = [
+            [
+                datetime.fromtimestamp(event.timestamp).astimezone().isoformat(" ", "seconds"),
+                "home" if event.home else "not_home",
+                event.access_point if event.home else "",
+            ]
+            for event in reader.get_events(start, end, args.host)
+        ]
+        print(tabulate(table_data, headers=table_headers, tablefmt="rounded_outline"))
+        return
+
+    hostnames = reader.who_was_home(start, end)
+    print(f"Hosts home between {start.isoformat(' ', 'seconds')} and {end.isoformat(' ', 'seconds')}:")
+    for hostname in hostnames:
+        print(f"  {hostname}")
+
+
 # -----------------------------------------------------------------------------
 # Parsers
 # -----------------------------------------------------------------------------
@@ -149,6 +281,9 @@ def add_status_parser(subparsers) -> None:
     show_status_parser = status_subparsers.add_parser(
         "show", description=DESCRIPTION_SHOW, formatter_class=argparse.RawTextHelpFormatter
     )
+    show_status_parser.add_argument(
+        "--format", choices=OUTPUT_FORMATS, default="table", help="The output format. Default: %(default)s"
+    )
     show_status_parser.set_defaults(func=show_status)
 
     monitor_status_parser = status_subparsers.add_parser(
@@ -161,8 +296,29 @@ def add_status_parser(subparsers) -> None:
         default=300,
         help="Time between two status retrievals in seconds. Default: %(default)s",
     )
+    monitor_status_parser.add_argument(
+        "--format", choices=OUTPUT_FORMATS, default="table", help="The output format. Default: %(default)s"
+    )
     monitor_status_parser.set_defaults(func=monitor_status)
 
+    history_status_parser = status_subparsers.add_parser(
+        "history", description=DESCRIPTION_HISTORY, formatter_class=argparse.RawTextHelpFormatter
+    )
+    history_status_parser.add_argument(
+        "--from",
+        dest="from_time",
+        type=datetime.fromisoformat,
+        help="Start of the period as ISO 8601 date and time. Default: 24 hours before the end.",
+    )
+    history_status_parser.add_argument(
+        "--to",
+        dest="to_time",
+        type=datetime.fromisoformat,
+        help="End of the period as ISO 8601 date and time. Default: now",
+    )
+    history_status_parser.add_argument("--host", help="Show the presence transitions of this host.")
+    history_status_parser.set_defaults(func=show_history)
+
 
 # -----------------------------------------------------------------------------
 # EOF
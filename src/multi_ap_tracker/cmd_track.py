@@ -17,10 +17,15 @@ Copyright:
 # -----------------------------------------------------------------------------
 import argparse
 import logging
+from dataclasses import replace
 
 from .config import Config
+from .profiling import CycleProfiler
+from .reload import ConfigWatcher
+from .spans import get_span_writer
 from .state import State
-from .tracker import Tracker
+from .trace import TraceFinished, get_recorder, get_replay
+from .tracker import Tracker, garbage_collect
 
 # -----------------------------------------------------------------------------
 # Module Variables
@@ -31,6 +36,10 @@ DESCRIPTION_TRACK = """
 ===============
 
 Perform the tracking of devices and publishing the state via MQTT.
+
+A trace replayed by the global option --replay is processed as dry run, i.e.,
+the MQTT messages are only logged and neither the state nor the history are
+changed, unless the option --publish is given.
 """
 DESCRIPTION_CLEANUP = """
 'cleanup' command
@@ -38,6 +47,16 @@ DESCRIPTION_CLEANUP = """
 
 Remove all tracked devices from home-assistant and the internal state.
 """
+DESCRIPTION_GC = """
+'gc' command
+============
+
+Remove all orphaned device trackers and access point sensors from
+home-assistant. All retained device tracker and sensor configurations published
+under the configured node ID are collected and compared with the created device
+trackers, the hosts currently known by the Fritz!Box and all repeaters and the
+configured access points. All other configurations are deleted.
+"""
 
 
 # -----------------------------------------------------------------------------
@@ -47,9 +66,32 @@ def track(args) -> None:
     """Perform the tracking of the devices and publish the state via MQTT."""
     config = Config()
     config.load(args.config_file)
-    state = State(args.state_file)
-    tracker = Tracker(config, state)
-    tracker.track()
+    replay = get_replay(args)
+    dry_run = replay is not None and not args.publish
+    if dry_run:
+        LOGGER.info("Replaying a trace as dry run, use --publish to update home-assistant and the state.")
+        config = replace(
+            config,
+            high_availability=replace(config.high_availability, enabled=False),
+            history=replace(config.history, enabled=False),
+        )
+    state = State(args.state_file, read_only=dry_run)
+    recorder = get_recorder(args)
+    span_writer = get_span_writer(args)
+    tracker = Tracker(config, state, recorder, replay, dry_run=dry_run)
+    config_watcher = None
+    if args.config_file and not replay:
+        config_watcher = ConfigWatcher(args.config_file, tracker.wake_up)
+    try:
+        tracker.track(CycleProfiler.from_args(args), config_watcher, span_writer)
+    except TraceFinished:
+        LOGGER.info("End of the trace reached.")
+        tracker.close()
+    finally:
+        if recorder:
+            recorder.close()
+        if span_writer:
+            span_writer.close()
 
 
 def cleanup(args) -> None:
@@ -61,6 +103,13 @@ def cleanup(args) -> None:
     tracker.cleanup()
 
 
+def collect_garbage(args) -> None:
+    """Remove all orphaned device trackers and access point sensors in home-assistant."""
+    config = Config()
+    config.load(args.config_file)
+    garbage_collect(config, State(args.state_file))
+
+
 # -----------------------------------------------------------------------------
 # Parsers
 # -----------------------------------------------------------------------------
@@ -69,6 +118,11 @@ def add_track_parser(subparsers) -> None:
     track_parser = subparsers.add_parser(
         "track", description=DESCRIPTION_TRACK, formatter_class=argparse.RawTextHelpFormatter
     )
+    track_parser.add_argument(
+        "--publish",
+        action="store_true",
+        help="publish the results of a replayed trace via MQTT and update the state and the history",
+    )
     track_parser.set_defaults(func=track)
 
     cleanup_parser = subparsers.add_parser(
@@ -76,6 +130,9 @@ def add_track_parser(subparsers) -> None:
     )
     cleanup_parser.set_defaults(func=cleanup)
 
+    gc_parser = subparsers.add_parser("gc", description=DESCRIPTION_GC, formatter_class=argparse.RawTextHelpFormatter)
+    gc_parser.set_defaults(func=collect_garbage)
+
 
 # -----------------------------------------------------------------------------
 # EOF
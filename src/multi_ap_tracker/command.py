@@ -23,6 +23,7 @@ from .cmd_config import add_config_parser
 from .cmd_mqtt import add_mqtt_parser
 from .cmd_status import add_status_parser
 from .cmd_track import add_track_parser
+from .spans import SPAN_FORMATS
 
 # -----------------------------------------------------------------------------
 # Module Variables
@@ -55,6 +56,56 @@ def get_parser():
         default=Path.cwd() / "state.yml",
         help="The persistent state file. Default: %(default)s",
     )
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        default=None,
+        metavar="DIR",
+        help="Profile the cycles of the track and status commands and write the results to this directory.",
+    )
+    parser.add_argument(
+        "--profile-every",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Profile only every N-th cycle. Default: %(default)s",
+    )
+
+    parser.add_argument(
+        "--record",
+        type=Path,
+        default=None,
+        metavar="FILE",
+        help="Record the responses of all routers into this compressed trace file.",
+    )
+    parser.add_argument(
+        "--replay",
+        type=Path,
+        default=None,
+        metavar="FILE",
+        help="Replay the responses of a recorded trace file instead of querying the routers.",
+    )
+    parser.add_argument(
+        "--replay-speed",
+        type=float,
+        default=1.0,
+        metavar="FACTOR",
+        help="Speed factor of the replay relative to real time, 0 for as fast as possible. Default: %(default)s",
+    )
+
+    parser.add_argument(
+        "--spans",
+        type=Path,
+        default=None,
+        metavar="FILE",
+        help="Append the timed spans of each cycle of the track command to this file, one line per cycle.",
+    )
+    parser.add_argument(
+        "--spans-format",
+        choices=SPAN_FORMATS,
+        default="jsonl",
+        help="Format of the spans: JSON lines with nested spans or OTLP/JSON. Default: %(default)s",
+    )
 
     add_config_parser(subparsers)
     add_status_parser(subparsers)
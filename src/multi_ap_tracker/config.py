@@ -16,9 +16,10 @@ Copyright:
 # Module Import
 # -----------------------------------------------------------------------------
 import logging
-from dataclasses import asdict, dataclass, field
+from dataclasses import asdict, dataclass, field, fields, replace
 from pathlib import Path
-from typing import Optional
+from textwrap import indent
+from typing import Any, Dict, List, Optional
 
 import yaml
 
@@ -28,6 +29,16 @@ import yaml
 LOGGER = logging.getLogger(__name__)
 
 
+# -----------------------------------------------------------------------------
+# Helper Functions
+# -----------------------------------------------------------------------------
+def poll_interval_str(poll_interval: int) -> str:
+    """Get the string representation of a router poll interval."""
+    if poll_interval > 0:
+        return f"{poll_interval} s"
+    return "tracker time interval"
+
+
 # -----------------------------------------------------------------------------
 # Configuration Objects
 # -----------------------------------------------------------------------------
@@ -38,13 +49,19 @@ class Fritzbox:
     address: str = "fritz.box"
     username: str = "admin"
     password: str = "secret"
+    poll_interval: int = 0
+    timeout: int = 10
+    parallelism: int = 1
 
     def __str__(self) -> str:
         """Return the string representation of this object."""
         retval = "  FritzBox Connection:\n"
-        retval += f"    Address:  {self.address}\n"
-        retval += f"    Username: {self.username}\n"
-        retval += f"    Password: {self.password}\n"
+        retval += f"    Address:       {self.address}\n"
+        retval += f"    Username:      {self.username}\n"
+        retval += f"    Password:      {self.password}\n"
+        retval += f"    Poll interval: {poll_interval_str(self.poll_interval)}\n"
+        retval += f"    Timeout:       {self.timeout} s\n"
+        retval += f"    Parallelism:   {self.parallelism}\n"
         return retval
 
 
@@ -61,6 +78,8 @@ class Mqtt:
     node_id: str = "multi_ap_tracker"
     name_prefix: str = "mqtt_"
     ha_state_topic: str = "homeassistant/status"
+    client_id: str = ""
+    single_topic: bool = False
 
     def __str__(self) -> str:
         """Return the string representation of this object."""
@@ -73,6 +92,8 @@ class Mqtt:
         retval += f"    Node ID:          {self.node_id}\n"
         retval += f"    Name Prefix:      {self.name_prefix}\n"
         retval += f"    HA State Topic:   {self.ha_state_topic}\n"
+        retval += f"    Client ID:        {self.client_id or 'ha_multi_ap_tracker-<hostname>-<pid>'}\n"
+        retval += f"    Single Topic:     {self.single_topic}\n"
         return retval
 
 
@@ -83,13 +104,19 @@ class Repeater:
     address: str = "fritz.repeater"
     username: str = "admin"
     password: str = "secret"
+    poll_interval: int = 0
+    timeout: int = 10
+    parallelism: int = 1
 
     def __str__(self) -> str:
         """Return the string representation of this object."""
         retval = "  Repeater Connection:\n"
-        retval += f"    Address:  {self.address}\n"
-        retval += f"    Username: {self.username}\n"
-        retval += f"    Password: {self.password}\n"
+        retval += f"    Address:       {self.address}\n"
+        retval += f"    Username:      {self.username}\n"
+        retval += f"    Password:      {self.password}\n"
+        retval += f"    Poll interval: {poll_interval_str(self.poll_interval)}\n"
+        retval += f"    Timeout:       {self.timeout} s\n"
+        retval += f"    Parallelism:   {self.parallelism}\n"
         return retval
 
 
@@ -99,12 +126,216 @@ class Tracker:
 
     time_interval: int = 60
     send_state_always: bool = False
+    ttl: int = 0
 
     def __str__(self) -> str:
         """Return the string representation of this object."""
         retval = "  Tracker:\n"
         retval += f"    Time interval:     {self.time_interval} s\n"
         retval += f"    Send State always: {self.send_state_always}\n"
+        retval += f"    TTL:               {f'{self.ttl} days' if self.ttl else 'never expire'}\n"
+        return retval
+
+
+@dataclass
+class Neighbour:
+    """Configuration of the neighbour table presence source."""
+
+    enabled: bool = False
+    interface: str = ""
+
+    def __str__(self) -> str:
+        """Return the string representation of this object."""
+        retval = "  Neighbour Table:\n"
+        retval += f"    Enabled:   {self.enabled}\n"
+        retval += f"    Interface: {self.interface or 'all'}\n"
+        return retval
+
+
+@dataclass
+class Probe:
+    """Configuration of the active probing to confirm departures."""
+
+    enabled: bool = False
+    timeout: float = 1.0
+    attempts: int = 2
+    concurrency: int = 1000
+    rate: int = 500
+    idle_time: int = 0
+
+    def __str__(self) -> str:
+        """Return the string representation of this object."""
+        retval = "  Probe:\n"
+        retval += f"    Enabled:     {self.enabled}\n"
+        retval += f"    Timeout:     {self.timeout} s\n"
+        retval += f"    Attempts:    {self.attempts}\n"
+        retval += f"    Concurrency: {self.concurrency}\n"
+        retval += f"    Rate:        {self.rate} probes/s\n"
+        retval += f"    Idle Time:   {f'{self.idle_time} s' if self.idle_time else 'disabled'}\n"
+        return retval
+
+
+@dataclass
+class HighAvailability:
+    """Configuration of the active/standby operation of multiple instances."""
+
+    enabled: bool = False
+    lock_topic: str = ""
+    claim_delay: float = 3.0
+    keepalive: int = 10
+
+    def __str__(self) -> str:
+        """Return the string representation of this object."""
+        retval = "  High Availability:\n"
+        retval += f"    Enabled:     {self.enabled}\n"
+        retval += f"    Lock Topic:  {self.lock_topic or '<node_id>/leader'}\n"
+        retval += f"    Claim Delay: {self.claim_delay} s\n"
+        retval += f"    Keepalive:   {self.keepalive} s\n"
+        return retval
+
+
+@dataclass
+class History:
+    """Configuration of the local presence history."""
+
+    enabled: bool = False
+    directory: str = ""
+    retention_days: int = 365
+
+    def __str__(self) -> str:
+        """Return the string representation of this object."""
+        retval = "  History:\n"
+        retval += f"    Enabled:     {self.enabled}\n"
+        retval += f"    Directory:   {self.directory or '<state directory>/history'}\n"
+        retval += f"    Retention:   {self.retention_days} days\n"
+        return retval
+
+
+@dataclass
+class Roaming:
+    """Configuration of the roaming events and access point occupancy sensors."""
+
+    enabled: bool = False
+    events_topic: str = ""
+
+    def __str__(self) -> str:
+        """Return the string representation of this object."""
+        retval = "  Roaming:\n"
+        retval += f"    Enabled:      {self.enabled}\n"
+        retval += f"    Events Topic: {self.events_topic or '<node_id>/roaming'}\n"
+        return retval
+
+
+@dataclass
+class Snapshot:
+    """Configuration of the aggregate snapshot and diff messages of all hosts."""
+
+    enabled: bool = False
+    topic: str = ""
+    diff_topic: str = ""
+
+    def __str__(self) -> str:
+        """Return the string representation of this object."""
+        retval = "  Snapshot:\n"
+        retval += f"    Enabled:    {self.enabled}\n"
+        retval += f"    Topic:      {self.topic or '<node_id>/snapshot'}\n"
+        retval += f"    Diff Topic: {self.diff_topic or '<node_id>/snapshot/diff'}\n"
+        return retval
+
+
+@dataclass
+class HostFilterConfig:
+    """Configuration of the include and exclude rules of hosts."""
+
+    include: List[Dict[str, str]] = field(default_factory=lambda: [])
+    exclude: List[Dict[str, str]] = field(default_factory=lambda: [])
+    exclude_pc_hosts: bool = True
+
+    def __str__(self) -> str:
+        """Return the string representation of this object."""
+        retval = "  Host Filter:\n"
+        retval += f"    Include:     {self.include or 'all'}\n"
+        retval += f"    Exclude:     {self.exclude or 'none'}\n"
+        retval += f"    Exclude PCs: {self.exclude_pc_hosts}\n"
+        return retval
+
+
+@dataclass
+class Wlan:
+    """Configuration of the enrichment of wireless clients by signal, band and link speed."""
+
+    enabled: bool = False
+    budget: int = 10
+    refresh_interval: int = 900
+
+    def __str__(self) -> str:
+        """Return the string representation of this object."""
+        retval = "  WLAN Information:\n"
+        retval += f"    Enabled:          {self.enabled}\n"
+        retval += f"    Budget:           {self.budget} calls per cycle\n"
+        retval += f"    Refresh Interval: {self.refresh_interval} s\n"
+        return retval
+
+
+@dataclass
+class Throttling:
+    """Configuration of the health based throttling of the router polls."""
+
+    enabled: bool = False
+    latency_factor: float = 2.0
+    backoff: float = 2.0
+    recovery_step: int = 30
+    max_interval: int = 600
+
+    def __str__(self) -> str:
+        """Return the string representation of this object."""
+        retval = "  Throttling:\n"
+        retval += f"    Enabled:        {self.enabled}\n"
+        retval += f"    Latency Factor: {self.latency_factor}\n"
+        retval += f"    Backoff:        {self.backoff}\n"
+        retval += f"    Recovery Step:  {self.recovery_step} s\n"
+        retval += f"    Max Interval:   {self.max_interval} s\n"
+        return retval
+
+
+@dataclass
+class DescriptionCache:
+    """Configuration of the on-disk cache of the TR-064 descriptions of the routers."""
+
+    enabled: bool = False
+    directory: str = ""
+
+    def __str__(self) -> str:
+        """Return the string representation of this object."""
+        retval = "  Description Cache:\n"
+        retval += f"    Enabled:   {self.enabled}\n"
+        retval += f"    Directory: {self.directory or '<state directory>/tr064_cache'}\n"
+        return retval
+
+
+@dataclass
+class Site:
+    """Configuration of a site with its own Fritz!Box and repeaters."""
+
+    name: str = "site"
+    fritzbox: Fritzbox = field(default_factory=Fritzbox)
+    repeater: List[Repeater] = field(default_factory=lambda: [])
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Site":
+        """Create the site configuration from the loaded yaml data."""
+        return cls(
+            name=data.get("name", "site"),
+            fritzbox=Fritzbox(**data.get("fritzbox", {})),
+            repeater=[Repeater(**args) for args in data.get("repeater", [])],
+        )
+
+    def __str__(self) -> str:
+        """Return the string representation of this object."""
+        retval = f"  Site {self.name}:\n"
+        retval += indent(str(self.fritzbox), "  ")
+        for repeater in self.repeater:
+            retval += indent(str(repeater), "  ")
         return retval
 
 
@@ -112,11 +343,23 @@ class Tracker:
 class Config:
     """Configuration of this application."""
 
-    mqtt: Mqtt = Mqtt()
-    fritzbox: Fritzbox = Fritzbox()
+    mqtt: Mqtt = field(default_factory=Mqtt)
+    fritzbox: Fritzbox = field(default_factory=Fritzbox)
     repeater: list[Repeater] = field(default_factory=lambda: [Repeater()])
-    tracker: Tracker = Tracker()
+    tracker: Tracker = field(default_factory=Tracker)
+    neighbour: Neighbour = field(default_factory=Neighbour)
+    probe: Probe = field(default_factory=Probe)
+    sites: List[Site] = field(default_factory=lambda: [])
+    high_availability: HighAvailability = field(default_factory=HighAvailability)
+    history: History = field(default_factory=History)
+    roaming: Roaming = field(default_factory=Roaming)
+    host_filter: HostFilterConfig = field(default_factory=HostFilterConfig)
+    wlan: Wlan = field(default_factory=Wlan)
+    description_cache: DescriptionCache = field(default_factory=DescriptionCache)
+    throttling: Throttling = field(default_factory=Throttling)
+    snapshot: Snapshot = field(default_factory=Snapshot)
 
+    # pylint: disable=too-many-branches
     def load(self, config_file: Optional[Path]) -> None:
         """Load the configuration from a yaml file."""
         if config_file:
@@ -131,6 +374,40 @@ class Config:
                 self.repeater = [Repeater(**args) for args in data["repeater"]]
             if "tracker" in data:
                 self.tracker = Tracker(**data["tracker"])
+            if "neighbour" in data:
+                self.neighbour = Neighbour(**data["neighbour"])
+            if "probe" in data:
+                self.probe = Probe(**data["probe"])
+            if "sites" in data:
+                self.sites = [Site.from_dict(args) for args in data["sites"]]
+            if "high_availability" in data:
+                self.high_availability = HighAvailability(**data["high_availability"])
+            if "history" in data:
+                self.history = History(**data["history"])
+            if "roaming" in data:
+                self.roaming = Roaming(**data["roaming"])
+            if "host_filter" in data:
+                self.host_filter = HostFilterConfig(**data["host_filter"])
+            if "wlan" in data:
+                self.wlan = Wlan(**data["wlan"])
+            if "description_cache" in data:
+                self.description_cache = DescriptionCache(**data["description_cache"])
+            if "throttling" in data:
+                self.throttling = Throttling(**data["throttling"])
+            if "snapshot" in data:
+                self.snapshot = Snapshot(**data["snapshot"])
+
+    def get_changed_sections(self, other: "Config") -> List[str]:
+        """Get the names of the sections that differ from the other configuration."""
+        return [
+            config_field.name
+            for config_field in fields(self)
+            if getattr(self, config_field.name) != getattr(other, config_field.name)
+        ]
+
+    def get_site_config(self, site: Site) -> "Config":
+        """Get the configuration of a single site."""
+        return replace(self, fritzbox=site.fritzbox, repeater=site.repeater, sites=[])
 
     def save(self, config_file: Path) -> None:
         """Save the configuration to a yaml file."""
@@ -145,6 +422,18 @@ class Config:
         for repeater in self.repeater:
             retval += str(repeater) + "\n"
         retval += str(self.tracker) + "\n"
+        retval += str(self.neighbour) + "\n"
+        retval += str(self.probe) + "\n"
+        for site in self.sites:
+            retval += str(site) + "\n"
+        retval += str(self.high_availability) + "\n"
+        retval += str(self.history) + "\n"
+        retval += str(self.roaming) + "\n"
+        retval += str(self.host_filter) + "\n"
+        retval += str(self.wlan) + "\n"
+        retval += str(self.description_cache) + "\n"
+        retval += str(self.throttling) + "\n"
+        retval += str(self.snapshot) + "\n"
         return retval
 
 
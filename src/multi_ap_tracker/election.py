@@ -0,0 +1,182 @@
+"""
+Leader election of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import json
+import logging
+import time
+from threading import Lock
+from typing import Dict, Optional, Set, Tuple
+
+from .config import Config
+from .mqtt_ifc import MqttInterface, get_client_id
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+LOGGER = logging.getLogger(__name__)
+SETTLE_TIME = 1.0
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+# pylint: disable=too-many-instance-attributes
+class LeaderElection:
+    """Active/standby operation of multiple tracker instances using MQTT.
+
+    Every instance announces itself with a retained message on the topic
+    `<lock_topic>/<client_id>`, which is cleared by the last will of the
+    instance if its connection is lost. The leader holds the lock by a retained
+    message containing its client ID on the lock topic. A standby instance claims
+    the lock if it is empty or if the announcement of its holder was cleared for
+    at least `claim_delay` seconds. Concurrent claims are resolved by the broker,
+    as all instances see the last retained lock message.
+
+    While in standby, the instance keeps a warm view of the device trackers
+    created by the leader and their published states, so that it can take over
+    without republishing everything.
+    """
+
+    def __init__(self, config: Config) -> None:
+        """Initialize this object."""
+        self._config = config
+        self._lock = Lock()
+        self.instance_id = get_client_id(config.mqtt)
+        node_id = config.mqtt.node_id or "ha_multi_ap_tracker"
+        self._lock_topic = config.high_availability.lock_topic or f"{node_id}/leader"
+        self._mqtt: Optional[MqttInterface] = None
+        self._holder = ""
+        self._holder_since = time.monotonic()
+        self._free_since: Optional[float] = None
+        self._online_instances: Set[str] = set()
+        self._hostnames: Dict[str, str] = {}
+        self._states: Dict[str, bool] = {}
+
+    @property
+    def will(self) -> Tuple[str, str]:
+        """The last will to clear the announcement of this instance."""
+        return self._get_instance_topic(self.instance_id), ""
+
+    def _get_instance_topic(self, instance_id: str) -> str:
+        """Get the topic of the announcement of an instance."""
+        return f"{self._lock_topic}/{instance_id}"
+
+    def start(self, mqtt: MqttInterface) -> None:
+        """Start the election using the given MQTT interface."""
+        self._mqtt = mqtt
+        mqtt.subscribe(self._lock_topic, self._on_lock_message)
+        mqtt.subscribe(self._get_instance_topic("+"), self._on_instance_message)
+        mqtt.subscribe(mqtt.get_config_topic_filter(), self._on_config_message)
+        mqtt.subscribe(mqtt.get_state_topic_filter(), self._on_state_message)
+        mqtt.add_connect_callback(self._announce)
+
+    def _announce(self) -> None:
+        """Announce this instance."""
+        assert self._mqtt is not None
+        LOGGER.debug("Announcing instance %s.", self.instance_id)
+        self._mqtt.publish(self._get_instance_topic(self.instance_id), "online", qos=1, retain=True)
+
+    def release(self) -> None:
+        """Release the lock (if held) and remove the announcement of this instance."""
+        if self._mqtt is None:
+            return
+        infos = []
+        if self.is_leader:
+            LOGGER.info("Releasing leadership.")
+            infos.append(self._mqtt.publish(self._lock_topic, "", qos=1, retain=True))
+        infos.append(self._mqtt.publish(self._get_instance_topic(self.instance_id), "", qos=1, retain=True))
+        for info in infos:
+            try:
+                info.wait_for_publish(5.0)
+            except RuntimeError:
+                pass
+
+    def _on_lock_message(self, _client, _userdata, message) -> None:
+        """Callback called when the lock holder changed."""
+        with self._lock:
+            self._holder = message.payload.decode()
+            self._holder_since = time.monotonic()
+        LOGGER.debug("Lock is held by %s.", self._holder or "nobody")
+
+    def _on_instance_message(self, _client, _userdata, message) -> None:
+        """Callback called when an instance was announced or went away."""
+        instance_id = message.topic.split("/")[-1]
+        with self._lock:
+            if message.payload:
+                self._online_instances.add(instance_id)
+            else:
+                self._online_instances.discard(instance_id)
+
+    def _on_config_message(self, _client, _userdata, message) -> None:
+        """Callback called for device tracker configuration messages."""
+        object_id = message.topic.split("/")[-2]
+        with self._lock:
+            if not message.payload:
+                self._hostnames.pop(object_id, None)
+                return
+            try:
+                name = json.loads(message.payload.decode())["name"]
+            except (ValueError, KeyError):
+                return
+            prefix_length = len(self._config.mqtt.name_prefix)
+            self._hostnames[object_id] = name[prefix_length:]
+
+    def _on_state_message(self, _client, _userdata, message) -> None:
+        """Callback called for device tracker state messages."""
+        object_id = message.topic.split("/")[-2]
+        state = message.payload.decode()
+        if state.startswith("{"):
+            try:
+                state = json.loads(state)["state"]
+            except (ValueError, KeyError, TypeError):
+                return
+        with self._lock:
+            self._states[object_id] = state == "home"
+
+    @property
+    def is_leader(self) -> bool:
+        """Returns True if this instance holds the lock."""
+        with self._lock:
+            return self._holder == self.instance_id and time.monotonic() - self._holder_since >= SETTLE_TIME
+
+    def update(self) -> bool:
+        """Claim the lock if it is free and return True if this instance is the leader."""
+        assert self._mqtt is not None
+        claim = False
+        with self._lock:
+            now = time.monotonic()
+            if self._holder == self.instance_id or self._holder in self._online_instances:
+                self._free_since = None
+            elif self._free_since is None:
+                self._free_since = now
+            elif now - self._free_since >= self._config.high_availability.claim_delay:
+                self._free_since = None
+                claim = True
+        if claim:
+            LOGGER.info("Lock is free, claiming leadership as %s.", self.instance_id)
+            self._mqtt.publish(self._lock_topic, self.instance_id, qos=1, retain=True)
+        return self.is_leader
+
+    def get_warm_view(self) -> Dict[str, Optional[bool]]:
+        """Get the device trackers created by the leader and their last published states."""
+        with self._lock:
+            return {hostname: self._states.get(object_id) for object_id, hostname in self._hostnames.items()}
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
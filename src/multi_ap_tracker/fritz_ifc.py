@@ -16,13 +16,28 @@ Copyright:
 # Module Import
 # -----------------------------------------------------------------------------
 import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass, field
-from typing import Any, Dict, List, Tuple
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 
+from fritzconnection.core.exceptions import FritzConnectionException
 from fritzconnection.lib.fritzhosts import FritzHosts
 
-from .config import Config
+from .clock import SYSTEM_CLOCK, Clock
+from .config import Config, Fritzbox, Repeater
+from .health import RouterHealth
+from .host_filter import HostFilter
+from .host_table import ParallelFritzHosts
+from .identity import HostIdentityIndex
+from .mac import is_locally_administered, load_mac_table, parse_mac
+from .neigh_ifc import NeighbourMonitor
 from .state import State
+from .timing import StageTimings
+from .trace import HostsSource, ReplayHosts, TraceRecorder
+from .wlan_ifc import WlanEnricher
 
 # -----------------------------------------------------------------------------
 # Module Variables
@@ -30,21 +45,45 @@ from .state import State
 LOGGER = logging.getLogger(__name__)
 
 
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+def get_description_cache_directory(config: Config, state_filepath: Path) -> Optional[Path]:
+    """Get the directory of the cached TR-064 descriptions or None if the cache is disabled."""
+    if not config.description_cache.enabled:
+        return None
+    if config.description_cache.directory:
+        return Path(config.description_cache.directory)
+    return state_filepath.parent / "tr064_cache"
+
+
+def get_router_configs(config: Config) -> List[Tuple[str, Union[Fritzbox, Repeater]]]:
+    """Get the names and the configurations of all routers, starting with the Fritz!Box."""
+    router_configs: List[Tuple[str, Union[Fritzbox, Repeater]]] = [("Fritz!Box", config.fritzbox)]
+    router_configs += [(f"Repeater {repeater_config.address}", repeater_config) for repeater_config in config.repeater]
+    return router_configs
+
+
 # -----------------------------------------------------------------------------
 # Classes
 # -----------------------------------------------------------------------------
+# pylint: disable=too-many-instance-attributes
 @dataclass
 class Device:
     """A device identified by the DeviceMonitor."""
 
     # pylint: disable=invalid-name
-    mac: str = ""
+    mac: int = 0
     ip: str = ""
     name: str = ""
     interface_type: str = ""
     connected_to: str = ""
     status: bool = False
     seen_by: List[str] = field(default_factory=lambda: [])
+    signal: Optional[int] = None
+    speed: Optional[int] = None
+    band: str = ""
+    random_mac: bool = False
 
     @property
     def known(self) -> bool:
@@ -52,115 +91,425 @@ class Device:
         return len(self.seen_by) > 0
 
 
-# pylint: disable=too-few-public-methods
+@dataclass
+class MonitorUpdate:
+    """An update of the aggregated view yielded by the DeviceMonitor after a router answered."""
+
+    router_name: str
+    devices: Dict[Any, Device]  # Keyed by the MAC address (device view) or the host name (host view)
+    complete: bool = False
+
+
+# pylint: disable=too-many-instance-attributes
+@dataclass
+class Router:
+    """A router queried by the DeviceMonitor together with its last results.
+
+    The `last_poll` is the time of the last attempt to query the router and is
+    used to schedule the next poll, while `last_success` is the time at which the
+    `hosts` were retrieved.
+    """
+
+    name: str
+    fritz_hosts: Union[FritzHosts, ReplayHosts]
+    poll_interval: int
+    rank: int
+    config: Union[Fritzbox, Repeater]
+    last_poll: Optional[float] = None
+    last_success: Optional[float] = None
+    hosts: List[Dict[str, Any]] = field(default_factory=lambda: [])
+    health: Optional[RouterHealth] = None
+
+    @property
+    def next_poll(self) -> float:
+        """The time (on the monotonic clock) at which the router should be polled next.
+
+        The poll interval is taken from the health of the router, if available,
+        which might be throttled.
+        """
+        if self.last_poll is None:
+            return 0.0
+        return self.last_poll + (self.health.interval if self.health else self.poll_interval)
+
+    def is_due(self, now: float) -> bool:
+        """Returns True if the router must be polled at the given time."""
+        return self.next_poll <= now
+
+
 class DeviceMonitor:
-    """Device status retriever."""
+    """Device status retriever.
+
+    Every router is polled at its own poll interval. Routers that are not due
+    contribute the results of their last poll, so that every cycle is based on a
+    complete view of all routers. If a NeighbourMonitor is given, its presence
+    hints override the status reported by the routers as long as they are newer
+    than the last successful poll of the router.
 
-    def __init__(self, config: Config, state: State) -> None:
+    Host entries rejected by the host filter of the configuration are dropped
+    when they are merged, before any device is created for them or their names
+    are recorded in the state.
+
+    The raw responses of the routers can be recorded by a TraceRecorder. If a
+    TraceReplay (or another HostsSource) is given, the routers are not contacted
+    at all and the recorded responses are used instead, driven by the clock of
+    the replay.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        config: Config,
+        state: State,
+        neighbour_monitor: Optional[NeighbourMonitor] = None,
+        recorder: Optional[TraceRecorder] = None,
+        replay: Optional[HostsSource] = None,
+    ) -> None:
         """Initialize this object."""
         self._state = state
-        LOGGER.debug("Create connection to Fritz!Box at address %s.", config.fritzbox.address)
-        self._fritz_hosts = [
-            (
-                "Fritz!Box",
-                FritzHosts(
-                    address=config.fritzbox.address, user=config.fritzbox.username, password=config.fritzbox.password
-                ),
-            )
+        self._neighbour_monitor = neighbour_monitor
+        self._recorder = recorder
+        self._replay = replay
+        self.clock: Clock = replay.clock if replay else SYSTEM_CLOCK
+        self._host_filter = HostFilter(config.host_filter)
+        self._identities = HostIdentityIndex(state.data)
+        self._device_types: Dict[int, str]
+        self._device_types, self._state_dirty = load_mac_table(state.data, "MacToDeviceType")
+        self._routers: List[Router] = []
+        self._wlan_enricher: Optional[WlanEnricher] = None
+        self._cache_directory: Optional[Path] = None
+        self._max_status_age = 0.0
+        self.reconfigure(config)
+
+    def reconfigure(self, config: Config) -> None:
+        """Apply a (changed) configuration.
+
+        Only the connections of new routers and of routers with changed
+        connection settings are (re-)created. All other routers keep their
+        connection and the results of their last poll. The connections are
+        created concurrently.
+        """
+        self._host_filter = HostFilter(config.host_filter)
+        self._max_status_age = float(config.tracker.time_interval)
+        self._cache_directory = get_description_cache_directory(config, self._state.filepath)
+        if not config.wlan.enabled:
+            self._wlan_enricher = None
+        elif self._wlan_enricher is None:
+            self._wlan_enricher = WlanEnricher(config.wlan, self.clock)
+        else:
+            self._wlan_enricher.config = config.wlan
+        router_configs = get_router_configs(config)
+
+        old_routers = {router.name: router for router in self._routers}
+        new_routers = [
+            (name, router_config)
+            for name, router_config in router_configs
+            if name not in old_routers
+            or self._get_connection_settings(old_routers[name].config) != self._get_connection_settings(router_config)
         ]
-        for repeater_config in config.repeater:
-            LOGGER.debug("Create connection to repeater at address %s.", repeater_config.address)
-            self._fritz_hosts.append(
-                (
-                    f"Repeater {repeater_config.address}",
-                    FritzHosts(
-                        address=repeater_config.address,
-                        user=repeater_config.username,
-                        password=repeater_config.password,
-                    ),
+        if new_routers:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=len(new_routers)) as executor:
+                futures = {
+                    name: executor.submit(self._create_hosts, name, router_config)
+                    for name, router_config in new_routers
+                }
+                for name, router_config in new_routers:
+                    old_routers[name] = Router(
+                        name=name,
+                        fritz_hosts=futures[name].result(),
+                        poll_interval=0,
+                        rank=0,
+                        config=router_config,
+                    )
+            LOGGER.debug("Created %d connection(s) in %.2f s.", len(new_routers), time.perf_counter() - start)
+
+        self._routers = []
+        for rank, (name, router_config) in enumerate(router_configs):
+            router = old_routers[name]
+            router.config = router_config
+            router.rank = rank
+            router.poll_interval = router_config.poll_interval or config.tracker.time_interval
+            if router.health is None:
+                router.health = RouterHealth(name, router.poll_interval, router_config.parallelism, config.throttling)
+            else:
+                router.health.configure(router.poll_interval, router_config.parallelism, config.throttling)
+            self._routers.append(router)
+
+    @staticmethod
+    def _get_connection_settings(router_config: Union[Fritzbox, Repeater]) -> Tuple[str, str, str, int, int]:
+        """Get the settings of a router configuration that require a new connection if changed."""
+        return (
+            router_config.address,
+            router_config.username,
+            router_config.password,
+            router_config.timeout,
+            router_config.parallelism,
+        )
+
+    def _create_hosts(
+        self, router_name: str, router_config: Union[Fritzbox, Repeater]
+    ) -> Union[FritzHosts, ReplayHosts]:
+        """Create the connection to a router or its replacement during a replay.
+
+        With a `parallelism` greater than one, the host table is enumerated
+        using that many concurrent connections to the router. If the description
+        cache is enabled, the parsed TR-064 descriptions are loaded from the
+        cache directory. The cache is renewed by fritzconnection if the model or
+        the firmware version of the router changed.
+        """
+        if self._replay:
+            return self._replay.create_hosts(router_name)
+        LOGGER.debug("Create connection to %s at address %s.", router_name, router_config.address)
+        kwargs: Dict[str, Any] = {
+            "address": router_config.address,
+            "user": router_config.username,
+            "password": router_config.password,
+            "timeout": router_config.timeout,
+        }
+        if self._cache_directory:
+            self._cache_directory.mkdir(parents=True, exist_ok=True)
+            kwargs.update(use_cache=True, cache_directory=self._cache_directory, cache_format="json")
+        if router_config.parallelism > 1:
+            return ParallelFritzHosts(router_config.parallelism, **kwargs)
+        return FritzHosts(**kwargs)
+
+    def time_until_next_poll(self) -> float:
+        """Get the time in seconds until the next router is due."""
+        next_poll = min(router.next_poll for router in self._routers)
+        return max(0.0, next_poll - self.clock.monotonic())
+
+    def _poll_routers(self, timings: StageTimings) -> Iterator[Router]:
+        """Retrieve the current host infos from all routers that are due.
+
+        The routers that are not due are yielded first with the results of their
+        last poll. All due routers are queried concurrently and yielded in the
+        order of their arrival, so that slow repeaters do not delay the processing
+        of the faster ones.
+        """
+
+        def poll(router: Router) -> Router:
+            with timings.span(f"poll {router.name}"):
+                return poll_router(router)
+
+        def poll_router(router: Router) -> Router:
+            LOGGER.debug("Gather hosts information from %s.", router.name)
+            assert router.health is not None
+            start = time.perf_counter()
+            try:
+                hosts = router.fritz_hosts.get_hosts_info()
+            except (FritzConnectionException, OSError) as exception:
+                LOGGER.warning(
+                    "Failed to gather hosts information from %s, using its last results: %s", router.name, exception
                 )
-            )
-        LOGGER.debug("All connections created.")
-
-    def _aquire_host_infos(self) -> List[Tuple[str, List[Dict[str, Any]]]]:
-        """Retrieve the current host infos from the Fritz!Box and all repeaters."""
-        host_infos = []
-        for router_name, fritz_host in self._fritz_hosts:
-            LOGGER.debug("Gather hosts information from %s.", router_name)
-            host_infos.append((router_name, fritz_host.get_hosts_info()))
-        return host_infos
-
-    def _get_mac_to_host_names(self, host_infos: List[Tuple[str, List[Dict[str, Any]]]]) -> Dict[str, str]:
-        """Update the MAC to host name dictionary."""
-        LOGGER.debug("Updating MAC to host names dictionary.")
-        device_names: Dict[str, str] = self._state.data.setdefault("MacToDeviceNames", {})
-        for _, hosts in host_infos:
-            for host in hosts:
-                mac = host["mac"]
-                if mac:
-                    name = host["name"]
-                    if mac not in device_names:
-                        device_names[mac] = name
-                    elif not name.startswith("PC-"):
-                        if device_names[mac].startswith("PC-"):
-                            device_names[mac] = name
-                        elif name[:15] != device_names[mac][:15]:
-                            device_names[mac] = name
-                        elif len(name) > len(device_names[mac]):
-                            device_names[mac] = name
-        return device_names
-
-    def _get_mac_to_device_type(self, host_infos: List[Tuple[str, List[Dict[str, Any]]]]) -> Dict[str, str]:
-        """Update the MAC to device type (802.11 or Ethernet) dictionary."""
-        LOGGER.debug("Updating MAC to device type dictionary.")
-        device_types: Dict[str, str] = self._state.data.setdefault("MacToDeviceType", {})
-        for _, hosts in host_infos:
-            for host in hosts:
-                mac = host["mac"]
-                if mac and host["ip"] and host["interface_type"]:
-                    if mac not in device_types:
-                        device_types[mac] = host["interface_type"]
-                    # Prefer the 802.11 interface over Ethernet
-                    if host["interface_type"] == "802.11" and device_types[mac] != host["interface_type"]:
-                        device_types[mac] = host["interface_type"]
-        return device_types
-
-    def get_device_stati(self) -> Dict[str, Device]:
-        """Query all devices and aggregate the information per device (identified by its MAC address)."""
-        host_infos = self._aquire_host_infos()
-        device_names = self._get_mac_to_host_names(host_infos)
-        device_types = self._get_mac_to_device_type(host_infos)
-        device_states: Dict[str, Device] = {}
-        for router_name, hosts in host_infos:
-            for host in hosts:
-                mac = host["mac"]
-                if not mac:
-                    continue
-
-                if mac not in device_states:
-                    device_states[mac] = Device(mac=mac)
-
-                device_states[mac].seen_by.append(router_name)
-
-                # Add a fully identified host (this has normally a status True)
-                if host["ip"] and host["interface_type"] and device_types[mac] == host["interface_type"]:
-                    device_states[mac].ip = host["ip"]
-                    device_states[mac].interface_type = host["interface_type"]
-                    device_states[mac].connected_to = router_name
-                    device_states[mac].status = host["status"]
-
-        self._state.data["MacToDeviceNames"] = device_names
-        self._state.data["MacToDeviceType"] = device_types
-        self._state.save()
+                router.health.record_error()
+                router.last_poll = self.clock.monotonic()
+                timings.add(f"fetch {router.name}", time.perf_counter() - start, start, {"error": str(exception)})
+                return router
+            fetched = time.perf_counter()
+            router.health.record_success(fetched - start, len(hosts))
+            if isinstance(router.fritz_hosts, ParallelFritzHosts):
+                router.fritz_hosts.parallelism = router.health.parallelism
+            if self._recorder:
+                self._recorder.record(router.name, self.clock.time(), hosts)
+            router.hosts = self._normalise_host_infos(hosts)
+            router.last_poll = router.last_success = self.clock.monotonic()
+            timings.add(f"fetch {router.name}", fetched - start, start, {"hosts": len(hosts)})
+            timings.add("normalise", time.perf_counter() - fetched, fetched)
+            return router
+
+        now = self.clock.monotonic()
+        due_routers = [router for router in self._routers if router.is_due(now)]
+        for router in self._routers:
+            if router not in due_routers:
+                LOGGER.debug("Using cached hosts information of %s.", router.name)
+                yield router
 
+        if due_routers:
+            with ThreadPoolExecutor(max_workers=len(due_routers)) as executor:
+                futures = [executor.submit(poll, router) for router in due_routers]
+                for future in as_completed(futures):
+                    yield future.result()
+
+    @staticmethod
+    def _normalise_host_infos(hosts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Drop all host entries without a valid MAC address and parse the MAC addresses into integers."""
+        normalised = []
+        for host in hosts:
+            if not host["mac"]:
+                continue
+            try:
+                mac = parse_mac(host["mac"])
+            except ValueError:
+                LOGGER.debug("Dropping host entry %s with invalid MAC address %s.", host["name"], host["mac"])
+                continue
+            normalised.append({**host, "mac": mac, "interface_type": sys.intern(host["interface_type"] or "")})
+        return normalised
+
+    def _update_device_type(self, device_types: Dict[int, str], host: Dict[str, Any]) -> bool:
+        """Update the MAC to device type (802.11 or Ethernet) dictionary.
+
+        Returns True if the device type of the MAC address changed.
+        """
+        mac = host["mac"]
+        if not (host["ip"] and host["interface_type"]):
+            return False
+        if mac not in device_types:
+            device_types[mac] = host["interface_type"]
+            self._state_dirty = True
+            return True
+        # Prefer the 802.11 interface over Ethernet
+        if host["interface_type"] == "802.11" and device_types[mac] != host["interface_type"]:
+            device_types[mac] = host["interface_type"]
+            self._state_dirty = True
+            return True
+        return False
+
+    def _merge_host_infos(
+        self,
+        router: Router,
+        device_states: Dict[int, Device],
+        assigned_ranks: Dict[int, Tuple[bool, float, int]],
+    ) -> None:
+        """Merge the host infos of one router into the per-device view of the current cycle.
+
+        As the routers answer in arbitrary order and are polled at different
+        intervals, an entry of a router only replaces the connection data of a
+        device if it is active while the current one is not. Among entries with
+        the same status the router with the most recent successful poll wins,
+        followed by the router order of the configuration. The `assigned_ranks`
+        dictionary keeps track of the rank of the current connection data per MAC.
+
+        An active entry of a router successfully polled more than one
+        `time_interval` ago loses its precedence, so that the cached results of a
+        slow router can't hide the departure reported by a faster router. If the
+        last poll of the router failed as well, its entries are considered
+        inactive, so that the hosts of an unreachable router age out.
+        """
+        device_types = self._device_types
+        fresh = router.last_success is not None and self.clock.monotonic() - router.last_success <= self._max_status_age
+        expired = not fresh and router.last_poll != router.last_success
+        for host in router.hosts:
+            mac = host["mac"]
+            name = self._identities.lookup(mac, host["name"], router.name)
+            interface_type = host["interface_type"] or device_types.get(mac, "")
+            if not self._host_filter.accepts(mac, name, interface_type, host["ip"]):
+                continue
+            name = self._identities.resolve(mac, host["name"], router.name)
+            type_changed = self._update_device_type(device_types, host)
+
+            if mac not in device_states:
+                device_states[mac] = Device(mac=mac, random_mac=is_locally_administered(mac))
+            device = device_states[mac]
+            device.name = name
+            device.seen_by.append(router.name)
+
+            if type_changed and mac in assigned_ranks and device.interface_type != device_types[mac]:
+                # Connection data of the former preferred interface is no longer valid
+                device.ip = ""
+                device.interface_type = ""
+                device.connected_to = ""
+                device.status = False
+                del assigned_ranks[mac]
+
+            # Add a fully identified host (this has normally a status True)
+            if host["ip"] and host["interface_type"] and device_types.get(mac) == host["interface_type"]:
+                status = bool(host["status"]) and not expired
+                rank = (status and fresh, router.last_success or 0.0, router.rank)
+                if mac not in assigned_ranks or rank > assigned_ranks[mac]:
+                    assigned_ranks[mac] = rank
+                    device.ip = host["ip"]
+                    device.interface_type = host["interface_type"]
+                    device.connected_to = router.name
+                    device.status = status
+
+    def _apply_neighbour_hints(
+        self, device_states: Dict[int, Device], assigned_ranks: Dict[int, Tuple[bool, float, int]]
+    ) -> None:
+        """Override the status of the devices by the newer hints of the neighbour table."""
+        assert self._neighbour_monitor is not None
+        for mac, device in device_states.items():
+            if not device.ip or mac not in assigned_ranks:
+                continue
+            present = self._neighbour_monitor.get_hint(device.ip, mac, assigned_ranks[mac][1])
+            if present is not None and present != device.status:
+                LOGGER.debug("Neighbour table reports %s as %s.", device.name, "present" if present else "gone")
+                device.status = present
+
+    def iter_device_stati(self, timings: Optional[StageTimings] = None) -> Iterator[MonitorUpdate]:
+        """Query all devices and aggregate the information per device (identified by its MAC address).
+
+        This is a streaming pipeline: after each router answered, its hosts are
+        normalised and merged into the per-device view, which is then yielded as
+        an intermediate update. Routers that are not due are merged first using
+        the results of their last poll. The last update has the `complete` flag set and
+        is the only one that contains the information of all routers.
+        """
+        if timings is None:
+            timings = StageTimings()
+        device_states: Dict[int, Device] = {}
+        assigned_ranks: Dict[int, Tuple[bool, float, int]] = {}
+
+        for router in self._poll_routers(timings):
+            with timings.measure("merge", {"router": router.name, "hosts": len(router.hosts)}):
+                self._merge_host_infos(router, device_states, assigned_ranks)
+            yield MonitorUpdate(router_name=router.name, devices=device_states)
+
+        if self._neighbour_monitor:
+            with timings.measure("neighbour hints"):
+                self._apply_neighbour_hints(device_states, assigned_ranks)
+
+        if self._wlan_enricher:
+            with timings.measure("wlan information"):
+                connections = {
+                    router.name: router.fritz_hosts.fc
+                    for router in self._routers
+                    if isinstance(router.fritz_hosts, FritzHosts)
+                }
+                self._wlan_enricher.enrich(connections, device_states)
+
+        if self._state_dirty or self._identities.dirty:
+            with timings.measure("save state"):
+                self._state.save()
+            self._state_dirty = False
+            self._identities.dirty = False
+
+        device_types = self._device_types
         for mac, state in device_states.items():
-            if mac in device_names:
-                state.name = device_names[mac]
             if mac in device_types and not state.interface_type:
                 state.interface_type = device_types[mac]
 
+        yield MonitorUpdate(router_name="", devices=device_states, complete=True)
+
+    def get_device_stati(self) -> Dict[int, Device]:
+        """Query all devices and aggregate the information per device (identified by its MAC address)."""
+        device_states: Dict[int, Device] = {}
+        for update in self.iter_device_stati():
+            device_states = update.devices
         return device_states
 
+    @staticmethod
+    def _get_host_states(device_states: Dict[int, Device]) -> Dict[str, Device]:
+        """Collapse the per-device view to a per-host view."""
+        host_states: Dict[str, Device] = {}
+        for device in device_states.values():
+            if device.name in host_states and host_states[device.name].status:  # Do not overwrite valid entries
+                continue
+            host_states[device.name] = device
+        return host_states
+
+    def iter_host_stati(self, timings: Optional[StageTimings] = None) -> Iterator[MonitorUpdate]:
+        """Query all devices and yield the per-host status information after each router answered.
+
+        See `get_host_stati()` for the per-host view and `iter_device_stati()`
+        for the meaning of the intermediate updates.
+        """
+        if timings is None:
+            timings = StageTimings()
+        for update in self.iter_device_stati(timings):
+            with timings.measure("collapse"):
+                host_states = self._get_host_states(update.devices)
+            yield MonitorUpdate(router_name=update.router_name, devices=host_states, complete=update.complete)
+
     def get_host_stati(self) -> Dict[str, Device]:
         """Query all devices and create a per-host status information.
 
@@ -170,15 +519,8 @@ class DeviceMonitor:
         repeater (in this case the `known` attribute of the Device object is False).
         """
         host_states: Dict[str, Device] = {}
-        device_states = self.get_device_stati()
-
-        for device in device_states.values():
-            if device.name.startswith("PC-"):  # Ignore hosts named PC-*
-                continue
-            if device.name in host_states and host_states[device.name].status:  # Do not overwrite valid entries
-                continue
-            host_states[device.name] = device
-
+        for update in self.iter_host_stati():
+            host_states = update.devices
         return host_states
 
 
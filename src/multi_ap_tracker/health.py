@@ -0,0 +1,134 @@
+"""
+Router health tracking and throttling of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import logging
+from typing import Optional
+
+from .config import Throttling
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+LOGGER = logging.getLogger(__name__)
+EWMA_WEIGHT = 0.3
+BASELINE_DRIFT = 1.01
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+# pylint: disable=too-many-instance-attributes
+class RouterHealth:
+    """Health of a router driving the throttling of its polls.
+
+    The latency of a single request is estimated from the duration of each poll,
+    the number of host entries and the parallelism, and smoothed by an
+    exponentially weighted moving average (EWMA). The lowest smoothed latency
+    observed is the baseline of the router; it drifts slowly upwards so that it
+    follows permanent changes.
+
+    The poll interval and the parallelism are adapted by additive increase,
+    multiplicative decrease (AIMD) of the poll rate: if a poll failed or the
+    smoothed latency exceeds `latency_factor` times the baseline, the interval
+    is multiplied by `backoff` (up to `max_interval`) and the parallelism is
+    halved. Every healthy poll decreases the interval by `recovery_step`
+    seconds and increases the parallelism by one, until the configured values
+    are reached again. The configured values are the fastest rate used.
+    """
+
+    def __init__(self, router_name: str, poll_interval: int, parallelism: int, config: Throttling) -> None:
+        """Initialize this object."""
+        self.router_name = router_name
+        self.latency: Optional[float] = None
+        self.baseline: Optional[float] = None
+        self.errors = 0
+        self.consecutive_errors = 0
+        self._config = config
+        self._min_interval = float(poll_interval)
+        self._max_parallelism = parallelism
+        self.interval = float(poll_interval)
+        self.parallelism = parallelism
+
+    def configure(self, poll_interval: int, parallelism: int, config: Throttling) -> None:
+        """Apply changed settings, keeping the measurements."""
+        self._config = config
+        self._min_interval = float(poll_interval)
+        self._max_parallelism = parallelism
+        if not config.enabled:
+            self.interval = self._min_interval
+            self.parallelism = parallelism
+        else:
+            self.interval = min(max(self.interval, self._min_interval), self._get_max_interval())
+            self.parallelism = max(1, min(self.parallelism, parallelism))
+
+    def _get_max_interval(self) -> float:
+        """Get the maximum poll interval."""
+        return max(self._min_interval, float(self._config.max_interval))
+
+    def record_success(self, duration: float, num_entries: int) -> None:
+        """Record a successful poll of the given duration returning the given number of host entries."""
+        requests_per_session = (num_entries + 1) / self.parallelism
+        latency = duration / max(1.0, requests_per_session)
+        self.latency = latency if self.latency is None else EWMA_WEIGHT * latency + (1 - EWMA_WEIGHT) * self.latency
+        self.baseline = self.latency if self.baseline is None else min(self.baseline * BASELINE_DRIFT, self.latency)
+        self.consecutive_errors = 0
+        if self.latency > self._config.latency_factor * self.baseline:
+            self._throttle(f"latency {self.latency * 1000:.1f} ms above baseline {self.baseline * 1000:.1f} ms")
+        else:
+            self._recover()
+
+    def record_error(self) -> None:
+        """Record a failed poll."""
+        self.errors += 1
+        self.consecutive_errors += 1
+        self._throttle(f"error #{self.consecutive_errors}")
+
+    def _throttle(self, reason: str) -> None:
+        """Decrease the poll rate multiplicatively."""
+        if not self._config.enabled:
+            return
+        interval = min(self._get_max_interval(), max(self.interval, 1.0) * self._config.backoff)
+        parallelism = max(1, self.parallelism // 2)
+        if (interval, parallelism) != (self.interval, self.parallelism):
+            LOGGER.info(
+                "Throttling %s due to %s: poll interval %.0f s, parallelism %d.",
+                self.router_name,
+                reason,
+                interval,
+                parallelism,
+            )
+        self.interval = interval
+        self.parallelism = parallelism
+
+    def _recover(self) -> None:
+        """Increase the poll rate additively up to the configured rate."""
+        if not self._config.enabled:
+            return
+        if self.interval > self._min_interval or self.parallelism < self._max_parallelism:
+            self.interval = max(self._min_interval, self.interval - self._config.recovery_step)
+            self.parallelism = min(self._max_parallelism, self.parallelism + 1)
+            LOGGER.debug(
+                "Recovering %s: poll interval %.0f s, parallelism %d.",
+                self.router_name,
+                self.interval,
+                self.parallelism,
+            )
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
@@ -0,0 +1,308 @@
+"""
+Presence history of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import json
+import logging
+import struct
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .config import Config
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+LOGGER = logging.getLogger(__name__)
+
+# A record consists of the timestamp (seconds since the epoch), the name ID of
+# the host, the name ID of the access point (or NO_NAME_ID) and the flags.
+RECORD = struct.Struct("<IIIB")
+INDEX_ENTRY = struct.Struct("<I")
+NO_NAME_ID = 0xFFFFFFFF
+FLAG_HOME = 0x01
+FLAG_SNAPSHOT = 0x02
+SEGMENT_SUFFIX = ".seg"
+INDEX_SUFFIX = ".idx"
+NAMES_FILE = "names.jsonl"
+
+
+# -----------------------------------------------------------------------------
+# Helper Functions
+# -----------------------------------------------------------------------------
+def get_history_directory(config: Config, state_filepath: Path) -> Path:
+    """Get the directory of the presence history."""
+    if config.history.directory:
+        return Path(config.history.directory)
+    return state_filepath.parent / "history"
+
+
+def _get_segment_day(timestamp: int) -> str:
+    """Get the name of the segment (the UTC day) containing the timestamp."""
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y%m%d")
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+@dataclass
+class HistoryEvent:
+    """A presence transition of a host."""
+
+    timestamp: int
+    hostname: str
+    home: bool
+    access_point: str = ""
+
+
+# pylint: disable=too-few-public-methods
+class _HistoryStore:
+    """Common functionality of the history reader and writer.
+
+    The history is stored in a directory containing one segment file per UTC day
+    with fixed-size binary records. Every segment starts with snapshot records of
+    all hosts being home at the start of the segment, followed by the transition
+    events. Host and access point names are stored once in the names file as
+    JSON strings, one per line, and referenced by their line number. The ID
+    NO_NAME_ID is never assigned and marks records without an access point.
+    Once a segment is closed, an index file containing the IDs of all hosts that
+    were home during the segment is written.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        """Initialize this object."""
+        self._directory = directory
+        self._names: List[str] = []
+        self._name_ids: Dict[str, int] = {}
+        self._names_length = 0
+        names_filepath = self._directory / NAMES_FILE
+        if names_filepath.exists():
+            data = names_filepath.read_bytes()
+            # Only complete lines are valid, a partial last line is the result of an interrupted write
+            self._names_length = data.rfind(b"\n") + 1
+            self._names = [json.loads(line) for line in data[: self._names_length].decode("utf-8").splitlines()]
+            self._name_ids = {name: name_id for name_id, name in enumerate(self._names)}
+
+    def _get_name(self, name_id: int) -> str:
+        """Get the name of the given ID."""
+        return self._names[name_id] if name_id != NO_NAME_ID else ""
+
+    def _get_segments(self) -> List[Tuple[str, Path]]:
+        """Get all segments sorted by their day."""
+        if not self._directory.exists():
+            return []
+        return sorted((path.stem, path) for path in self._directory.glob(f"*{SEGMENT_SUFFIX}"))
+
+    @staticmethod
+    def _read_records(segment_path: Path) -> Iterator[Tuple[int, int, int, int]]:
+        """Read all records of a segment."""
+        data = segment_path.read_bytes()
+        usable_length = len(data) - len(data) % RECORD.size
+        return RECORD.iter_unpack(data[:usable_length])
+
+
+class HistoryWriter(_HistoryStore):
+    """Append-only writer of the presence history.
+
+    Transitions are collected by `record()` and written in one batch by `flush()`.
+    Segments older than the retention time are deleted.
+    """
+
+    def __init__(self, directory: Path, retention_days: int) -> None:
+        """Initialize this object."""
+        super().__init__(directory)
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._retention_days = retention_days
+        self._buffer: List[Tuple[int, int, int, int]] = []
+        self._new_names: List[str] = []
+        self._segment_day = ""
+        self._segment_states: Dict[int, Tuple[bool, int]] = {}
+        self._home_in_segment: Set[int] = set()
+        names_filepath = self._directory / NAMES_FILE
+        if names_filepath.exists() and names_filepath.stat().st_size != self._names_length:
+            LOGGER.warning("Dropping the incomplete last line of the history names file.")
+            with open(names_filepath, "r+b") as file_handle:
+                file_handle.truncate(self._names_length)
+
+        segments = self._get_segments()
+        if segments:
+            self._segment_day = segments[-1][0]
+            for _, host_id, ap_id, flags in self._read_records(segments[-1][1]):
+                self._segment_states[host_id] = (bool(flags & FLAG_HOME), ap_id)
+                if flags & FLAG_HOME:
+                    self._home_in_segment.add(host_id)
+        self._current = dict(self._segment_states)
+
+    def _get_name_id(self, name: str) -> int:
+        """Get the ID of the name and register it if required."""
+        if name not in self._name_ids:
+            self._name_ids[name] = len(self._names)
+            self._names.append(name)
+            self._new_names.append(name)
+        return self._name_ids[name]
+
+    def record(self, hostname: str, home: bool, access_point: str, timestamp: float) -> None:
+        """Record the state of a host. Only changes are added to the history."""
+        host_id = self._get_name_id(hostname)
+        ap_id = self._get_name_id(access_point) if home and access_point else NO_NAME_ID
+        if self._current.get(host_id, (False, NO_NAME_ID)) == (home, ap_id):
+            return
+        self._current[host_id] = (home, ap_id)
+        self._buffer.append((int(timestamp), host_id, ap_id, FLAG_HOME if home else 0))
+
+    def record_departures(self, hostnames: Iterable[str], timestamp: float) -> None:
+        """Record all hosts being home according to the history except the given ones as departed.
+
+        This covers hosts that disappeared from the lists of all routers.
+        """
+        present = {self._name_ids[hostname] for hostname in hostnames if hostname in self._name_ids}
+        for host_id, (home, _) in list(self._current.items()):
+            if home and host_id not in present:
+                self.record(self._names[host_id], False, "", timestamp)
+
+    def flush(self) -> None:
+        """Write all recorded changes to disc."""
+        if self._new_names:
+            with open(self._directory / NAMES_FILE, "a", encoding="utf-8") as file_handle:
+                file_handle.write("".join(f"{json.dumps(name)}\n" for name in self._new_names))
+            self._new_names = []
+        if not self._buffer:
+            return
+
+        data = bytearray()
+        for timestamp, host_id, ap_id, flags in self._buffer:
+            day = _get_segment_day(timestamp)
+            if day != self._segment_day:
+                self._write_segment(data)
+                data = self._start_segment(day, timestamp)
+            data += RECORD.pack(timestamp, host_id, ap_id, flags)
+            self._segment_states[host_id] = (bool(flags & FLAG_HOME), ap_id)
+            if flags & FLAG_HOME:
+                self._home_in_segment.add(host_id)
+        self._write_segment(data)
+        LOGGER.debug("Wrote %d history record(s).", len(self._buffer))
+        self._buffer = []
+
+    def _write_segment(self, data: bytearray) -> None:
+        """Append the data to the current segment."""
+        if data:
+            with open(self._directory / f"{self._segment_day}{SEGMENT_SUFFIX}", "ab") as file_handle:
+                file_handle.write(data)
+
+    def _start_segment(self, day: str, timestamp: int) -> bytearray:
+        """Close the current segment and get the snapshot records starting the new one."""
+        if self._segment_day:
+            index = b"".join(INDEX_ENTRY.pack(host_id) for host_id in sorted(self._home_in_segment))
+            (self._directory / f"{self._segment_day}{INDEX_SUFFIX}").write_bytes(index)
+        self._segment_day = day
+        self._segment_states = {host_id: state for host_id, state in self._segment_states.items() if state[0]}
+        self._home_in_segment = set(self._segment_states)
+        self._apply_retention(day)
+
+        data = bytearray()
+        for host_id, (_, ap_id) in self._segment_states.items():
+            data += RECORD.pack(timestamp, host_id, ap_id, FLAG_HOME | FLAG_SNAPSHOT)
+        return data
+
+    def _apply_retention(self, day: str) -> None:
+        """Delete all segments older than the retention time."""
+        if self._retention_days <= 0:
+            return
+        oldest_day = (datetime.strptime(day, "%Y%m%d") - timedelta(days=self._retention_days)).strftime("%Y%m%d")
+        for segment_day, segment_path in self._get_segments():
+            if segment_day < oldest_day:
+                LOGGER.debug("Deleting history segment %s.", segment_path)
+                segment_path.unlink()
+                index_path = segment_path.with_suffix(INDEX_SUFFIX)
+                if index_path.exists():
+                    index_path.unlink()
+
+
+class HistoryReader(_HistoryStore):
+    """Query interface of the presence history."""
+
+    def who_was_home(self, start: datetime, end: datetime) -> List[str]:
+        """Get the hosts that were home at any time between start and end."""
+        start_ts = int(start.timestamp())
+        end_ts = int(end.timestamp())
+        start_day = _get_segment_day(start_ts)
+        end_day = _get_segment_day(end_ts)
+        segments = self._get_segments()
+
+        # The first segment to consider is the last one starting before the start
+        first = 0
+        for position, (day, _) in enumerate(segments):
+            if day <= start_day:
+                first = position
+
+        home: Set[int] = set()
+        for day, segment_path in segments[first:]:
+            if day > end_day:
+                break
+            index_path = segment_path.with_suffix(INDEX_SUFFIX)
+            if start_day < day < end_day and index_path.exists():
+                home.update(host_id for (host_id,) in INDEX_ENTRY.iter_unpack(index_path.read_bytes()))
+                continue
+            home.update(self._scan_segment(segment_path, start_ts, end_ts))
+        return sorted(self._get_name(host_id) for host_id in home)
+
+    def _scan_segment(self, segment_path: Path, start_ts: int, end_ts: int) -> Set[int]:
+        """Get the hosts being home between start and end according to a single segment."""
+        states: Dict[int, bool] = {}
+        home: Set[int] = set()
+        reached_start = False
+        for timestamp, host_id, _, flags in self._read_records(segment_path):
+            if timestamp > end_ts:
+                break
+            if timestamp >= start_ts and not reached_start:
+                # Hosts being home at the start of the period
+                home.update(state_host_id for state_host_id, is_home in states.items() if is_home)
+                reached_start = True
+            states[host_id] = bool(flags & FLAG_HOME)
+            if reached_start and states[host_id]:
+                home.add(host_id)
+        if not reached_start:
+            # The segment ended before the start of the period
+            home.update(host_id for host_id, is_home in states.items() if is_home)
+        return home
+
+    def get_events(self, start: datetime, end: datetime, hostname: Optional[str] = None) -> Iterator[HistoryEvent]:
+        """Get all transitions between start and end, optionally only of a single host."""
+        start_ts = int(start.timestamp())
+        end_ts = int(end.timestamp())
+        host_id = self._name_ids.get(hostname, -1) if hostname else None
+        for day, segment_path in self._get_segments():
+            if day < _get_segment_day(start_ts) or day > _get_segment_day(end_ts):
+                continue
+            for timestamp, record_host_id, ap_id, flags in self._read_records(segment_path):
+                if flags & FLAG_SNAPSHOT or not start_ts <= timestamp <= end_ts:
+                    continue
+                if host_id is not None and record_host_id != host_id:
+                    continue
+                home = bool(flags & FLAG_HOME)
+                yield HistoryEvent(
+                    timestamp=timestamp,
+                    hostname=self._get_name(record_host_id),
+                    home=home,
+                    access_point=self._get_name(ap_id) if home else "",
+                )
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
@@ -0,0 +1,112 @@
+"""
+Host filter of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import ipaddress
+import logging
+import re
+from fnmatch import translate
+from typing import Dict, List, Optional, Pattern, Union
+
+from .config import HostFilterConfig
+from .mac import parse_mac_prefix
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+LOGGER = logging.getLogger(__name__)
+RULE_KEYS = {"mac", "name", "name_regex", "interface_type", "ip"}
+PC_HOSTS_RULE = {"name": "PC-*"}
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+# pylint: disable=too-few-public-methods
+class FilterRule:
+    """A compiled include or exclude rule.
+
+    A rule consists of the optional criteria `mac` (a prefix of the MAC
+    address), `name` (a glob pattern of the host name), `name_regex` (a regular
+    expression matching the host name), `interface_type` (e.g., `802.11` or
+    `Ethernet`) and `ip` (an IP address or network, e.g., `192.168.1.0/24`).
+    A host matches the rule if all given criteria match.
+    """
+
+    def __init__(self, rule: Dict[str, str]) -> None:
+        """Compile the rule given as dictionary of the configuration."""
+        unknown_keys = set(rule) - RULE_KEYS
+        if unknown_keys:
+            raise ValueError(f"Unknown key(s) {', '.join(sorted(unknown_keys))} in host filter rule {rule}!")
+        self._description = str(rule)
+        self._mac_value, self._mac_mask = parse_mac_prefix(rule.get("mac", ""))
+        self._name_patterns: List[Pattern] = []
+        if "name" in rule:
+            self._name_patterns.append(re.compile(translate(rule["name"])))
+        if "name_regex" in rule:
+            self._name_patterns.append(re.compile(rule["name_regex"]))
+        self._interface_type = rule.get("interface_type")
+        self._network: Optional[Union[ipaddress.IPv4Network, ipaddress.IPv6Network]] = None
+        if "ip" in rule:
+            self._network = ipaddress.ip_network(rule["ip"], strict=False)
+
+    def matches(self, mac: int, name: str, interface_type: str, ip_address: str) -> bool:
+        """Returns True if the host matches all criteria of this rule."""
+        if mac & self._mac_mask != self._mac_value:
+            return False
+        if self._interface_type is not None and interface_type != self._interface_type:
+            return False
+        if any(not pattern.match(name) for pattern in self._name_patterns):
+            return False
+        if self._network is not None:
+            try:
+                if ipaddress.ip_address(ip_address) not in self._network:
+                    return False
+            except ValueError:
+                return False
+        return True
+
+    def __str__(self) -> str:
+        """Return the string representation of this object."""
+        return self._description
+
+
+class HostFilter:
+    """The compiled include and exclude rules of the configuration.
+
+    If include rules are given, a host must match at least one of them. A host
+    matching any exclude rule is always dropped. Unless disabled, the hosts
+    named `PC-*` by the Fritz!Box are excluded in addition to the configured
+    rules. The rules are compiled once when this object is created.
+    """
+
+    def __init__(self, config: HostFilterConfig) -> None:
+        """Initialize this object."""
+        self._include = [FilterRule(rule) for rule in config.include]
+        self._exclude = [FilterRule(rule) for rule in config.exclude]
+        if config.exclude_pc_hosts:
+            self._exclude.append(FilterRule(PC_HOSTS_RULE))
+
+    def accepts(self, mac: int, name: str, interface_type: str, ip_address: str) -> bool:
+        """Returns True if the host passes the filter."""
+        if self._include and not any(rule.matches(mac, name, interface_type, ip_address) for rule in self._include):
+            return False
+        return not any(rule.matches(mac, name, interface_type, ip_address) for rule in self._exclude)
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
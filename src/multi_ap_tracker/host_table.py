@@ -0,0 +1,122 @@
+"""
+Parallel enumeration of the host table of a router of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Sequence, Tuple
+
+from fritzconnection.lib.fritzhosts import FritzHosts
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+LOGGER = logging.getLogger(__name__)
+HOST_ENTRY_KEYS = {
+    "ip": "NewIPAddress",
+    "name": "NewHostName",
+    "mac": "NewMACAddress",
+    "status": "NewActive",
+    "interface_type": "NewInterfaceType",
+    "address_source": "NewAddressSource",
+    "lease_time_remaining": "NewLeaseTimeRemaining",
+}
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+def split_index_range(num_entries: int, num_parts: int) -> List[Tuple[int, int]]:
+    """Split the indices `0..num_entries-1` into at most `num_parts` contiguous ranges of similar size."""
+    num_parts = max(1, min(num_parts, num_entries))
+    size, remainder = divmod(num_entries, num_parts)
+    ranges = []
+    start = 0
+    for part in range(num_parts):
+        end = start + size + (1 if part < remainder else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def get_host_entries(session: Any, start: int, end: int) -> List[Dict[str, Any]]:
+    """Get the host entries of the index range `start..end-1` using a single session.
+
+    The entries are converted into the format of `FritzHosts.get_hosts_info()`.
+    If the host table shrank in the meantime, the remaining entries are skipped.
+    """
+    hosts = []
+    for index in range(start, end):
+        try:
+            entry = session.get_generic_host_entry(index)
+        except IndexError:
+            break
+        hosts.append({key: entry[action_key] for key, action_key in HOST_ENTRY_KEYS.items()})
+    return hosts
+
+
+def get_hosts_info_parallel(sessions: Sequence[Any]) -> List[Dict[str, Any]]:
+    """Get the host entries of a router using several sessions concurrently.
+
+    The sessions are objects providing `host_numbers` and
+    `get_generic_host_entry()` like FritzHosts, each using its own connection
+    to the same router. The index range of the host table is split into one
+    contiguous range per session and the results are concatenated in the order
+    of the indices.
+    """
+    ranges = split_index_range(sessions[0].host_numbers, len(sessions))
+    if len(ranges) == 1:
+        return get_host_entries(sessions[0], *ranges[0])
+    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        futures = [
+            executor.submit(get_host_entries, session, start, end) for session, (start, end) in zip(sessions, ranges)
+        ]
+        return [host for future in futures for host in future.result()]
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+class ParallelFritzHosts(FritzHosts):
+    """FritzHosts enumerating the host table using several concurrent sessions.
+
+    Besides the connection of this object, `parallelism - 1` additional
+    connections to the same router are created. The host table is enumerated by
+    `get_hosts_info_parallel()` using all connections. The parallelism caps the
+    number of concurrent requests to protect the CPU of the router. The
+    `parallelism` attribute can be lowered to use fewer of the connections.
+
+    If the description cache is used, the additional connections load the
+    descriptions verified by the first connection without verifying them again.
+    """
+
+    def __init__(self, parallelism: int, **kwargs) -> None:
+        """Initialize this object using the keyword arguments of FritzHosts."""
+        super().__init__(**kwargs)
+        if kwargs.get("use_cache"):
+            kwargs["verify_cache"] = False
+        self.parallelism = parallelism
+        self._sessions: List[FritzHosts] = [self]
+        self._sessions += [FritzHosts(**kwargs) for _ in range(parallelism - 1)]
+
+    def get_hosts_info(self) -> List[Dict[str, Any]]:
+        """Get the host entries of the router."""
+        return get_hosts_info_parallel(self._sessions[: max(1, self.parallelism)])
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
@@ -0,0 +1,122 @@
+"""
+Host identity index of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import logging
+import sys
+from typing import Any, Dict, Optional, Tuple
+
+from .mac import format_mac, is_locally_administered, load_mac_table
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+LOGGER = logging.getLogger(__name__)
+PLACEHOLDER_PREFIX = "PC-"
+TRUNCATED_NAME_LENGTH = 15
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+class HostIdentityIndex:
+    """Persistent mapping of MAC addresses to host identities (the host names).
+
+    The routers report a name per MAC address, which can be a placeholder
+    (`PC-...`) or truncated to 15 characters. The best name per MAC is resolved
+    by these heuristics only when a router reports a new raw name for a MAC;
+    as long as the router reports the same raw name, a lookup is a single
+    dictionary access. The name can also be looked up without recording the
+    reported name, e.g., to filter hosts. A truncated name is also resolved to the full name of
+    another MAC, so that a device using a new randomized MAC address keeps its
+    identity.
+
+    The mapping is stored in the `MacToDeviceNames` entry of the state, keyed
+    by the MAC addresses as integers. The names are interned, as many MAC
+    addresses share the same name. The `dirty` flag indicates that the mapping
+    changed since the last save.
+    """
+
+    def __init__(self, state_data: Dict[str, Any]) -> None:
+        """Initialize this object."""
+        self._names, self.dirty = load_mac_table(state_data, "MacToDeviceNames")
+        self._raw_names: Dict[Tuple[int, str], str] = {}
+        self._full_names: Dict[str, str] = {}
+        for mac, name in self._names.items():
+            self._names[mac] = sys.intern(name)
+            self._add_full_name(name)
+
+    def _add_full_name(self, name: str) -> None:
+        """Register the name for resolving truncated names."""
+        if len(name) > TRUNCATED_NAME_LENGTH:
+            prefix = name[:TRUNCATED_NAME_LENGTH]
+            if len(name) > len(self._full_names.get(prefix, "")):
+                self._full_names[prefix] = name
+
+    def lookup(self, mac: int, raw_name: str, router_name: str) -> str:
+        """Get the host name `resolve()` would return, without recording the name reported by the router."""
+        if self._raw_names.get((mac, router_name)) == raw_name:
+            return self._names[mac]
+        return self._get_name(mac, raw_name)
+
+    def resolve(self, mac: int, raw_name: str, router_name: str) -> str:
+        """Get the host name of the MAC address given the name reported by a router."""
+        key = (mac, router_name)
+        if self._raw_names.get(key) == raw_name:
+            return self._names[mac]
+        self._raw_names[key] = raw_name
+
+        name = self._names.get(mac)
+        new_name = self._get_name(mac, raw_name)
+        if new_name != name:
+            LOGGER.debug(
+                "Host name of %s MAC %s is now %s.",
+                "randomized" if is_locally_administered(mac) else "global",
+                format_mac(mac),
+                new_name,
+            )
+            self._names[mac] = sys.intern(new_name)
+            self._add_full_name(new_name)
+            self.dirty = True
+        return self._names[mac]
+
+    def _get_name(self, mac: int, raw_name: str) -> str:
+        """Get the host name of the MAC address given the name reported by a router, without the fast path."""
+        name = self._names.get(mac)
+        new_name = self._get_better_name(name, raw_name)
+        if new_name != name and len(new_name) == TRUNCATED_NAME_LENGTH and new_name in self._full_names:
+            new_name = self._full_names[new_name]
+        return new_name
+
+    @staticmethod
+    def _get_better_name(name: Optional[str], raw_name: str) -> str:
+        """Get the better of the current name of a MAC and the raw name reported by a router."""
+        if name is None:
+            return raw_name
+        if raw_name.startswith(PLACEHOLDER_PREFIX):
+            return name
+        if name.startswith(PLACEHOLDER_PREFIX):
+            return raw_name
+        if raw_name[:TRUNCATED_NAME_LENGTH] != name[:TRUNCATED_NAME_LENGTH]:
+            return raw_name
+        if len(raw_name) > len(name):
+            return raw_name
+        return name
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
@@ -0,0 +1,90 @@
+"""
+MAC address handling of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import logging
+from typing import Any, Dict, Tuple
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+LOGGER = logging.getLogger(__name__)
+MAC_DIGITS = 12
+MAC_SEPARATORS = str.maketrans("", "", ":-.")
+LOCALLY_ADMINISTERED_BIT = 1 << 41
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+def parse_mac(text: str) -> int:
+    """Parse a MAC address like `AA:BB:CC:DD:EE:FF` into an integer.
+
+    Raises a ValueError if the text is not a MAC address.
+    """
+    digits = text.translate(MAC_SEPARATORS)
+    if len(digits) != MAC_DIGITS:
+        raise ValueError(f"Invalid MAC address {text}!")
+    return int(digits, 16)
+
+
+def format_mac(mac: int) -> str:
+    """Format a MAC address given as integer as `AA:BB:CC:DD:EE:FF`."""
+    return ":".join(f"{(mac >> shift) & 0xFF:02X}" for shift in range(40, -8, -8))
+
+
+def parse_mac_prefix(text: str) -> Tuple[int, int]:
+    """Parse the prefix of a MAC address like `B8:27:EB` into the value and the mask to match it.
+
+    The prefix can end in the middle of a byte, e.g., `B8:2`.
+    """
+    digits = text.translate(MAC_SEPARATORS)
+    if len(digits) > MAC_DIGITS:
+        raise ValueError(f"Invalid MAC address prefix {text}!")
+    if not digits:
+        return 0, 0
+    shift = 4 * (MAC_DIGITS - len(digits))
+    return int(digits, 16) << shift, ((1 << (4 * len(digits))) - 1) << shift
+
+
+def is_locally_administered(mac: int) -> bool:
+    """Returns True if the MAC address is locally administered, e.g., a randomized one."""
+    return bool(mac & LOCALLY_ADMINISTERED_BIT)
+
+
+def load_mac_table(state_data: Dict[str, Any], key: str) -> Tuple[Dict[int, Any], bool]:
+    """Get the table of the state keyed by MAC addresses, migrating string keys to integers.
+
+    Former versions stored the MAC addresses as strings. Such keys are
+    converted in place, invalid ones are dropped. Returns the table and True if
+    it was converted.
+    """
+    table = state_data.setdefault(key, {})
+    string_keys = [mac for mac in table if isinstance(mac, str)]
+    if string_keys:
+        LOGGER.info("Converting %d MAC address(es) of the %s state entry to integers.", len(string_keys), key)
+        for mac in string_keys:
+            value = table.pop(mac)
+            try:
+                table[parse_mac(mac)] = value
+            except ValueError:
+                LOGGER.warning("Dropping invalid MAC address %s of the %s state entry.", mac, key)
+    return table, bool(string_keys)
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
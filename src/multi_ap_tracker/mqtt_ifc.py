@@ -18,13 +18,17 @@ import json
 # Module Import
 # -----------------------------------------------------------------------------
 import logging
+import os
+import socket
 import time
 from hashlib import md5
-from typing import Any, Callable, Dict, Optional
+from threading import Event
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import paho.mqtt.client as mqtt
 
-from .config import Config
+from .config import Config, Mqtt
+from .roaming import RoamingEvent
 
 # -----------------------------------------------------------------------------
 # Module Variables
@@ -32,44 +36,121 @@ from .config import Config
 LOGGER = logging.getLogger(__name__)
 
 
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+def get_client_id(mqtt_config: Mqtt) -> str:
+    """Get the MQTT client ID of this process.
+
+    Unless configured explicitly, the client ID is unique for every process, so
+    that multiple instances do not kick each other off the broker.
+    """
+    return mqtt_config.client_id or f"ha_multi_ap_tracker-{socket.gethostname()}-{os.getpid()}"
+
+
 # -----------------------------------------------------------------------------
 # Classes
 # -----------------------------------------------------------------------------
+# pylint: disable=too-many-instance-attributes,too-many-public-methods
 class MqttInterface:
     """The interface to the MQTT broker."""
 
-    def __init__(self, config: Config, ha_state_callback: Optional[Callable] = None) -> None:
-        """Initialize this object."""
+    def __init__(
+        self,
+        config: Config,
+        ha_state_callback: Optional[Callable] = None,
+        will: Optional[Tuple[str, str]] = None,
+        keepalive: int = 60,
+        dry_run: bool = False,
+    ) -> None:
+        """Initialize this object.
+
+        The optional `will` is a tuple of topic and payload of a retained message
+        the broker publishes if the connection to this client is lost. In the
+        `dry_run` mode, no connection to the broker is established and all
+        messages are only logged.
+        """
         LOGGER.debug("Create MQTT client.")
+        self._dry_run = dry_run
         self._mqtt_config = config.mqtt
+        self._roaming_config = config.roaming
+        self._snapshot_config = config.snapshot
+        self._attributes: Dict[str, Dict[str, Any]] = {}
         self.ha_state = "online"
         self._ha_state_callback: Optional[Callable] = ha_state_callback
-        self._client = mqtt.Client("ha_multi_ap_tracker")
+        self._subscriptions: Dict[str, int] = {}
+        self._connect_callbacks: List[Callable[[], None]] = []
+        self._client = mqtt.Client(get_client_id(config.mqtt))
         self._client.username_pw_set(config.mqtt.username, config.mqtt.password)
         self._client.on_connect = self._on_connect
+        if will:
+            self._client.will_set(will[0], will[1], qos=1, retain=True)
         if self._mqtt_config.ha_state_topic:
             self._client.message_callback_add(self._mqtt_config.ha_state_topic, self._on_ha_status_message)
-        self._client.connect_async(config.mqtt.address, config.mqtt.port)
+            self._subscriptions[self._mqtt_config.ha_state_topic] = 2
+        if dry_run:
+            LOGGER.info("Dry run, no messages are published to the MQTT broker.")
+            return
+        self._client.connect_async(config.mqtt.address, config.mqtt.port, keepalive)
         self._client.loop_start()
         time.sleep(1)
 
     def close(self) -> None:
         """Close the connection to the broker."""
+        if self._dry_run:
+            return
         LOGGER.debug("Closing MQTT connection.")
         self._client.loop_stop()
         self._client.disconnect()
 
+    def update_topics(self, config: Config) -> None:
+        """Apply the changed roaming and snapshot settings, which do not require a new connection."""
+        self._roaming_config = config.roaming
+        self._snapshot_config = config.snapshot
+
+    @property
+    def attributes(self) -> Dict[str, Dict[str, Any]]:
+        """The cached attributes of the hosts used by the single topic mode."""
+        return self._attributes
+
+    def take_over_attributes(self, other: "MqttInterface") -> None:
+        """Take over the cached attributes of the single topic mode from the interface replaced by this one."""
+        self._attributes = other.attributes
+
     def _on_connect(self, _client, _userdata, _flags, _rc):
         LOGGER.debug("MQTT Client connected to broker.")
-        if self._mqtt_config.ha_state_topic:
-            LOGGER.debug("Subscribing to topic %s.", self._mqtt_config.ha_state_topic)
-            res, _ = self._client.subscribe(self._mqtt_config.ha_state_topic, 2)
+        for topic, qos in self._subscriptions.items():
+            LOGGER.debug("Subscribing to topic %s.", topic)
+            res, _ = self._client.subscribe(topic, qos)
             if res == mqtt.MQTT_ERR_NO_CONN:
                 LOGGER.error("Subscription failed due to no connection to the broker.")
             elif res != mqtt.MQTT_ERR_SUCCESS:
                 LOGGER.error("Subscription failed due to unknown error.")
             else:
                 LOGGER.debug("Subscription succeeded.")
+        for callback in self._connect_callbacks:
+            callback()
+
+    def add_connect_callback(self, callback: Callable[[], None]) -> None:
+        """Add a callback called whenever the connection to the broker is (re-)established."""
+        self._connect_callbacks.append(callback)
+        if self._client.is_connected():
+            callback()
+
+    def subscribe(self, topic: str, callback: Callable, qos: int = 1) -> None:
+        """Subscribe to the topic and call the callback for every message received on it.
+
+        The subscription is renewed whenever the connection to the broker is
+        re-established.
+        """
+        self._client.message_callback_add(topic, callback)
+        self._subscriptions[topic] = qos
+        if self._client.is_connected():
+            self._client.subscribe(topic, qos)
+
+    def publish(self, topic: str, payload: str, qos: int = 0, retain: bool = False) -> mqtt.MQTTMessageInfo:
+        """Publish a message on an arbitrary topic."""
+        return self._publish(topic, payload, qos, retain)
 
     def _on_ha_status_message(self, _client, _userdata, message) -> None:
         """Callback called when the home-assistant state changed."""
@@ -78,36 +159,103 @@ class MqttInterface:
         if self._ha_state_callback:
             self._ha_state_callback(message.payload.decode() == "online")
 
+    def get_config_topic_filter(self) -> str:
+        """Get the topic filter matching the configuration messages of all our device trackers."""
+        return self._get_config_topic("+")
+
+    def get_state_topic_filter(self) -> str:
+        """Get the topic filter matching the state messages of all our device trackers."""
+        return self._get_state_topic("+")
+
     def _get_object_id(self, hostname: str) -> str:
         """Get the object ID for the given hostname."""
         return md5(hostname.encode("utf-8")).hexdigest()
 
-    def _get_config_topic(self, object_id: str) -> str:
+    def _get_config_topic(self, object_id: str, component: str = "device_tracker") -> str:
         """Get the topic for configuration messages."""
-        topic = f"{self._mqtt_config.discovery_prefix}/device_tracker/"
+        topic = f"{self._mqtt_config.discovery_prefix}/{component}/"
         if self._mqtt_config.node_id:
             topic += f"{self._mqtt_config.node_id}/"
         topic += f"{object_id}/config"
         return topic
 
-    def _get_state_topic(self, object_id: str) -> str:
-        """Get the topic for state messages."""
+    def _get_state_topic(self, object_id: str, component: str = "device_tracker") -> str:
+        """Get the topic for state messages.
+
+        The topics of components other than device trackers contain the
+        component, so that they never collide with the ones of the device trackers.
+        """
         topic = ""
         if self._mqtt_config.node_id:
             topic = f"{self._mqtt_config.node_id}/"
+        if component != "device_tracker":
+            topic += f"{component}/"
         topic += f"{object_id}/state"
         return topic
 
-    def _get_attributes_topic(self, object_id: str) -> str:
+    def _get_attributes_topic(self, object_id: str, component: str = "device_tracker") -> str:
         """Get the topic for attributes messages."""
         topic = ""
         if self._mqtt_config.node_id:
             topic = f"{self._mqtt_config.node_id}/"
+        if component != "device_tracker":
+            topic += f"{component}/"
         topic += f"{object_id}/attributes"
         return topic
 
+    def _get_ap_object_id(self, access_point: str) -> str:
+        """Get the object ID of the occupancy sensor of an access point."""
+        return md5(f"ap:{access_point}".encode("utf-8")).hexdigest()
+
+    def _get_roaming_topic(self) -> str:
+        """Get the topic for roaming events."""
+        if self._roaming_config.events_topic:
+            return self._roaming_config.events_topic
+        return f"{self._mqtt_config.node_id or 'ha_multi_ap_tracker'}/roaming"
+
+    def _get_snapshot_topic(self) -> str:
+        """Get the topic for the snapshot of all hosts."""
+        if self._snapshot_config.topic:
+            return self._snapshot_config.topic
+        return f"{self._mqtt_config.node_id or 'ha_multi_ap_tracker'}/snapshot"
+
+    def _get_snapshot_diff_topic(self) -> str:
+        """Get the topic for the diffs of the snapshot."""
+        if self._snapshot_config.diff_topic:
+            return self._snapshot_config.diff_topic
+        return f"{self._get_snapshot_topic()}/diff"
+
+    def _publish(self, topic: str, payload: str, qos: int = 0, retain: bool = False) -> mqtt.MQTTMessageInfo:
+        """Publish a message and log errors."""
+        if self._dry_run:
+            LOGGER.debug("Dry run, not publishing on topic %s: %s", topic, payload)
+            info = mqtt.MQTTMessageInfo(0)
+            info._set_as_published()  # pylint: disable=protected-access
+            return info
+        ret = self._client.publish(topic, payload, qos=qos, retain=retain)
+        if ret.rc == mqtt.MQTT_ERR_NO_CONN:
+            LOGGER.error("Mqtt Client is not connected!")
+        elif ret.rc == mqtt.MQTT_ERR_QUEUE_SIZE:
+            LOGGER.error("Mqtt Client queue size exceeded!")
+        return ret
+
+    def get_object_id(self, hostname: str) -> str:
+        """Get the object ID of the device tracker for the given hostname."""
+        return self._get_object_id(hostname)
+
+    def get_ap_object_id(self, access_point: str) -> str:
+        """Get the object ID of the occupancy sensor of the given access point."""
+        return self._get_ap_object_id(access_point)
+
     def create_device_tracker(self, hostname: str) -> None:
-        """Publish a configuration message to create the device tracker."""
+        """Publish a configuration message to create the device tracker.
+
+        The configuration message is retained, so that home-assistant finds it
+        after a restart and orphaned configurations can be found by
+        `collect_configs()`. In the single topic mode, the state
+        and the attributes are extracted by templates from the JSON messages on
+        the state topic.
+        """
         object_id = self._get_object_id(hostname)
         topic = self._get_config_topic(object_id)
         data = {
@@ -118,42 +266,206 @@ class MqttInterface:
             "payload_home": "home",
             "payload_not_home": "not_home",
         }
+        if self._mqtt_config.single_topic:
+            data["json_attributes_topic"] = data["state_topic"]
+            data["value_template"] = "{{ value_json.state }}"
+            data["json_attributes_template"] = "{{ value_json.attributes | tojson }}"
         LOGGER.debug("Create new device tracker by sending MQTT configuration message on topic %s.", topic)
-        ret = self._client.publish(topic, json.dumps(data))
-        if ret.rc == mqtt.MQTT_ERR_NO_CONN:
-            LOGGER.error("Mqtt Client is not connected!")
-        elif ret.rc == mqtt.MQTT_ERR_QUEUE_SIZE:
-            LOGGER.error("Mqtt Client queue size exceeded!")
+        self._publish(topic, json.dumps(data), retain=True)
 
     def update_device_tracker(self, hostname: str, state: str) -> None:
-        """Publish a state message of the device tracker."""
+        """Publish a state message of the device tracker.
+
+        In the single topic mode, the last published attributes are sent along
+        with the state.
+        """
+        if self._mqtt_config.single_topic:
+            self._publish_state_and_attributes(hostname, state, self._attributes.get(hostname, {}))
+            return
         object_id = self._get_object_id(hostname)
         topic = self._get_state_topic(object_id)
         LOGGER.debug("Send device tracker state %s on topic %s.", state, topic)
-        ret = self._client.publish(topic, state)
-        if ret.rc == mqtt.MQTT_ERR_NO_CONN:
-            LOGGER.error("Mqtt Client is not connected!")
-        elif ret.rc == mqtt.MQTT_ERR_QUEUE_SIZE:
-            LOGGER.error("Mqtt Client queue size exceeded!")
+        self._publish(topic, state)
+
+    def update_device_tracker_state_and_attributes(
+        self, hostname: str, state: Optional[str], attributes: Dict[str, Any]
+    ) -> None:
+        """Publish the state (if given) and the attributes of the device tracker.
+
+        In the single topic mode, both are sent in a single JSON message on the
+        state topic. The state is required in this mode.
+        """
+        if self._mqtt_config.single_topic:
+            assert state is not None
+            self._attributes[hostname] = attributes
+            self._publish_state_and_attributes(hostname, state, attributes)
+            return
+        if state is not None:
+            self.update_device_tracker(hostname, state)
+        self.update_device_tracker_attributes(hostname, attributes)
+
+    def _publish_state_and_attributes(self, hostname: str, state: str, attributes: Dict[str, Any]) -> None:
+        """Publish the combined state and attributes message of the single topic mode."""
+        object_id = self._get_object_id(hostname)
+        topic = self._get_state_topic(object_id)
+        LOGGER.debug("Send device tracker state %s and attributes for host %s on topic %s.", state, hostname, topic)
+        self._publish(topic, json.dumps({"state": state, "attributes": attributes}))
 
     def update_device_tracker_attributes(self, hostname: str, attributes: Dict[str, Any]) -> None:
         """Publish an attributes message of the device tracker."""
         object_id = self._get_object_id(hostname)
         topic = self._get_attributes_topic(object_id)
         LOGGER.debug("Send device tracker attributes for host %s on topic %s.", hostname, topic)
-        ret = self._client.publish(topic, json.dumps(attributes))
-        if ret.rc == mqtt.MQTT_ERR_NO_CONN:
-            LOGGER.error("Mqtt Client is not connected!")
-        elif ret.rc == mqtt.MQTT_ERR_QUEUE_SIZE:
-            LOGGER.error("Mqtt Client queue size exceeded!")
+        self._publish(topic, json.dumps(attributes))
 
     def delete_device_tracker(self, hostname: str) -> None:
         """Publish a configuration message to delete the device tracker."""
         object_id = self._get_object_id(hostname)
         topic = self._get_config_topic(object_id)
         LOGGER.debug("Delete device tracker by sending MQTT configuration message on topic %s.", topic)
-        ret = self._client.publish(topic, "")
-        if ret.rc == mqtt.MQTT_ERR_NO_CONN:
-            LOGGER.error("Mqtt Client is not connected!")
-        elif ret.rc == mqtt.MQTT_ERR_QUEUE_SIZE:
-            LOGGER.error("Mqtt Client queue size exceeded!")
+        self._publish(topic, "", retain=True)
+
+    def create_ap_sensor(self, access_point: str) -> None:
+        """Publish a retained configuration message to create the occupancy sensor of an access point."""
+        object_id = self._get_ap_object_id(access_point)
+        topic = self._get_config_topic(object_id, "sensor")
+        data = {
+            "state_topic": self._get_state_topic(object_id, "sensor"),
+            "json_attributes_topic": self._get_attributes_topic(object_id, "sensor"),
+            "name": f"{self._mqtt_config.name_prefix}{access_point} clients",
+            "unique_id": object_id,
+            "unit_of_measurement": "clients",
+            "state_class": "measurement",
+            "icon": "mdi:access-point-network",
+        }
+        LOGGER.debug("Create occupancy sensor of access point %s on topic %s.", access_point, topic)
+        self._publish(topic, json.dumps(data), retain=True)
+
+    def update_ap_sensor(self, access_point: str, hostnames: List[str]) -> None:
+        """Publish the number of clients and the connected hosts of an access point."""
+        object_id = self._get_ap_object_id(access_point)
+        LOGGER.debug("Send %d client(s) of access point %s.", len(hostnames), access_point)
+        self._publish(self._get_state_topic(object_id, "sensor"), str(len(hostnames)), retain=True)
+        self._publish(self._get_attributes_topic(object_id, "sensor"), json.dumps({"hosts": hostnames}), retain=True)
+
+    def publish_roaming_event(self, event: RoamingEvent) -> None:
+        """Publish a roaming event."""
+        topic = self._get_roaming_topic()
+        LOGGER.debug("Send roaming event of host %s on topic %s.", event.hostname, topic)
+        self._publish(
+            topic,
+            json.dumps(
+                {"host": event.hostname, "from": event.from_ap, "to": event.to_ap, "timestamp": event.timestamp}
+            ),
+            qos=1,
+        )
+
+    def publish_snapshot(self, snapshot: Dict[str, Any], diff: Dict[str, Any]) -> None:
+        """Publish the diff of a cycle and the retained snapshot of all hosts as compact JSON messages."""
+        diff_topic = self._get_snapshot_diff_topic()
+        LOGGER.debug("Send snapshot diff version %d on topic %s.", diff["version"], diff_topic)
+        self._publish(diff_topic, json.dumps(diff, separators=(",", ":")), qos=1)
+        self._publish(self._get_snapshot_topic(), json.dumps(snapshot, separators=(",", ":")), qos=1, retain=True)
+
+    def delete_snapshot(self) -> None:
+        """Delete the retained snapshot of all hosts."""
+        self._publish(self._get_snapshot_topic(), "", qos=1, retain=True)
+
+    def delete_device_trackers(self, object_ids: List[str], timeout: float = 10.0) -> int:
+        """Delete the device trackers of the given object IDs in one batch.
+
+        All delete messages are published with QoS 1 first, then the
+        acknowledgements of the broker are awaited. Returns the number of
+        acknowledged deletions.
+        """
+        LOGGER.debug("Delete %d device tracker(s) in one batch.", len(object_ids))
+        infos = [self._publish(self._get_config_topic(object_id), "", qos=1, retain=True) for object_id in object_ids]
+        return self._wait_for_publish(infos, timeout)
+
+    def delete_ap_sensors(self, object_ids: List[str], timeout: float = 10.0) -> int:
+        """Delete the occupancy sensors of the given object IDs and their retained states in one batch.
+
+        Returns the number of acknowledged deletions of the configurations.
+        """
+        LOGGER.debug("Delete %d access point sensor(s) in one batch.", len(object_ids))
+        infos = []
+        for object_id in object_ids:
+            infos.append(self._publish(self._get_config_topic(object_id, "sensor"), "", qos=1, retain=True))
+            self._publish(self._get_state_topic(object_id, "sensor"), "", qos=1, retain=True)
+            self._publish(self._get_attributes_topic(object_id, "sensor"), "", qos=1, retain=True)
+        return self._wait_for_publish(infos, timeout)
+
+    @staticmethod
+    def _wait_for_publish(infos: List[mqtt.MQTTMessageInfo], timeout: float) -> int:
+        """Wait for the acknowledgements of the given messages and return the number of acknowledged ones."""
+        deadline = time.monotonic() + timeout
+        acknowledged = 0
+        for info in infos:
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                continue
+            try:
+                info.wait_for_publish(max(0.0, deadline - time.monotonic()))
+            except RuntimeError:
+                continue
+            if info.is_published():
+                acknowledged += 1
+        return acknowledged
+
+    def collect_configs(
+        self, components: List[str], quiet_time: float = 2.0, timeout: float = 30.0
+    ) -> Dict[str, Dict[str, str]]:
+        """Collect all retained configurations of the given components below our node ID.
+
+        A separate connection to the broker is used, so that the subscriptions
+        of this interface, e.g., the ones of the leader election on the same
+        topics, are not affected. The retained messages are delivered by the
+        broker right after the subscription. The collection ends if no message
+        was received for `quiet_time` seconds or after `timeout` seconds.
+        Returns a dictionary mapping each component to a dictionary of the
+        object IDs and the configuration payloads.
+        """
+        configs: Dict[str, Dict[str, str]] = {component: {} for component in components}
+        topic_filters = {self._get_config_topic("+", component): component for component in components}
+        connected = Event()
+        last_message = Event()
+
+        def on_connect(client, _userdata, _flags, _rc) -> None:
+            for topic_filter in topic_filters:
+                LOGGER.debug("Collecting retained configurations on topic %s.", topic_filter)
+                client.subscribe(topic_filter, 1)
+            connected.set()
+
+        def on_message(_client, _userdata, message) -> None:
+            if message.retain and message.payload:
+                for topic_filter, component in topic_filters.items():
+                    if mqtt.topic_matches_sub(topic_filter, message.topic):
+                        configs[component][message.topic.split("/")[-2]] = message.payload.decode()
+            last_message.set()
+
+        client = mqtt.Client(f"{get_client_id(self._mqtt_config)}-collector")
+        client.username_pw_set(self._mqtt_config.username, self._mqtt_config.password)
+        client.on_connect = on_connect
+        client.on_message = on_message
+        client.connect_async(self._mqtt_config.address, self._mqtt_config.port)
+        client.loop_start()
+        deadline = time.monotonic() + timeout
+        try:
+            if not connected.wait(timeout):
+                LOGGER.error("Can't connect to the MQTT broker to collect the retained configurations.")
+                return configs
+            while last_message.wait(min(quiet_time, max(0.0, deadline - time.monotonic()))):
+                last_message.clear()
+                if time.monotonic() >= deadline:
+                    LOGGER.warning("Timeout while collecting the retained configurations.")
+                    break
+        finally:
+            client.disconnect()
+            client.loop_stop()
+        for component, component_configs in configs.items():
+            LOGGER.debug("Found %d retained %s configuration(s).", len(component_configs), component)
+        return configs
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
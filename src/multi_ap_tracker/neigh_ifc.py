@@ -0,0 +1,208 @@
+"""
+Linux neighbour table interface of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import logging
+import socket
+import struct
+import time
+from dataclasses import dataclass
+from threading import Lock, Thread
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+from .mac import format_mac
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+LOGGER = logging.getLogger(__name__)
+
+# Netlink constants (see linux/netlink.h, linux/rtnetlink.h and linux/neighbour.h)
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x001
+NLM_F_DUMP = 0x300
+RTM_NEWNEIGH = 28
+RTM_DELNEIGH = 29
+RTM_GETNEIGH = 30
+RTMGRP_NEIGH = 0x4
+NDA_DST = 1
+NDA_LLADDR = 2
+NUD_REACHABLE = 0x02
+NUD_FAILED = 0x20
+
+NLMSG_HEADER = struct.Struct("=IHHII")
+NDMSG = struct.Struct("=BBHiHBB")
+RTATTR_HEADER = struct.Struct("=HH")
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+@dataclass
+class NeighbourEvent:
+    """A reachability change of a neighbour as reported by the kernel."""
+
+    ip: str  # pylint: disable=invalid-name
+    present: bool
+    mac: int = 0
+    timestamp: float = 0.0
+
+
+class NetlinkNeighbourSource:
+    """Source of neighbour events using the rtnetlink socket of the Linux kernel.
+
+    Upon iteration the current neighbour table is dumped first, followed by all
+    changes reported by the kernel. Only the states REACHABLE (the neighbour
+    confirmed its address recently) and FAILED (the address resolution failed)
+    are reported, all other states do not carry presence information.
+    """
+
+    def __init__(self, interface: str = "") -> None:
+        """Initialize this object."""
+        self._ifindex = socket.if_nametoindex(interface) if interface else 0
+        self._socket = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        self._socket.bind((0, RTMGRP_NEIGH))
+
+    def close(self) -> None:
+        """Close the netlink socket."""
+        self._socket.close()
+
+    def _request_dump(self) -> None:
+        """Request a dump of the neighbour table."""
+        payload = NDMSG.pack(socket.AF_UNSPEC, 0, 0, self._ifindex, 0, 0, 0)
+        header = NLMSG_HEADER.pack(NLMSG_HEADER.size + len(payload), RTM_GETNEIGH, NLM_F_REQUEST | NLM_F_DUMP, 1, 0)
+        self._socket.send(header + payload)
+
+    def _parse_neighbour(self, msg_type: int, data: bytes) -> Optional[NeighbourEvent]:
+        """Parse a RTM_NEWNEIGH or RTM_DELNEIGH message."""
+        family, _, _, ifindex, state, _, _ = NDMSG.unpack_from(data)
+        if self._ifindex and ifindex != self._ifindex:
+            return None
+        if msg_type != RTM_NEWNEIGH or not state & (NUD_REACHABLE | NUD_FAILED):
+            return None
+
+        ip_address = ""
+        mac = 0
+        offset = NDMSG.size
+        while offset + RTATTR_HEADER.size <= len(data):
+            attr_len, attr_type = RTATTR_HEADER.unpack_from(data, offset)
+            if attr_len < RTATTR_HEADER.size:
+                break
+            value_start = offset + RTATTR_HEADER.size
+            value_end = offset + attr_len
+            value = data[value_start:value_end]
+            if attr_type == NDA_DST:
+                ip_address = socket.inet_ntop(family, value)
+            elif attr_type == NDA_LLADDR and len(value) == 6:
+                mac = int.from_bytes(value, "big")
+            offset += (attr_len + 3) & ~3
+
+        if not ip_address:
+            return None
+        return NeighbourEvent(ip=ip_address, present=bool(state & NUD_REACHABLE), mac=mac, timestamp=time.monotonic())
+
+    def __iter__(self) -> Iterator[NeighbourEvent]:
+        """Yield the neighbour events."""
+        self._request_dump()
+        while True:
+            try:
+                data = self._socket.recv(65536)
+            except OSError:
+                LOGGER.debug("Netlink socket closed.")
+                return
+            offset = 0
+            while offset + NLMSG_HEADER.size <= len(data):
+                msg_len, msg_type, _, _, _ = NLMSG_HEADER.unpack_from(data, offset)
+                if msg_len < NLMSG_HEADER.size:
+                    break
+                if msg_type in (RTM_NEWNEIGH, RTM_DELNEIGH):
+                    payload_start = offset + NLMSG_HEADER.size
+                    payload_end = offset + msg_len
+                    event = self._parse_neighbour(msg_type, data[payload_start:payload_end])
+                    if event:
+                        yield event
+                elif msg_type == NLMSG_ERROR:
+                    LOGGER.error("Netlink reported an error on the neighbour table request.")
+                offset += (msg_len + 3) & ~3
+
+
+class NeighbourMonitor:
+    """Presence hints derived from the neighbour table of this host.
+
+    The monitor consumes the events of a source (e.g., a NetlinkNeighbourSource
+    or any other iterable of NeighbourEvent objects) in a background thread and
+    keeps the latest event per IP address. Events can also be fed directly
+    using `feed()`. The optional callback is called whenever the presence of an
+    IP address changed.
+    """
+
+    def __init__(
+        self, source: Optional[Iterable[NeighbourEvent]] = None, on_change: Optional[Callable[[], None]] = None
+    ) -> None:
+        """Initialize this object."""
+        self._lock = Lock()
+        self._hints: Dict[str, NeighbourEvent] = {}
+        self._on_change = on_change
+        self._source = source
+        if source is not None:
+            Thread(target=self._consume, name="neighbour-monitor", daemon=True).start()
+
+    def close(self) -> None:
+        """Stop the source of events."""
+        if isinstance(self._source, NetlinkNeighbourSource):
+            self._source.close()
+
+    def _consume(self) -> None:
+        """Consume all events of the source."""
+        assert self._source is not None
+        for event in self._source:
+            self.feed(event)
+
+    def feed(self, event: NeighbourEvent) -> None:
+        """Process a single neighbour event."""
+        if not event.timestamp:
+            event.timestamp = time.monotonic()
+        with self._lock:
+            last_event = self._hints.get(event.ip)
+            if not event.mac and last_event:
+                event.mac = last_event.mac  # FAILED entries do not carry the link layer address
+            self._hints[event.ip] = event
+        if last_event is None or last_event.present != event.present:
+            LOGGER.debug(
+                "Neighbour %s (%s) is %s.", event.ip, format_mac(event.mac), "reachable" if event.present else "gone"
+            )
+            if self._on_change:
+                self._on_change()
+
+    def get_hint(self, ip_address: str, mac: int, since: float) -> Optional[bool]:
+        """Get the presence hint for the given address if it is newer than `since`.
+
+        Returns None if there is no newer hint or if the IP address is known to
+        belong to a different MAC address.
+        """
+        with self._lock:
+            event = self._hints.get(ip_address)
+        if event is None or event.timestamp <= since:
+            return None
+        if event.mac and mac and event.mac != mac:
+            return None
+        return event.present
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
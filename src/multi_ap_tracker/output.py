@@ -0,0 +1,95 @@
+"""
+Machine-readable output of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import csv
+import json
+import sys
+from typing import Any, Dict, List, Optional, TextIO
+
+from .fritz_ifc import Device
+from .mac import format_mac
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+OUTPUT_FORMATS = ["table", "json", "jsonl", "csv"]
+DEVICE_FIELDS = ["name", "mac", "ip", "interface_type", "connected_to", "status", "seen_by"]
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+def get_device_record(device: Device) -> Dict[str, Any]:
+    """Get the output record of a device."""
+    return {
+        "name": device.name,
+        "mac": format_mac(device.mac),
+        "ip": device.ip,
+        "interface_type": device.interface_type,
+        "connected_to": device.connected_to,
+        "status": device.status,
+        "seen_by": device.seen_by,
+    }
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+class RecordWriter:
+    """Writer of records in one of the machine-readable formats.
+
+    Every record is written and flushed immediately, so that the output can be
+    processed while it is being written. In the `jsonl` and `csv` formats every
+    record is a single line. The `json` format streams the elements of a single
+    array, which is terminated when the writer is closed. List values are joined
+    by semicolons in `csv`.
+    """
+
+    def __init__(self, output_format: str, fields: List[str], stream: Optional[TextIO] = None) -> None:
+        """Initialize this object."""
+        self._format = output_format
+        self._stream = stream or sys.stdout
+        self._num_records = 0
+        self._csv_writer: Optional[csv.DictWriter] = None
+        if output_format == "csv":
+            self._csv_writer = csv.DictWriter(self._stream, fieldnames=fields, extrasaction="ignore")
+            self._csv_writer.writeheader()
+
+    def write(self, record: Dict[str, Any]) -> None:
+        """Write a single record."""
+        if self._format == "json":
+            separator = ",\n  " if self._num_records else "[\n  "
+            self._stream.write(separator + json.dumps(record, indent=2).replace("\n", "\n  "))
+        elif self._csv_writer:
+            self._csv_writer.writerow(
+                {key: ";".join(value) if isinstance(value, list) else value for key, value in record.items()}
+            )
+        else:
+            self._stream.write(json.dumps(record) + "\n")
+        self._num_records += 1
+        self._stream.flush()
+
+    def close(self) -> None:
+        """Terminate the array of the `json` format."""
+        if self._format == "json":
+            self._stream.write("\n]\n" if self._num_records else "[]\n")
+            self._num_records = 0
+        self._stream.flush()
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
@@ -0,0 +1,205 @@
+"""
+Active probing of hosts of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import asyncio
+import ipaddress
+import logging
+import os
+import socket
+import struct
+from typing import Dict, Iterable, Tuple
+
+from .config import Probe
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+LOGGER = logging.getLogger(__name__)
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMP_HEADER = struct.Struct("!BBHHH")
+
+
+# -----------------------------------------------------------------------------
+# Helper Functions
+# -----------------------------------------------------------------------------
+def _checksum(data: bytes) -> int:
+    """Calculate the internet checksum of the given data."""
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def _open_icmp_socket() -> Tuple[socket.socket, bool]:
+    """Open an ICMP socket.
+
+    The unprivileged datagram ICMP socket is preferred (it requires the group of
+    this process to be listed in the `net.ipv4.ping_group_range` sysctl), the raw
+    socket requires the CAP_NET_RAW capability. Returns the socket and a flag
+    indicating whether it is a raw socket.
+    """
+    try:
+        return socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP), False
+    except PermissionError:
+        return socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP), True
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+# pylint: disable=too-few-public-methods
+class _TokenBucket:
+    """Simple rate limiter for asyncio tasks."""
+
+    def __init__(self, rate: float) -> None:
+        """Initialize this object."""
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Wait until the next slot is available."""
+        if not self._interval:
+            return
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            if self._next_slot > now:
+                await asyncio.sleep(self._next_slot - now)
+            self._next_slot = max(now, self._next_slot) + self._interval
+
+
+# pylint: disable=too-few-public-methods
+class Prober:
+    """Confirm the presence of hosts by sending ICMP echo requests.
+
+    All hosts are probed concurrently using a single ICMP socket, limited by the
+    maximum number of outstanding probes and the maximum number of echo requests
+    per second. Sending the echo request also makes the kernel resolve the
+    address via ARP, which refreshes the neighbour table for the NeighbourMonitor.
+    """
+
+    def __init__(self, config: Probe) -> None:
+        """Initialize this object."""
+        self._config = config
+        self._ident = os.getpid() & 0xFFFF
+        self._waiters: Dict[Tuple[str, int], asyncio.Future] = {}
+
+    def probe(self, ip_addresses: Iterable[str]) -> Dict[str, bool]:
+        """Probe the given IP addresses and return the result per address.
+
+        If no ICMP socket can be opened, all probes are reported as failed.
+        """
+        addresses = [address for address in dict.fromkeys(ip_addresses) if self._is_ipv4(address)]
+        if not addresses:
+            return {}
+        try:
+            icmp_socket, is_raw = _open_icmp_socket()
+        except OSError as exception:
+            LOGGER.error("Can't open ICMP socket (%s), departures are not confirmed by probes.", exception)
+            return {address: False for address in addresses}
+        with icmp_socket:
+            icmp_socket.setblocking(False)
+            return asyncio.run(self._probe_all(icmp_socket, is_raw, addresses))
+
+    @staticmethod
+    def _is_ipv4(address: str) -> bool:
+        """Returns True if the address is a valid IPv4 address."""
+        try:
+            return isinstance(ipaddress.ip_address(address), ipaddress.IPv4Address)
+        except ValueError:
+            return False
+
+    async def _probe_all(self, icmp_socket: socket.socket, is_raw: bool, addresses: Iterable[str]) -> Dict[str, bool]:
+        """Probe all addresses concurrently."""
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(max(1, self._config.concurrency))
+        bucket = _TokenBucket(self._config.rate)
+        loop.add_reader(icmp_socket.fileno(), self._on_reply, icmp_socket, is_raw)
+        try:
+
+            async def probe_with_limit(address: str, index: int) -> bool:
+                async with semaphore:
+                    return await self._probe(icmp_socket, is_raw, bucket, address, index)
+
+            addresses = list(addresses)
+            results = await asyncio.gather(
+                *(probe_with_limit(address, index) for index, address in enumerate(addresses))
+            )
+        finally:
+            loop.remove_reader(icmp_socket.fileno())
+        return dict(zip(addresses, results))
+
+    # pylint: disable=too-many-arguments
+    async def _probe(
+        self, icmp_socket: socket.socket, is_raw: bool, bucket: _TokenBucket, address: str, index: int
+    ) -> bool:
+        """Probe a single address using up to `attempts` echo requests."""
+        loop = asyncio.get_running_loop()
+        for attempt in range(max(1, self._config.attempts)):
+            sequence = (index * self._config.attempts + attempt) & 0xFFFF
+            waiter = loop.create_future()
+            self._waiters[(address, sequence)] = waiter
+            try:
+                await bucket.acquire()
+                icmp_socket.sendto(self._echo_request(sequence, is_raw), (address, 0))
+                await asyncio.wait_for(waiter, self._config.timeout)
+                return True
+            except asyncio.TimeoutError:
+                LOGGER.debug("No echo reply from %s (attempt %d).", address, attempt + 1)
+            except OSError as exception:
+                LOGGER.debug("Sending echo request to %s failed: %s", address, exception)
+            finally:
+                del self._waiters[(address, sequence)]
+        return False
+
+    def _echo_request(self, sequence: int, is_raw: bool) -> bytes:
+        """Create an ICMP echo request packet.
+
+        For datagram sockets the kernel replaces the identifier and the checksum.
+        """
+        payload = b"ha_multi_ap_tracker"
+        header = ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, 0, self._ident, sequence)
+        checksum = _checksum(header + payload) if is_raw else 0
+        return ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, checksum, self._ident, sequence) + payload
+
+    def _on_reply(self, icmp_socket: socket.socket, is_raw: bool) -> None:
+        """Read all pending ICMP packets and resolve the corresponding waiters."""
+        while True:
+            try:
+                packet, (address, _) = icmp_socket.recvfrom(1024)
+            except OSError:
+                return
+            icmp_packet = packet
+            if is_raw:
+                header_length = (packet[0] & 0x0F) * 4
+                icmp_packet = packet[header_length:]
+            if len(icmp_packet) < ICMP_HEADER.size:
+                continue
+            icmp_type, _, _, ident, sequence = ICMP_HEADER.unpack_from(icmp_packet)
+            if icmp_type != ICMP_ECHO_REPLY or (is_raw and ident != self._ident):
+                continue
+            waiter = self._waiters.get((address, sequence))
+            if waiter and not waiter.done():
+                waiter.set_result(True)
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
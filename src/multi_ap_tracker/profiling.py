@@ -0,0 +1,96 @@
+"""
+Profiling support of the ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import cProfile
+import logging
+import pstats
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import ContextManager, Iterator, Optional
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+LOGGER = logging.getLogger(__name__)
+NUM_TOP_ALLOCATIONS = 25
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+class CycleProfiler:
+    """Profiler of the cycles of the track and status commands.
+
+    If a directory is given, every `every`-th cycle is profiled using cProfile
+    and the memory allocations are traced using tracemalloc. For each profiled
+    cycle the files `cycle-<n>.pstats` (to be loaded with the `pstats` module or
+    tools like snakeviz) and `cycle-<n>-allocations.txt` (the top allocations by
+    source line) are written to the directory. The memory allocations are only
+    traced during the profiled cycles, so the other cycles run without the
+    overhead of tracemalloc. Note that cProfile only covers the calling thread,
+    so the time spent in the concurrent router queries shows up as waiting time.
+
+    Without a directory, `cycle()` returns a shared no-op context manager.
+    """
+
+    def __init__(self, directory: Optional[Path] = None, every: int = 1) -> None:
+        """Initialize this object."""
+        self._directory = directory
+        self._every = max(1, every)
+        self._cycle = 0
+        self._noop: ContextManager[None] = nullcontext()
+        if self._directory:
+            LOGGER.info("Profiling every %d. cycle into directory %s.", self._every, self._directory)
+            self._directory.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_args(cls, args) -> "CycleProfiler":
+        """Create the profiler from the command line arguments."""
+        return cls(args.profile, args.profile_every)
+
+    def cycle(self) -> ContextManager[None]:
+        """Get the context manager to wrap a single cycle."""
+        if not self._directory:
+            return self._noop
+        self._cycle += 1
+        if (self._cycle - 1) % self._every:
+            return self._noop
+        return self._profile(self._directory / f"cycle-{self._cycle:06d}")
+
+    @contextmanager
+    def _profile(self, basename: Path) -> Iterator[None]:
+        """Profile the enclosed block and write the results."""
+        profiler = cProfile.Profile()
+        tracemalloc.start()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            pstats.Stats(profiler).dump_stats(f"{basename}.pstats")
+            with open(f"{basename}-allocations.txt", "w", encoding="utf-8") as file_handle:
+                for statistic in snapshot.statistics("lineno")[:NUM_TOP_ALLOCATIONS]:
+                    file_handle.write(f"{statistic}\n")
+            LOGGER.debug("Wrote profiling results to %s.*", basename)
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
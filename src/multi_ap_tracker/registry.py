@@ -0,0 +1,123 @@
+"""
+Registry of the created device trackers of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import logging
+from typing import Any, Dict, Iterator, List
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+LOGGER = logging.getLogger(__name__)
+LAST_SEEN_RESOLUTION = 3600
+SECONDS_PER_DAY = 86400
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+class TrackerRegistry:
+    """Registry of the device trackers created in home-assistant.
+
+    The registry maps the host names to the creation time and the time the
+    host was last seen online (both in seconds since the epoch) and is stored
+    in the `Trackers` entry of the state. The former `CreatedHostnames` list is
+    migrated on creation. The last seen time is only updated once per
+    `LAST_SEEN_RESOLUTION` seconds, so that the `dirty` flag (the state needs
+    to be saved) is not set in every cycle for every online host.
+
+    Expired device trackers are moved to the `ExpiredTrackers` entry of the
+    state, so that hosts still listed as offline by the routers are not created
+    again until they come online. These entries are dropped once the host was
+    not seen online for twice the TTL, as the routers forget such hosts as well.
+    """
+
+    def __init__(self, state_data: Dict[str, Any], now: float) -> None:
+        """Initialize this object."""
+        self._entries: Dict[str, Dict[str, int]] = state_data.setdefault("Trackers", {})
+        self._expired: Dict[str, int] = state_data.setdefault("ExpiredTrackers", {})
+        self.dirty = False
+        if "CreatedHostnames" in state_data:
+            created_hostnames = state_data.pop("CreatedHostnames") or []
+            LOGGER.info("Migrating %d created device tracker(s) to the tracker registry.", len(created_hostnames))
+            for hostname in created_hostnames:
+                self.add(hostname, now)
+            self.dirty = True
+        self._next_expiry_check = 0.0
+
+    def __contains__(self, hostname: str) -> bool:
+        """Returns True if a device tracker of the host was created."""
+        return hostname in self._entries
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the host names of the created device trackers."""
+        return iter(self._entries)
+
+    def __len__(self) -> int:
+        """Get the number of created device trackers."""
+        return len(self._entries)
+
+    def add(self, hostname: str, now: float) -> None:
+        """Register a created device tracker."""
+        self._entries[hostname] = {"created": int(now), "last_seen": int(now)}
+        self._expired.pop(hostname, None)
+        self.dirty = True
+
+    def is_expired(self, hostname: str) -> bool:
+        """Returns True if the device tracker of the host was deleted after it expired."""
+        return hostname in self._expired
+
+    def seen(self, hostname: str, now: float) -> None:
+        """Update the last seen time of an online host."""
+        entry = self._entries[hostname]
+        if now - entry["last_seen"] >= LAST_SEEN_RESOLUTION:
+            entry["last_seen"] = int(now)
+            self.dirty = True
+
+    def pop_expired(self, ttl_days: int, now: float) -> List[str]:
+        """Remove and return the hosts not seen online for more than `ttl_days` days.
+
+        A TTL of 0 disables the expiry. The registry is only checked once per
+        `LAST_SEEN_RESOLUTION` seconds. Expired hosts not seen online for twice
+        the TTL are forgotten.
+        """
+        if ttl_days <= 0 or now < self._next_expiry_check:
+            return []
+        self._next_expiry_check = now + LAST_SEEN_RESOLUTION
+        deadline = now - ttl_days * SECONDS_PER_DAY
+        expired = [hostname for hostname, entry in self._entries.items() if entry["last_seen"] < deadline]
+        for hostname in expired:
+            self._expired[hostname] = self._entries.pop(hostname)["last_seen"]
+        forgotten = [
+            hostname
+            for hostname, last_seen in self._expired.items()
+            if last_seen < deadline - ttl_days * SECONDS_PER_DAY
+        ]
+        for hostname in forgotten:
+            del self._expired[hostname]
+        if expired or forgotten:
+            self.dirty = True
+        return expired
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        self._entries.clear()
+        self._expired.clear()
+        self.dirty = True
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
@@ -0,0 +1,111 @@
+"""
+Configuration reload of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import logging
+import signal
+import threading
+from pathlib import Path
+from typing import Callable, Optional
+
+from .config import Config
+from .host_filter import HostFilter
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+LOGGER = logging.getLogger(__name__)
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+class ConfigWatcher:
+    """Watcher of the configuration file.
+
+    A reload is requested by the SIGHUP signal or if the modification time of
+    the configuration file changes, which is checked every `poll_interval`
+    seconds by a background thread. The callback `on_change` is called for every
+    request, so that the tracker can wake up from its sleep.
+    """
+
+    def __init__(self, config_file: Path, on_change: Callable[[], None], poll_interval: float = 2.0) -> None:
+        """Initialize this object."""
+        self._config_file = config_file
+        self._on_change = on_change
+        self._poll_interval = poll_interval
+        self._requested = threading.Event()
+        self._stop = threading.Event()
+        self._mtime = self._get_mtime()
+        if hasattr(signal, "SIGHUP") and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGHUP, self._on_sighup)
+        self._thread = threading.Thread(target=self._watch, name="config-watcher", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        """Stop watching the configuration file."""
+        self._stop.set()
+        self._thread.join()
+
+    def _get_mtime(self) -> Optional[float]:
+        """Get the modification time of the configuration file."""
+        try:
+            return self._config_file.stat().st_mtime
+        except OSError:
+            return None
+
+    def _request(self, reason: str) -> None:
+        """Request a reload of the configuration."""
+        LOGGER.info("Configuration reload requested (%s).", reason)
+        self._requested.set()
+        self._on_change()
+
+    def _on_sighup(self, _signum, _frame) -> None:
+        """Signal handler of SIGHUP."""
+        self._request("SIGHUP")
+
+    def _watch(self) -> None:
+        """Main function of the watcher thread."""
+        while not self._stop.wait(self._poll_interval):
+            mtime = self._get_mtime()
+            if mtime is not None and mtime != self._mtime:
+                self._mtime = mtime
+                self._request(f"{self._config_file} changed")
+
+    def get_new_config(self) -> Optional[Config]:
+        """Get the reloaded configuration if a reload was requested.
+
+        Returns None if no reload was requested or if the configuration file is
+        invalid. In the latter case, the current configuration should be kept.
+        """
+        if not self._requested.is_set():
+            return None
+        self._requested.clear()
+        config = Config()
+        try:
+            config.load(self._config_file)
+            HostFilter(config.host_filter)
+        except Exception as exception:  # pylint: disable=broad-except
+            LOGGER.error(
+                "Invalid configuration file %s, keeping the current configuration: %s", self._config_file, exception
+            )
+            return None
+        return config
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
@@ -0,0 +1,99 @@
+"""
+Roaming detection and access point occupancy of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+LOGGER = logging.getLogger(__name__)
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+@dataclass
+class RoamingEvent:
+    """A host moved from one access point to another."""
+
+    hostname: str
+    from_ap: str
+    to_ap: str
+    timestamp: str
+
+
+class ApIndex:
+    """Incrementally maintained index of the hosts connected to each access point.
+
+    The index is only updated with the changes of a cycle, so the cost of a
+    cycle does not depend on the total number of hosts. The access points whose
+    clients changed are collected until they are fetched by `pop_changed_aps()`.
+    """
+
+    def __init__(self) -> None:
+        """Initialize this object."""
+        self._host_ap: Dict[str, str] = {}
+        self._ap_hosts: Dict[str, Set[str]] = {}
+        self._changed_aps: Set[str] = set()
+
+    def get_ap(self, hostname: str) -> str:
+        """Get the access point the host is connected to or an empty string."""
+        return self._host_ap.get(hostname, "")
+
+    def get_hosts(self, access_point: str) -> List[str]:
+        """Get the sorted list of hosts connected to the access point."""
+        return sorted(self._ap_hosts.get(access_point, set()))
+
+    def move(self, hostname: str, access_point: str, timestamp: str) -> Optional[RoamingEvent]:
+        """Move the host to the given access point (empty string if it is offline).
+
+        Returns a RoamingEvent if the host moved between two access points.
+        """
+        old_ap = self._host_ap.get(hostname, "")
+        if old_ap == access_point:
+            return None
+
+        if old_ap:
+            del self._host_ap[hostname]
+            self._ap_hosts[old_ap].discard(hostname)
+            self._changed_aps.add(old_ap)
+        if access_point:
+            self._host_ap[hostname] = access_point
+            self._ap_hosts.setdefault(access_point, set()).add(hostname)
+            self._changed_aps.add(access_point)
+
+        if old_ap and access_point:
+            LOGGER.debug("Host %s roamed from %s to %s.", hostname, old_ap, access_point)
+            return RoamingEvent(hostname=hostname, from_ap=old_ap, to_ap=access_point, timestamp=timestamp)
+        return None
+
+    def pop_changed_aps(self) -> Dict[str, List[str]]:
+        """Get the access points whose clients changed since the last call with their hosts."""
+        changed = {access_point: self.get_hosts(access_point) for access_point in sorted(self._changed_aps)}
+        self._changed_aps = set()
+        return changed
+
+    def mark_all_changed(self) -> None:
+        """Mark all known access points as changed, e.g., to republish all sensors."""
+        self._changed_aps.update(self._ap_hosts)
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
@@ -0,0 +1,267 @@
+"""
+Multi-site support of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import logging
+import multiprocessing
+import queue
+import re
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from .clock import SYSTEM_CLOCK, Clock
+from .config import Config, Site
+from .fritz_ifc import Device, DeviceMonitor, MonitorUpdate, get_router_configs
+from .state import State
+from .timing import StageTimings
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+LOGGER = logging.getLogger(__name__)
+POLL_REQUEST = "poll"
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+def get_access_point_names(config: Config) -> List[str]:
+    """Get the names of all routers as reported in the `connected_to` attribute of the hosts.
+
+    With sites, the router names are prefixed by the name of their site.
+    """
+    if not config.sites:
+        return [name for name, _ in get_router_configs(config)]
+    return [
+        f"{site.name}: {name}" for site in config.sites for name, _ in get_router_configs(config.get_site_config(site))
+    ]
+
+
+def get_site_state_filepath(state_filepath: Path, site: Site) -> Path:
+    """Get the path of the state file of a site next to the given state file."""
+    site_name = re.sub(r"[^A-Za-z0-9_-]", "_", site.name)
+    return state_filepath.with_name(f"{state_filepath.stem}-{site_name}{state_filepath.suffix}")
+
+
+def qualify_device(site_name: str, device: Device) -> Device:
+    """Prefix the host name and the router names of a device by the name of its site.
+
+    The same host name can be used at different sites, so the host names are
+    qualified to keep their device trackers apart.
+    """
+    device.name = f"{site_name}: {device.name}"
+    if device.connected_to:
+        device.connected_to = f"{site_name}: {device.connected_to}"
+    device.seen_by = [f"{site_name}: {router_name}" for router_name in device.seen_by]
+    return device
+
+
+def get_site_device_stati(config: Config, state: State) -> List[Device]:
+    """Query the routers of all sites one after the other and get the per-device view of all sites."""
+    devices = []
+    for site in config.sites:
+        monitor = DeviceMonitor(config.get_site_config(site), State(get_site_state_filepath(state.filepath, site)))
+        devices += [qualify_device(site.name, device) for device in monitor.get_device_stati().values()]
+    return devices
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+@dataclass
+class SiteResult:
+    """The result of a poll of a site worker."""
+
+    site_name: str
+    host_states: Dict[str, Device] = field(default_factory=lambda: {})
+    time_until_next_poll: float = 0.0
+    durations: Dict[str, float] = field(default_factory=lambda: {})
+    error: str = ""
+
+
+@dataclass
+class _Worker:
+    """A worker process of a site."""
+
+    site: Site
+    process: Any
+    requests: Any
+
+
+# -----------------------------------------------------------------------------
+# Worker Process
+# -----------------------------------------------------------------------------
+# pylint: disable=too-many-arguments
+def _run_site_worker(
+    site_name: str, config: Config, state_filepath: Path, log_level: int, *, requests, results
+) -> None:
+    """Main function of a site worker process.
+
+    The worker polls the routers of its site whenever it receives a poll request
+    and sends back the per-host view of the site.
+    """
+    logging.basicConfig(format="%(asctime)s [%(levelname)s]: %(message)s", level=logging.WARNING)
+    logging.getLogger("fritzconnection").setLevel(logging.WARNING)
+    logging.getLogger("multi_ap_tracker").setLevel(log_level)
+
+    monitor = DeviceMonitor(config, State(state_filepath))
+    while requests.get() == POLL_REQUEST:
+        timings = StageTimings()
+        try:
+            host_states: Dict[str, Device] = {}
+            for update in monitor.iter_host_stati(timings):
+                host_states = update.devices
+            results.put(
+                SiteResult(
+                    site_name=site_name,
+                    host_states=host_states,
+                    time_until_next_poll=monitor.time_until_next_poll(),
+                    durations=timings.durations,
+                )
+            )
+        except Exception as exception:  # pylint: disable=broad-except
+            results.put(SiteResult(site_name=site_name, error=str(exception)))
+
+
+# -----------------------------------------------------------------------------
+# Supervisor
+# -----------------------------------------------------------------------------
+# pylint: disable=too-many-instance-attributes
+class SiteSupervisor:
+    """Device status retriever for multiple sites.
+
+    Every site configured in the `sites` entry of the configuration is polled by
+    a DeviceMonitor running in its own worker process with its own state file.
+    The supervisor merges the per-host views of all sites, so that it can be used
+    by the Tracker and the `status monitor` command in place of a single
+    DeviceMonitor and all sites are published over a single MQTT connection. The
+    host names are qualified by the site names (see `qualify_device()`).
+    """
+
+    def __init__(self, config: Config, state: State) -> None:
+        """Initialize this object."""
+        self._config = config
+        self._state = state
+        self.clock: Clock = SYSTEM_CLOCK
+        self._context = multiprocessing.get_context("spawn")
+        self._results = self._context.Queue()
+        self._workers: Dict[str, _Worker] = {}
+        self._site_hosts: Dict[str, Dict[str, Device]] = {}
+        self._next_polls: Dict[str, float] = {}
+        for site in config.sites:
+            self._start_worker(site)
+
+    def _start_worker(self, site: Site) -> None:
+        """Start the worker process of a site."""
+        LOGGER.debug("Start worker process for site %s.", site.name)
+        requests = self._context.Queue()
+        process = self._context.Process(
+            target=_run_site_worker,
+            name=f"site-{site.name}",
+            args=(
+                site.name,
+                self._config.get_site_config(site),
+                get_site_state_filepath(self._state.filepath, site),
+                logging.getLogger("multi_ap_tracker").getEffectiveLevel(),
+            ),
+            kwargs={"requests": requests, "results": self._results},
+            daemon=True,
+        )
+        process.start()
+        self._workers[site.name] = _Worker(site=site, process=process, requests=requests)
+
+    def close(self) -> None:
+        """Stop all worker processes."""
+        for worker in self._workers.values():
+            worker.requests.put(None)
+        for worker in self._workers.values():
+            worker.process.join(5)
+
+    def time_until_next_poll(self) -> float:
+        """Get the time in seconds until the next router of any site is due."""
+        if not self._next_polls:
+            return float(self._config.tracker.time_interval)
+        return max(0.0, min(self._next_polls.values()) - time.monotonic())
+
+    def _merge_sites(self) -> Dict[str, Device]:
+        """Merge the per-host views of all sites."""
+        host_states: Dict[str, Device] = {}
+        for site_hosts in self._site_hosts.values():
+            host_states.update(site_hosts)
+        return host_states
+
+    def _store_result(self, result: SiteResult, timings: StageTimings) -> None:
+        """Store the result of a site worker."""
+        for stage, duration in result.durations.items():
+            timings.add(f"{result.site_name}: {stage}", duration)
+        if result.error:
+            LOGGER.error("Polling site %s failed: %s", result.site_name, result.error)
+            return
+        self._site_hosts[result.site_name] = {
+            device.name: device
+            for device in (qualify_device(result.site_name, device) for device in result.host_states.values())
+        }
+        self._next_polls[result.site_name] = time.monotonic() + result.time_until_next_poll
+
+    def _get_result(self, pending: Dict[str, _Worker]) -> Optional[SiteResult]:
+        """Wait for the next result of the pending workers and restart dead workers."""
+        while True:
+            try:
+                return self._results.get(timeout=1.0)
+            except queue.Empty:
+                for site_name, worker in list(pending.items()):
+                    if not worker.process.is_alive():
+                        LOGGER.error("Worker process of site %s died, restarting it.", site_name)
+                        del pending[site_name]
+                        self._start_worker(worker.site)
+                if not pending:
+                    return None
+
+    def iter_host_stati(self, timings: Optional[StageTimings] = None) -> Iterator[MonitorUpdate]:
+        """Poll all sites and yield the merged per-host view after each site answered."""
+        if timings is None:
+            timings = StageTimings()
+        for worker in self._workers.values():
+            worker.requests.put(POLL_REQUEST)
+
+        pending = dict(self._workers)
+        while pending:
+            result = self._get_result(pending)
+            if result is None:
+                break
+            pending.pop(result.site_name, None)
+            self._store_result(result, timings)
+            with timings.measure("merge sites"):
+                host_states = self._merge_sites()
+            yield MonitorUpdate(router_name=result.site_name, devices=host_states)
+
+        with timings.measure("merge sites"):
+            host_states = self._merge_sites()
+        yield MonitorUpdate(router_name="", devices=host_states, complete=True)
+
+    def get_host_stati(self) -> Dict[str, Device]:
+        """Poll all sites and get the merged per-host view."""
+        host_states: Dict[str, Device] = {}
+        for update in self.iter_host_stati():
+            host_states = update.devices
+        return host_states
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
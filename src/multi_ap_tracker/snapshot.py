@@ -0,0 +1,79 @@
+"""
+Aggregate snapshot of all hosts of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import logging
+from typing import Any, Dict, Iterable, Optional
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+LOGGER = logging.getLogger(__name__)
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+class HostSnapshot:
+    """Versioned view of all tracked hosts for bulk consumers.
+
+    Every host is represented by a flat entry of its state and attributes
+    without the timestamp of the last update, so that an entry only changes if
+    the host changed. The `version` is increased by one for every cycle with
+    changes. Together with the `epoch` (the time this view was started), a
+    consumer can detect missed or repeated diffs and resynchronize using the
+    snapshot.
+    """
+
+    def __init__(self, epoch: int) -> None:
+        """Initialize this object."""
+        self.epoch = epoch
+        self.version = 0
+        self._hosts: Dict[str, Dict[str, Any]] = {}
+
+    def apply(
+        self, entries: Dict[str, Dict[str, Any]], removed: Iterable[str], timestamp: str
+    ) -> Optional[Dict[str, Any]]:
+        """Apply the entries and the removed hosts of a cycle.
+
+        Returns the diff message listing only the changed and removed hosts, or
+        None if nothing changed.
+        """
+        changed = {hostname: entry for hostname, entry in entries.items() if self._hosts.get(hostname) != entry}
+        removed = sorted(hostname for hostname in removed if hostname in self._hosts)
+        if not changed and not removed:
+            return None
+
+        self._hosts.update(changed)
+        for hostname in removed:
+            del self._hosts[hostname]
+        self.version += 1
+        LOGGER.debug("Snapshot version %d: %d host(s) changed, %d removed.", self.version, len(changed), len(removed))
+        return {
+            "epoch": self.epoch,
+            "version": self.version,
+            "timestamp": timestamp,
+            "changed": changed,
+            "removed": removed,
+        }
+
+    def get_snapshot(self, timestamp: str) -> Dict[str, Any]:
+        """Get the snapshot message of all hosts."""
+        return {"epoch": self.epoch, "version": self.version, "timestamp": timestamp, "hosts": self._hosts}
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
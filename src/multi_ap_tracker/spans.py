@@ -0,0 +1,156 @@
+"""
+Span recording of the cycles of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .timing import Span, StageTimings
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+LOGGER = logging.getLogger(__name__)
+SPAN_FORMATS = ("jsonl", "otlp")
+SERVICE_NAME = "ha_multi_ap_tracker"
+SPAN_KIND_INTERNAL = 1
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+def _get_otlp_value(value: Any) -> Dict[str, Any]:
+    """Convert an attribute value into an OTLP AnyValue."""
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _get_otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Convert attributes into a list of OTLP KeyValues."""
+    return [{"key": key, "value": _get_otlp_value(value)} for key, value in attributes.items()]
+
+
+def get_span_writer(args) -> Optional["SpanWriter"]:
+    """Create the span writer if requested by the command line arguments."""
+    return SpanWriter(args.spans, args.spans_format) if args.spans else None
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+class SpanWriter:
+    """Writer of the spans of each cycle to a file with one line per cycle.
+
+    In the `jsonl` format, each line contains the cycle number, the start time,
+    the duration and the tree of spans with their start relative to the start
+    of the cycle and their duration in seconds. In the `otlp` format, each line
+    is an OTLP/JSON `ExportTraceServiceRequest` with one trace per cycle, as
+    written by the file exporter of the OpenTelemetry collector, so that the
+    traces can be loaded into standard viewers.
+    """
+
+    def __init__(self, filepath: Path, span_format: str = "jsonl") -> None:
+        """Initialize this object."""
+        if span_format not in SPAN_FORMATS:
+            raise ValueError(f"Unsupported span format {span_format}!")
+        LOGGER.info("Writing the spans of each cycle to %s.", filepath)
+        self._format = span_format
+        self._cycle = 0
+        self._file = open(filepath, "a", encoding="utf-8")  # pylint: disable=consider-using-with
+
+    def write(self, timings: StageTimings) -> None:
+        """Write the spans of a finished cycle."""
+        self._cycle += 1
+        if self._format == "otlp":
+            data = self._get_otlp_record(timings)
+        else:
+            data = self._get_jsonl_record(timings)
+        self._file.write(json.dumps(data, separators=(",", ":")) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        """Close the file."""
+        self._file.close()
+
+    def _get_jsonl_record(self, timings: StageTimings) -> Dict[str, Any]:
+        """Get the record of a cycle with the nested spans."""
+        children: Dict[Optional[int], List[Dict[str, Any]]] = {}
+        nodes = []
+        for span in timings.spans:
+            node: Dict[str, Any] = {
+                "name": span.name,
+                "start": round(span.start, 6),
+                "duration": round(span.duration, 6),
+            }
+            if span.attributes:
+                node["attributes"] = span.attributes
+            nodes.append(node)
+            children.setdefault(span.parent, []).append(node)
+        for index, node in enumerate(nodes):
+            if index in children:
+                node["spans"] = children[index]
+        return {
+            "cycle": self._cycle,
+            "start": round(timings.start_time, 6),
+            "duration": round(timings.total, 6),
+            "spans": children.get(None, []),
+        }
+
+    def _get_otlp_record(self, timings: StageTimings) -> Dict[str, Any]:
+        """Get the OTLP/JSON export request of a cycle."""
+        trace_id = os.urandom(16).hex()
+        root_id = os.urandom(8).hex()
+        span_ids = [os.urandom(8).hex() for _ in timings.spans]
+        start_ns = int(timings.start_time * 1e9)
+
+        def get_otlp_span(span: Span, span_id: str, parent_id: str) -> Dict[str, Any]:
+            return {
+                "traceId": trace_id,
+                "spanId": span_id,
+                "parentSpanId": parent_id,
+                "name": span.name,
+                "kind": SPAN_KIND_INTERNAL,
+                "startTimeUnixNano": str(start_ns + int(span.start * 1e9)),
+                "endTimeUnixNano": str(start_ns + int((span.start + span.duration) * 1e9)),
+                "attributes": _get_otlp_attributes(span.attributes),
+            }
+
+        root = Span("cycle", 0.0, timings.total, None, {"cycle": self._cycle})
+        spans = [get_otlp_span(root, root_id, "")]
+        spans += [
+            get_otlp_span(span, span_id, root_id if span.parent is None else span_ids[span.parent])
+            for span, span_id in zip(timings.spans, span_ids)
+        ]
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": _get_otlp_attributes({"service.name": SERVICE_NAME})},
+                    "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": spans}],
+                }
+            ]
+        }
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
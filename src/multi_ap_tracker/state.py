@@ -37,16 +37,25 @@ class State:
     information to save. Upon creation of this object, the state is automatically
     loaded into memory. Users of this state must call the `save()` method to
     ensure the data survives crashes and restarts of the application.
+
+    A read-only state is loaded from the file, but never saved, e.g., to replay
+    a trace without changing the persistent state.
     """
 
-    def __init__(self, state_filepath: Path) -> None:
+    def __init__(self, state_filepath: Path, read_only: bool = False) -> None:
         """Create the persistent state object."""
         LOGGER.debug("Initialize persistent state using yaml file %s", state_filepath)
         self._filepath = state_filepath
+        self._read_only = read_only
         self.data: Dict[str, Any] = {}
         self._filepath.parent.mkdir(parents=True, exist_ok=True)
         self.load()
 
+    @property
+    def filepath(self) -> Path:
+        """The path of the yaml file of this state."""
+        return self._filepath
+
     def load(self) -> None:
         """Load the persistent state from disc."""
         self.data = {}
@@ -59,6 +68,9 @@ class State:
 
     def save(self) -> None:
         """Save the persistent state to disc."""
+        if self._read_only:
+            LOGGER.debug("Not saving the read-only state.")
+            return
         LOGGER.debug("Saving persistent state to yaml file %s", self._filepath)
         with open(self._filepath, "w", encoding="utf-8") as file_handle:
             yaml.dump(self.data, file_handle)
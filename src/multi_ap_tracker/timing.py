@@ -0,0 +1,145 @@
+"""
+Stage timing of the ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import logging
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from threading import Lock, local
+from typing import Any, Dict, Iterator, List, Optional
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+LOGGER = logging.getLogger(__name__)
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+@dataclass
+class Span:
+    """A timed section of a cycle.
+
+    The start is given in seconds since the start of the cycle, the parent is
+    the index of the enclosing span in the list of spans or None for a top-level
+    span.
+    """
+
+    name: str
+    start: float
+    duration: float = 0.0
+    parent: Optional[int] = None
+    attributes: Dict[str, Any] = field(default_factory=lambda: {})
+
+
+class StageTimings:
+    """Accumulated wall-clock durations of the stages of one cycle.
+
+    Stages are identified by their name. Measuring the same stage multiple times
+    accumulates the durations, so that e.g. the merge of all routers is reported
+    as one value. Durations can also be added from worker threads using `add()`.
+
+    If `record_spans` is set, every measurement is additionally recorded as a
+    Span. Spans measured while another span of the same thread is open are
+    nested into it. `span()` records a span without accumulating a stage
+    duration, e.g., to group the stages of a router.
+    """
+
+    def __init__(self, record_spans: bool = False) -> None:
+        """Initialize this object."""
+        self._lock = Lock()
+        self._start = time.perf_counter()
+        self._record_spans = record_spans
+        self._open_spans = local()
+        self.start_time = time.time()
+        self.durations: Dict[str, float] = {}
+        self.spans: List[Span] = []
+
+    def _get_open_spans(self) -> List[int]:
+        """Get the stack of the indices of the open spans of the current thread."""
+        if not hasattr(self._open_spans, "stack"):
+            self._open_spans.stack = []
+        return self._open_spans.stack
+
+    def _add_span(self, name: str, start: float, duration: float, attributes: Optional[Dict[str, Any]]) -> int:
+        """Add a span starting at the given value of the performance counter and return its index."""
+        open_spans = self._get_open_spans()
+        span = Span(name, start - self._start, duration, open_spans[-1] if open_spans else None, attributes or {})
+        with self._lock:
+            self.spans.append(span)
+            return len(self.spans) - 1
+
+    def add(
+        self,
+        stage: str,
+        duration: float,
+        start: Optional[float] = None,
+        attributes: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Add the given duration in seconds to the stage.
+
+        The optional start is the value of `time.perf_counter()` at the start of
+        the stage, by default the stage is assumed to have just ended.
+        """
+        with self._lock:
+            self.durations[stage] = self.durations.get(stage, 0.0) + duration
+        if self._record_spans:
+            self._add_span(stage, time.perf_counter() - duration if start is None else start, duration, attributes)
+
+    @contextmanager
+    def measure(self, stage: str, attributes: Optional[Dict[str, Any]] = None) -> Iterator[None]:
+        """Context manager measuring the duration of the enclosed block."""
+        start = time.perf_counter()
+        with self.span(stage, attributes):
+            try:
+                yield
+            finally:
+                duration = time.perf_counter() - start
+                with self._lock:
+                    self.durations[stage] = self.durations.get(stage, 0.0) + duration
+
+    @contextmanager
+    def span(self, name: str, attributes: Optional[Dict[str, Any]] = None) -> Iterator[None]:
+        """Context manager recording the enclosed block as a span, if spans are recorded."""
+        if not self._record_spans:
+            yield
+            return
+        start = time.perf_counter()
+        index = self._add_span(name, start, 0.0, attributes)
+        open_spans = self._get_open_spans()
+        open_spans.append(index)
+        try:
+            yield
+        finally:
+            open_spans.pop()
+            self.spans[index].duration = time.perf_counter() - start
+
+    @property
+    def total(self) -> float:
+        """The time in seconds since the creation of this object."""
+        return time.perf_counter() - self._start
+
+    def __str__(self) -> str:
+        """Return the string representation of this object."""
+        stages = ", ".join(f"{stage}={duration:.3f}s" for stage, duration in self.durations.items())
+        return f"total={self.total:.3f}s: {stages}"
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
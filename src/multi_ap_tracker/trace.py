@@ -0,0 +1,224 @@
+"""
+Recording and replay of router responses of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import gzip
+import json
+import logging
+import time
+import zlib
+from bisect import bisect_right
+from pathlib import Path
+from threading import Event, Lock
+from typing import Any, Dict, List, Optional, Protocol, Tuple
+
+from .clock import Clock
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+LOGGER = logging.getLogger(__name__)
+TRACE_VERSION = 1
+HOST_FIELDS = ["mac", "ip", "name", "interface_type", "status"]
+
+
+# -----------------------------------------------------------------------------
+# Exceptions
+# -----------------------------------------------------------------------------
+class TraceFinished(Exception):
+    """Raised by the replay clock when the end of the trace is reached."""
+
+
+# -----------------------------------------------------------------------------
+# Interfaces
+# -----------------------------------------------------------------------------
+class HostsSource(Protocol):
+    """Source of the replacements of FritzHosts, like a TraceReplay or a simulated network."""
+
+    @property
+    def clock(self) -> Clock:
+        """The clock driving the DeviceMonitor and the Tracker."""
+
+    def create_hosts(self, router_name: str) -> Any:
+        """Create the replacement of FritzHosts of the given router."""
+
+
+# -----------------------------------------------------------------------------
+# Recording
+# -----------------------------------------------------------------------------
+class TraceRecorder:
+    """Recorder of the raw responses of the routers.
+
+    The trace is a gzip compressed file of JSON lines. The first line is a
+    header containing the version and the field names of the host entries, each
+    following line contains the timestamp, the router name and the host entries
+    of one `get_hosts_info()` call as lists of values. The compressed stream is
+    flushed after every record, so that the trace stays readable if the tracker
+    is killed.
+    """
+
+    def __init__(self, filepath: Path) -> None:
+        """Initialize this object."""
+        LOGGER.info("Recording router responses to %s.", filepath)
+        self._lock = Lock()
+        self._file = gzip.open(filepath, "wt", encoding="utf-8")
+        self._write({"version": TRACE_VERSION, "fields": HOST_FIELDS})
+
+    def _write(self, data: Dict[str, Any]) -> None:
+        """Write a single line and flush the compressed stream."""
+        self._file.write(json.dumps(data, separators=(",", ":")) + "\n")
+        self._file.flush()
+
+    def record(self, router_name: str, timestamp: float, hosts: List[Dict[str, Any]]) -> None:
+        """Record the response of a router."""
+        with self._lock:
+            self._write(
+                {
+                    "t": round(timestamp, 3),
+                    "r": router_name,
+                    "h": [[host.get(field) for field in HOST_FIELDS] for host in hosts],
+                }
+            )
+
+    def close(self) -> None:
+        """Close the trace file."""
+        with self._lock:
+            self._file.close()
+
+
+# -----------------------------------------------------------------------------
+# Replay
+# -----------------------------------------------------------------------------
+class ReplayClock(Clock):
+    """Virtual clock of a trace replay.
+
+    The clock starts at the first timestamp of the trace. Sleeping advances the
+    virtual time immediately and waits for the real time scaled by the replay
+    speed (a speed of 0 does not wait at all). Sleeping after the virtual time
+    reached the end of the trace raises `TraceFinished`.
+    """
+
+    def __init__(self, start: float, end: float, speed: float) -> None:
+        """Initialize this object."""
+        self._now = start
+        self._end = end
+        self._speed = speed
+
+    def time(self) -> float:
+        """Get the current virtual time in seconds since the epoch."""
+        return self._now
+
+    def monotonic(self) -> float:
+        """Get the current virtual time."""
+        return self._now
+
+    def sleep(self, seconds: float) -> None:
+        """Advance the virtual time by the given number of seconds."""
+        if self._now >= self._end:
+            raise TraceFinished()
+        self._now += seconds
+        if self._speed > 0:
+            time.sleep(seconds / self._speed)
+
+    def wait(self, event: Event, timeout: float) -> bool:
+        """Advance the virtual time. Events can't occur during a replay."""
+        self.sleep(timeout)
+        return False
+
+
+# pylint: disable=too-few-public-methods
+class ReplayHosts:
+    """Replacement of FritzHosts returning the recorded responses of a router."""
+
+    def __init__(self, records: List[Tuple[float, List[Dict[str, Any]]]], clock: Clock) -> None:
+        """Initialize this object."""
+        self._timestamps = [timestamp for timestamp, _ in records]
+        self._responses = [hosts for _, hosts in records]
+        self._clock = clock
+
+    def get_hosts_info(self) -> List[Dict[str, Any]]:
+        """Get the last response of the router recorded before the current time of the clock."""
+        if not self._responses:
+            return []
+        position = max(0, bisect_right(self._timestamps, self._clock.time()) - 1)
+        return [dict(host) for host in self._responses[position]]
+
+
+class TraceReplay:
+    """Replay of a recorded trace.
+
+    The recorded responses are provided by `ReplayHosts` objects created for
+    each router name. The DeviceMonitor and the Tracker use the `clock` of the
+    replay, so that a trace of several weeks can be processed in seconds.
+    """
+
+    def __init__(self, filepath: Path, speed: float = 1.0) -> None:
+        """Initialize this object."""
+        self._records: Dict[str, List[Tuple[float, List[Dict[str, Any]]]]] = {}
+        num_records = 0
+        with gzip.open(filepath, "rt", encoding="utf-8") as file_handle:
+            header = json.loads(file_handle.readline())
+            if header.get("version") != TRACE_VERSION:
+                raise ValueError(f"Unsupported trace version {header.get('version')} of file {filepath}!")
+            fields = header["fields"]
+            try:
+                for line in file_handle:
+                    data = json.loads(line)
+                    hosts = [dict(zip(fields, values)) for values in data["h"]]
+                    self._records.setdefault(data["r"], []).append((data["t"], hosts))
+                    num_records += 1
+            except (EOFError, zlib.error, ValueError) as exception:
+                LOGGER.warning(
+                    "Trace %s is truncated (%s), using the first %d records.", filepath, exception, num_records
+                )
+
+        timestamps = [timestamp for records in self._records.values() for timestamp, _ in records]
+        if not timestamps:
+            raise ValueError(f"Trace {filepath} contains no records!")
+        self.start = min(timestamps)
+        self.end = max(timestamps)
+        self.clock = ReplayClock(self.start, self.end, speed)
+        LOGGER.info(
+            "Replaying %d records of %d router(s) covering %.1f hours from %s.",
+            num_records,
+            len(self._records),
+            (self.end - self.start) / 3600.0,
+            filepath,
+        )
+
+    def create_hosts(self, router_name: str) -> ReplayHosts:
+        """Create the replacement of FritzHosts of the given router."""
+        if router_name not in self._records:
+            LOGGER.warning("No records of router %s in the trace.", router_name)
+        return ReplayHosts(self._records.get(router_name, []), self.clock)
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+def get_recorder(args) -> Optional[TraceRecorder]:
+    """Create the recorder if requested by the command line arguments."""
+    return TraceRecorder(args.record) if args.record else None
+
+
+def get_replay(args) -> Optional[TraceReplay]:
+    """Create the replay if requested by the command line arguments."""
+    return TraceReplay(args.replay, args.replay_speed) if args.replay else None
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
@@ -17,14 +17,30 @@ Copyright:
 # -----------------------------------------------------------------------------
 import logging
 import time
+from dataclasses import dataclass, field, replace
 from datetime import datetime
-from threading import Lock
-from typing import Any, Dict, List
+from threading import Event, Lock
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
 
+from .clock import SYSTEM_CLOCK, Clock
 from .config import Config
-from .fritz_ifc import DeviceMonitor
+from .election import LeaderElection
+from .fritz_ifc import Device, DeviceMonitor
+from .history import HistoryWriter, get_history_directory
+from .mac import format_mac
 from .mqtt_ifc import MqttInterface
+from .neigh_ifc import NeighbourMonitor, NetlinkNeighbourSource
+from .probe import Prober
+from .profiling import CycleProfiler
+from .registry import TrackerRegistry
+from .reload import ConfigWatcher
+from .roaming import ApIndex
+from .sites import SiteSupervisor, get_access_point_names
+from .snapshot import HostSnapshot
+from .spans import SpanWriter
 from .state import State
+from .timing import StageTimings
+from .trace import HostsSource, TraceRecorder
 
 # -----------------------------------------------------------------------------
 # Module Variables
@@ -32,27 +48,242 @@ from .state import State
 LOGGER = logging.getLogger(__name__)
 
 
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+def _get_known_hostnames(config: Config, state: State) -> Set[str]:
+    """Query all routers (of all sites) and get the names of all hosts they know."""
+    monitor: Union[DeviceMonitor, SiteSupervisor]
+    monitor = SiteSupervisor(config, state) if config.sites else DeviceMonitor(config, state)
+    try:
+        return {hostname for hostname, device in monitor.get_host_stati().items() if device.known}
+    finally:
+        if isinstance(monitor, SiteSupervisor):
+            monitor.close()
+
+
+def garbage_collect(config: Config, state: State) -> None:
+    """Delete all orphaned device trackers and access point sensors in home-assistant.
+
+    All retained device tracker and sensor configurations below our node ID
+    are collected. A device tracker is kept if it belongs to a host of the
+    tracker registry or to a host currently known by the routers, which are only
+    queried if there are device trackers of hosts not in the registry. An access
+    point sensor is kept if roaming is enabled and the access point is
+    configured. All other configurations are deleted in one batch.
+
+    Only a plain MQTT connection is used, the leader election, the neighbour
+    table and the probes of the tracker are not started.
+    """
+    if not config.mqtt.node_id:
+        LOGGER.error("Garbage collection requires a node ID to identify our device trackers.")
+        return
+
+    start = time.perf_counter()
+    mqtt = MqttInterface(config)
+    try:
+        configs = mqtt.collect_configs(["device_tracker", "sensor"])
+        live_object_ids = {mqtt.get_object_id(hostname) for hostname in TrackerRegistry(state.data, time.time())}
+        candidates = [object_id for object_id in configs["device_tracker"] if object_id not in live_object_ids]
+        if candidates:
+            live_object_ids.update(mqtt.get_object_id(hostname) for hostname in _get_known_hostnames(config, state))
+        orphans = sorted(object_id for object_id in candidates if object_id not in live_object_ids)
+
+        live_sensor_ids = set()
+        if config.roaming.enabled:
+            live_sensor_ids = {mqtt.get_ap_object_id(name) for name in get_access_point_names(config)}
+        orphan_sensors = sorted(object_id for object_id in configs["sensor"] if object_id not in live_sensor_ids)
+
+        acknowledged = mqtt.delete_device_trackers(orphans)
+        acknowledged += mqtt.delete_ap_sensors(orphan_sensors)
+        LOGGER.info(
+            "Found %d device tracker and %d sensor configuration(s), deleted %d orphan(s) (%d acknowledged) in %.2f s.",
+            len(configs["device_tracker"]),
+            len(configs["sensor"]),
+            len(orphans) + len(orphan_sensors),
+            acknowledged,
+            time.perf_counter() - start,
+        )
+    finally:
+        mqtt.close()
+
+
 # -----------------------------------------------------------------------------
 # Classes
 # -----------------------------------------------------------------------------
+@dataclass
+class CycleDiff:
+    """The changes to publish at the end of a tracking cycle."""
+
+    hosts_to_create: List[str] = field(default_factory=lambda: [])
+    hosts_to_delete: List[str] = field(default_factory=lambda: [])
+    hosts_to_update: Dict[str, bool] = field(default_factory=lambda: {})
+    host_attributes_to_update: Dict[str, Dict[str, Any]] = field(default_factory=lambda: {})
+    access_point_changes: Dict[str, str] = field(default_factory=lambda: {})
+    timestamp: str = ""
+
+
 # pylint: disable=too-many-instance-attributes
 class Tracker:
     """The tracker responsible for identifying the devices and publishing their states."""
 
-    def __init__(self, config: Config, state: State) -> None:
-        """Initialize the tracker."""
+    def __init__(
+        self,
+        config: Config,
+        state: State,
+        recorder: Optional[TraceRecorder] = None,
+        replay: Optional[HostsSource] = None,
+        dry_run: bool = False,
+    ) -> None:
+        """Initialize the tracker.
+
+        If a TraceReplay (or another HostsSource) is given, the recorded router
+        responses are processed using the clock of the replay. The neighbour table and the probes are
+        not used in this case, as they reflect the current network. In the `dry_run` mode, the
+        MQTT messages are only logged instead of being published.
+        """
         self._config = config
+        self._dry_run = dry_run
         self._state = state
         self._last_ha_online_state = True
-        self._created_hostnames: List[str] = self._state.data.setdefault("CreatedHostnames", [])
         self._reconfigure_all = False
         self._lock = Lock()
-        self._mqtt = MqttInterface(config, self.on_ha_state)
-        self._monitor = DeviceMonitor(config, state)
+        self._wakeup = Event()
+        self._stopped = Event()
+        self._mqtt_connected = False
+        self._election: Optional[LeaderElection] = None
+        if config.high_availability.enabled:
+            self._election = LeaderElection(config)
+        self._mqtt = self._create_mqtt(config)
+        if self._election:
+            self._election.start(self._mqtt)
+        self._neighbour_monitor = None
+        self._clock: Clock = replay.clock if replay else SYSTEM_CLOCK
+        self._replaying = replay is not None
+        self._registry = TrackerRegistry(state.data, self._clock.time())
+        self._published_attributes: Dict[str, Dict[str, Any]] = {}
+        self._attributes_refreshed = 0.0
+        self._monitor: Union[DeviceMonitor, SiteSupervisor]
+        if config.sites and not (recorder or replay):
+            LOGGER.debug("Tracking %d sites.", len(config.sites))
+            self._monitor = SiteSupervisor(config, state)
+        else:
+            if config.sites:
+                LOGGER.warning("Recording and replaying traces is not supported for sites, using the fritzbox entry.")
+            if config.neighbour.enabled and not replay:
+                self._neighbour_monitor = NeighbourMonitor(
+                    NetlinkNeighbourSource(config.neighbour.interface), on_change=self._wakeup.set
+                )
+            self._monitor = DeviceMonitor(config, state, self._neighbour_monitor, recorder, replay)
+        self._prober = Prober(config.probe) if config.probe.enabled and not replay else None
+        self._last_confirmed: Dict[str, float] = {}
+        self._probed_away: Set[str] = set()
+        self._history: Optional[HistoryWriter] = None
+        if config.history.enabled:
+            self._history = HistoryWriter(get_history_directory(config, state.filepath), config.history.retention_days)
+        self._ap_index: Optional[ApIndex] = ApIndex() if config.roaming.enabled else None
+        self._created_ap_sensors: Set[str] = set()
+        self._snapshot = self._create_snapshot(config)
+
+    def _create_snapshot(self, config: Config) -> Optional[HostSnapshot]:
+        """Create the aggregate snapshot of all hosts if enabled."""
+        return HostSnapshot(int(self._clock.time())) if config.snapshot.enabled else None
 
     def close(self) -> None:
         """Close the connection."""
+        if self._election:
+            self._election.release()
         self._mqtt.close()
+        if self._neighbour_monitor:
+            self._neighbour_monitor.close()
+        if isinstance(self._monitor, SiteSupervisor):
+            self._monitor.close()
+
+    def wake_up(self) -> None:
+        """Wake up the main loop if it is sleeping until the next router is due."""
+        self._wakeup.set()
+
+    def stop(self) -> None:
+        """Stop the main loop after the current cycle."""
+        self._stopped.set()
+        self._wakeup.set()
+
+    def reload(self, config: Config) -> None:
+        """Apply a reloaded configuration.
+
+        Only the components affected by the changed sections are recreated. The
+        connection to the MQTT broker is only re-established if the `mqtt`
+        section changed. The created device trackers and the last published
+        states are kept, so that nothing is republished unless the broker or the
+        MQTT topics changed.
+        """
+        changed = set(config.get_changed_sections(self._config))
+        if not changed:
+            LOGGER.info("Configuration is unchanged.")
+            return
+        LOGGER.info("Changed configuration section(s): %s", ", ".join(sorted(changed)))
+
+        ignored = changed & {"sites", "neighbour", "high_availability"}
+        if self._election:
+            ignored |= changed & {"mqtt"}
+        if ignored:
+            LOGGER.warning("Changes of the section(s) %s require a restart.", ", ".join(sorted(ignored)))
+            config = replace(config, **{name: getattr(self._config, name) for name in ignored})
+            changed -= ignored
+
+        if "mqtt" in changed:
+            LOGGER.info("Reconnecting to the MQTT broker.")
+            self._mqtt.close()
+            self._mqtt_connected = False
+            mqtt = self._create_mqtt(config)
+            mqtt.take_over_attributes(self._mqtt)
+            self._mqtt = mqtt
+            if self._get_publish_target(self._config) != self._get_publish_target(config):
+                LOGGER.info("MQTT broker or topics changed, republishing all device trackers.")
+                with self._lock:
+                    self._reconfigure_all = True
+        elif changed & {"roaming", "snapshot"}:
+            self._mqtt.update_topics(config)
+
+        if isinstance(self._monitor, DeviceMonitor) and changed & {
+            "fritzbox",
+            "repeater",
+            "tracker",
+            "host_filter",
+            "wlan",
+            "description_cache",
+            "throttling",
+        }:
+            self._monitor.reconfigure(config)
+
+        if "probe" in changed:
+            self._prober = Prober(config.probe) if config.probe.enabled and not self._replaying else None
+        if "history" in changed:
+            self._history = None
+            if config.history.enabled:
+                self._history = HistoryWriter(
+                    get_history_directory(config, self._state.filepath), config.history.retention_days
+                )
+        if "roaming" in changed and bool(self._ap_index) != config.roaming.enabled:
+            self._ap_index = ApIndex() if config.roaming.enabled else None
+            self._created_ap_sensors = set()
+        if changed & {"mqtt", "snapshot"}:
+            self._snapshot = self._create_snapshot(config)
+
+        self._config = config
+
+    @staticmethod
+    def _get_publish_target(config: Config) -> Tuple[str, int, str, str, str, bool]:
+        """Get the settings of the MQTT configuration that require to republish all device trackers if changed."""
+        mqtt_config = config.mqtt
+        return (
+            mqtt_config.address,
+            mqtt_config.port,
+            mqtt_config.discovery_prefix,
+            mqtt_config.node_id,
+            mqtt_config.name_prefix,
+            mqtt_config.single_topic,
+        )
 
     def on_ha_state(self, online: bool) -> None:
         """Callback when home-assistant goes offline or online."""
@@ -62,88 +293,387 @@ class Tracker:
                 self._reconfigure_all = True
         self._last_ha_online_state = online
 
-    # pylint: disable=too-many-branches
-    def track(self) -> None:
-        """The tracking main loop."""
-        last_states: Dict[str, bool] = {}
-
-        while True:
-            host_states = self._monitor.get_host_stati()
+    def _create_mqtt(self, config: Config) -> MqttInterface:
+        """Create the MQTT interface, using the last will of the election if high availability is enabled."""
+        if self._election:
+            mqtt = MqttInterface(
+                config, self.on_ha_state, will=self._election.will, keepalive=config.high_availability.keepalive
+            )
+        else:
+            mqtt = MqttInterface(config, self.on_ha_state, dry_run=self._dry_run)
+        mqtt.add_connect_callback(self._on_mqtt_connect)
+        return mqtt
 
-            hosts_to_create: List[str] = []
-            hosts_to_delete: List[str] = []
-            hosts_to_update: Dict[str, bool] = {}
-            host_attributes_to_update: Dict[str, Dict[str, Any]] = {}
-            current_time_str = datetime.now().astimezone().isoformat("T", "seconds")
+    def _on_mqtt_connect(self) -> None:
+        """Callback when the connection to the MQTT broker is (re-)established.
 
+        Messages published while the connection was lost are gone and a
+        restarted broker may have lost the retained configurations, so all
+        device trackers are republished after a reconnect.
+        """
+        if self._mqtt_connected:
+            LOGGER.info("Reconnected to the MQTT broker, republishing all device trackers.")
             with self._lock:
-                reconfigure_all = self._reconfigure_all
-                self._reconfigure_all = False
-
-            for hostname, device in host_states.items():
-                if device.known:
-                    if hostname not in self._created_hostnames or reconfigure_all:
-                        hosts_to_create.append(hostname)
-                        hosts_to_update[hostname] = device.status
-                        last_states[hostname] = device.status
-                        if hostname not in self._created_hostnames:
-                            self._created_hostnames.append(hostname)
-
-                    if (
-                        hostname not in last_states
-                        or device.status != last_states[hostname]
-                        or self._config.tracker.send_state_always
-                    ):
-                        hosts_to_update[hostname] = device.status
-                        last_states[hostname] = device.status
-
-                    host_attributes_to_update[hostname] = {
-                        "mac": device.mac,
-                        "ip": device.ip,
-                        "interface_type": device.interface_type,
-                        "connected_to": device.connected_to,
-                        "last_update": current_time_str,
-                    }
-                else:
-                    if hostname in self._created_hostnames:
-                        self._created_hostnames.remove(hostname)
-                        del last_states[hostname]
-
-            if hosts_to_create or hosts_to_delete:
-                self._state.data["CreatedHostnames"] = self._created_hostnames
+                self._reconfigure_all = True
+            self._wakeup.set()
+        self._mqtt_connected = True
+
+    def _publish_arrivals(self, host_states: Dict[str, Device], last_states: Dict[str, bool]) -> None:
+        """Publish the hosts that came online according to an intermediate update.
+
+        Only arrivals of already created device trackers are published early. All
+        other changes, especially departures, require the complete view of all
+        routers and are handled at the end of the cycle.
+        """
+        for hostname, device in host_states.items():
+            if (
+                device.status
+                and last_states.get(hostname) is False
+                and hostname in self._registry
+                and hostname not in self._probed_away
+            ):
+                LOGGER.debug("Host %s came online (reported by %s).", hostname, device.connected_to)
+                self._mqtt.update_device_tracker(hostname, "home")
+                last_states[hostname] = True
+
+    def _get_hosts_to_probe(
+        self, host_states: Dict[str, Device], last_states: Dict[str, bool], now: float
+    ) -> Tuple[Dict[str, Device], Dict[str, Device]]:
+        """Get the departed hosts and the idle hosts to probe."""
+        idle_time = self._config.probe.idle_time
+        departed = {}
+        idle = {}
+        for hostname, device in host_states.items():
+            if not device.known or not device.ip:
+                continue
+            if not device.status:
+                self._last_confirmed.pop(hostname, None)
+                self._probed_away.discard(hostname)
+                if last_states.get(hostname):
+                    departed[hostname] = device
+            elif idle_time:
+                last_confirmed = self._last_confirmed.setdefault(hostname, now)
+                if hostname in self._probed_away or now - last_confirmed >= idle_time:
+                    idle[hostname] = device
+        return departed, idle
+
+    def _confirm_departures(self, host_states: Dict[str, Device], last_states: Dict[str, bool]) -> None:
+        """Probe the hosts that went offline or are idle and update their status by the results.
+
+        Hosts reported offline by the routers are kept online if they answer a
+        probe. If the `idle_time` of the probe configuration is set, hosts still
+        reported online by the routers, but not confirmed within that time, are
+        probed as well and set offline if they do not answer. They stay offline
+        until they answer a probe or the routers report them offline as well.
+        """
+        assert self._prober is not None
+        now = self._clock.time()
+        departed, idle = self._get_hosts_to_probe(host_states, last_states, now)
+        if not departed and not idle:
+            return
+
+        LOGGER.debug("Probing %d departed and %d idle host(s).", len(departed), len(idle))
+        results = self._prober.probe(device.ip for device in [*departed.values(), *idle.values()])
+        for hostname, device in departed.items():
+            if results.get(device.ip):
+                LOGGER.debug("Host %s still answers probes at %s, keeping it online.", hostname, device.ip)
+                device.status = True
+        for hostname, device in idle.items():
+            if results.get(device.ip):
+                self._last_confirmed[hostname] = now
+                self._probed_away.discard(hostname)
+            else:
+                if hostname not in self._probed_away:
+                    LOGGER.debug("Idle host %s does not answer probes at %s, setting it offline.", hostname, device.ip)
+                self._probed_away.add(hostname)
+                device.status = False
+
+    def _expire_trackers(self, diff: CycleDiff, last_states: Dict[str, bool], now: float) -> None:
+        """Add the device trackers of hosts not seen online within the TTL to the deletions."""
+        for hostname in self._registry.pop_expired(self._config.tracker.ttl, now):
+            diff.hosts_to_delete.append(hostname)
+            diff.hosts_to_update.pop(hostname, None)
+            diff.host_attributes_to_update.pop(hostname, None)
+            last_states.pop(hostname, None)
+            self._published_attributes.pop(hostname, None)
+            if self._ap_index and self._ap_index.get_ap(hostname):
+                diff.access_point_changes[hostname] = ""
+
+    @staticmethod
+    def _get_attributes(device: Device) -> Dict[str, Any]:
+        """Get the attributes of the device tracker of a host without the time of the last update."""
+        attributes: Dict[str, Any] = {
+            "mac": format_mac(device.mac),
+            "ip": device.ip,
+            "interface_type": device.interface_type,
+            "connected_to": device.connected_to,
+            "random_mac": device.random_mac,
+        }
+        if device.signal is not None:
+            attributes.update({"signal": device.signal, "speed": device.speed, "band": device.band})
+        return attributes
+
+    @staticmethod
+    def _get_access_point(device: Device) -> str:
+        """Get the access point occupied by a device, only online wireless clients occupy one."""
+        if device.known and device.status and device.interface_type == "802.11":
+            return device.connected_to
+        return ""
+
+    def _diff(self, host_states: Dict[str, Device], last_states: Dict[str, bool], reconfigure_all: bool) -> CycleDiff:
+        """Compare the complete view of all hosts with the last published states.
+
+        The attributes of a host are only published if they or the state of the
+        host changed. Once every `time_interval` the attributes of all hosts are
+        refreshed, so that their `last_update` attribute stays current. In the
+        single topic mode, the state is sent along with every attributes update.
+        """
+        now = self._clock.time()
+        current_time_str = datetime.fromtimestamp(now).astimezone().isoformat("T", "seconds")
+        diff = CycleDiff(timestamp=current_time_str)
+        refresh_attributes = reconfigure_all or now - self._attributes_refreshed >= self._config.tracker.time_interval
+        if refresh_attributes:
+            self._attributes_refreshed = now
+
+        for hostname, device in host_states.items():
+            if not device.status and self._registry.is_expired(hostname):
+                continue
+            if device.known:
+                if hostname not in self._registry or reconfigure_all:
+                    diff.hosts_to_create.append(hostname)
+                    diff.hosts_to_update[hostname] = device.status
+                    last_states[hostname] = device.status
+                    if hostname not in self._registry:
+                        self._registry.add(hostname, now)
+                if device.status:
+                    self._registry.seen(hostname, now)
+
+                if (
+                    hostname not in last_states
+                    or device.status != last_states[hostname]
+                    or self._config.tracker.send_state_always
+                ):
+                    diff.hosts_to_update[hostname] = device.status
+                    last_states[hostname] = device.status
+
+                attributes = self._get_attributes(device)
+                if (
+                    refresh_attributes
+                    or hostname in diff.hosts_to_update
+                    or self._published_attributes.get(hostname) != attributes
+                ):
+                    self._published_attributes[hostname] = attributes
+                    diff.host_attributes_to_update[hostname] = {**attributes, "last_update": current_time_str}
+                    if self._config.mqtt.single_topic:
+                        diff.hosts_to_update[hostname] = device.status
+
+            if self._ap_index:
+                access_point = self._get_access_point(device)
+                if self._ap_index.get_ap(hostname) != access_point:
+                    diff.access_point_changes[hostname] = access_point
+
+        self._expire_trackers(diff, last_states, now)
+        return diff
+
+    def _publish(self, diff: CycleDiff, timings: StageTimings) -> None:
+        """Publish the changes of one cycle."""
+        if self._registry.dirty:
+            with timings.measure("save state"):
                 self._state.save()
+            self._registry.dirty = False
 
-            if hosts_to_create:
-                LOGGER.debug("Create device tracker(s) for %d hosts: %s", len(hosts_to_create), hosts_to_create)
-                for hostname in hosts_to_create:
+        if diff.hosts_to_create:
+            LOGGER.debug("Create device tracker(s) for %d hosts: %s", len(diff.hosts_to_create), diff.hosts_to_create)
+            with timings.measure("publish", {"batch": "create", "messages": len(diff.hosts_to_create)}):
+                for hostname in diff.hosts_to_create:
                     self._mqtt.create_device_tracker(hostname)
-                time.sleep(10)  # To give home assistant time to create listeners on the state topic
+            with timings.measure("sleep", {"seconds": 10}):
+                self._clock.sleep(10)  # To give home assistant time to create listeners on the state topic
+
+        LOGGER.debug(
+            "Update state of %d and attributes of %d device tracker(s).",
+            len(diff.hosts_to_update),
+            len(diff.host_attributes_to_update),
+        )
+        with timings.measure("publish", {"batch": "update", "messages": len(diff.host_attributes_to_update)}):
+            for hostname, attributes in diff.host_attributes_to_update.items():
+                state = None
+                if hostname in diff.hosts_to_update:
+                    state = "home" if diff.hosts_to_update[hostname] else "not_home"
+                self._mqtt.update_device_tracker_state_and_attributes(hostname, state, attributes)
+
+        if diff.hosts_to_delete:
+            LOGGER.info(
+                "Delete expired device tracker(s) of %d hosts: %s", len(diff.hosts_to_delete), diff.hosts_to_delete
+            )
+            with timings.measure("delete", {"messages": len(diff.hosts_to_delete)}):
+                self._mqtt.delete_device_trackers(
+                    [self._mqtt.get_object_id(hostname) for hostname in diff.hosts_to_delete]
+                )
+
+        if self._ap_index:
+            with timings.measure("roaming"):
+                self._publish_roaming(diff)
+
+    def _publish_roaming(self, diff: CycleDiff) -> None:
+        """Update the access point index with the changes of one cycle and publish the results."""
+        assert self._ap_index is not None
+        for hostname, access_point in diff.access_point_changes.items():
+            event = self._ap_index.move(hostname, access_point, diff.timestamp)
+            if event:
+                self._mqtt.publish_roaming_event(event)
+
+        for access_point, hostnames in self._ap_index.pop_changed_aps().items():
+            if access_point not in self._created_ap_sensors:
+                self._mqtt.create_ap_sensor(access_point)
+                self._created_ap_sensors.add(access_point)
+            self._mqtt.update_ap_sensor(access_point, hostnames)
+
+    def _publish_snapshot(self, diff: CycleDiff, last_states: Dict[str, bool]) -> None:
+        """Update the aggregate snapshot with the changes of one cycle and publish it if it changed."""
+        assert self._snapshot is not None
+        entries = {
+            hostname: {
+                "state": "home" if last_states.get(hostname) else "not_home",
+                **{key: value for key, value in attributes.items() if key != "last_update"},
+            }
+            for hostname, attributes in diff.host_attributes_to_update.items()
+        }
+        snapshot_diff = self._snapshot.apply(entries, diff.hosts_to_delete, diff.timestamp)
+        if snapshot_diff:
+            self._mqtt.publish_snapshot(self._snapshot.get_snapshot(diff.timestamp), snapshot_diff)
+
+    def track_cycle(self, last_states: Dict[str, bool], timings: StageTimings) -> None:
+        """Perform a single tracking cycle.
+
+        The cycle is a pipeline of the stages fetch, normalise and merge (done by
+        the DeviceMonitor), followed by diff and publish. Arrivals reported by
+        the first routers are published while the remaining routers are still
+        being queried.
+        """
+        with self._lock:
+            reconfigure_all = self._reconfigure_all
+            self._reconfigure_all = False
+        if reconfigure_all and self._ap_index:
+            self._created_ap_sensors = set()
+            self._ap_index.mark_all_changed()
+
+        for update in self._monitor.iter_host_stati(timings):
+            if not update.complete:
+                if not reconfigure_all:
+                    with timings.measure("publish", {"batch": "arrivals", "router": update.router_name}):
+                        self._publish_arrivals(update.devices, last_states)
+                continue
+
+            if self._prober:
+                with timings.measure("confirm departures"):
+                    self._confirm_departures(update.devices, last_states)
+
+            with timings.measure("diff"):
+                diff = self._diff(update.devices, last_states, reconfigure_all)
+            with timings.span("publish changes"):
+                self._publish(diff, timings)
+            if self._snapshot:
+                with timings.measure("snapshot"):
+                    self._publish_snapshot(diff, last_states)
+
+            if self._history:
+                with timings.measure("history"):
+                    self._record_history(update.devices)
+
+    def _record_history(self, host_states: Dict[str, Device]) -> None:
+        """Record the presence of all known hosts in the history.
+
+        Hosts no longer listed by any router are recorded as departed.
+        """
+        assert self._history is not None
+        timestamp = self._clock.time()
+        known_hostnames = [hostname for hostname, device in host_states.items() if device.known]
+        for hostname in known_hostnames:
+            device = host_states[hostname]
+            self._history.record(hostname, device.status, device.connected_to, timestamp)
+        self._history.record_departures(known_hostnames, timestamp)
+        self._history.flush()
+
+    def _adopt_warm_view(self, last_states: Dict[str, bool]) -> None:
+        """Take over the device trackers and states published by the former leader."""
+        assert self._election is not None
+        warm_view = self._election.get_warm_view()
+        for hostname, status in warm_view.items():
+            if hostname not in self._registry:
+                self._registry.add(hostname, self._clock.time())
+            if status is not None:
+                last_states[hostname] = status
+        LOGGER.debug("Adopted %d device tracker(s) of the former leader.", len(warm_view))
+
+    def track(
+        self,
+        profiler: Optional[CycleProfiler] = None,
+        config_watcher: Optional[ConfigWatcher] = None,
+        span_writer: Optional[SpanWriter] = None,
+    ) -> None:
+        """The tracking main loop running until `stop()` is called.
+
+        If a ConfigWatcher is given, a reloaded configuration is applied before
+        the next cycle. If a SpanWriter is given, the spans of each cycle
+        including the following wait for the next router are written to it.
+        """
+        last_states: Dict[str, bool] = {}
+        if profiler is None:
+            profiler = CycleProfiler()
 
-            if hosts_to_update:
-                LOGGER.debug("Update state of %d device tracker(s).", len(hosts_to_update))
-                for hostname, status in hosts_to_update.items():
-                    self._mqtt.update_device_tracker(hostname, "home" if status else "not_home")
+        is_leader = False
+        while not self._stopped.is_set():
+            if config_watcher:
+                config = config_watcher.get_new_config()
+                if config:
+                    self.reload(config)
 
-            if host_attributes_to_update:
-                LOGGER.debug("Update attributes of %d device tracker(s).", len(hosts_to_update))
-                for hostname, attributes in host_attributes_to_update.items():
-                    self._mqtt.update_device_tracker_attributes(hostname, attributes)
+            if self._election:
+                if not self._election.update():
+                    if is_leader:
+                        LOGGER.info("Lost leadership, switching to standby.")
+                        is_leader = False
+                    self._clock.wait(self._stopped, 1.0)
+                    continue
+                if not is_leader:
+                    LOGGER.info("Became leader, taking over the tracking.")
+                    self._adopt_warm_view(last_states)
+                    is_leader = True
 
-            if hosts_to_delete:
-                LOGGER.debug("Delete device tracker(s) for %d hosts: %s", len(hosts_to_delete), hosts_to_delete)
-                for hostname in hosts_to_delete:
-                    self._mqtt.delete_device_tracker(hostname)
+            timings = StageTimings(record_spans=span_writer is not None)
+            with profiler.cycle():
+                self.track_cycle(last_states, timings)
 
-            LOGGER.debug("Sleeping for %d seconds.", self._config.tracker.time_interval)
-            time.sleep(self._config.tracker.time_interval)
+            sleep_time = self._monitor.time_until_next_poll()
+            LOGGER.debug("Sleeping for %.1f seconds until the next router is due.", sleep_time)
+            with timings.measure("wait", {"timeout": round(sleep_time, 3)}):
+                if self._clock.wait(self._wakeup, sleep_time):
+                    LOGGER.debug("Woken up by a presence change in the neighbour table or a configuration reload.")
+            self._wakeup.clear()
+            LOGGER.debug("Cycle finished in %s", timings)
+            if span_writer:
+                span_writer.write(timings)
 
     def cleanup(self) -> None:
-        """Clean all device trackers in home-assistant and remove the state."""
-        LOGGER.info("Deleting %d device tracker(s).", len(self._created_hostnames))
-        for hostname in self._created_hostnames:
-            self._mqtt.delete_device_tracker(hostname)
-        self._created_hostnames = []
-        self._state.data["CreatedHostnames"] = self._created_hostnames
+        """Clean all device trackers and access point sensors in home-assistant and remove the state."""
+        object_ids = {self._mqtt.get_object_id(hostname) for hostname in self._registry}
+        sensor_ids = set()
+        if self._config.roaming.enabled:
+            sensor_ids = {self._mqtt.get_ap_object_id(name) for name in get_access_point_names(self._config)}
+        if self._config.mqtt.node_id:
+            configs = self._mqtt.collect_configs(["device_tracker", "sensor"])
+            object_ids.update(configs["device_tracker"])
+            sensor_ids.update(configs["sensor"])
+        LOGGER.info("Deleting %d device tracker(s) and %d access point sensor(s).", len(object_ids), len(sensor_ids))
+        acknowledged = self._mqtt.delete_device_trackers(sorted(object_ids))
+        acknowledged += self._mqtt.delete_ap_sensors(sorted(sensor_ids))
+        deletions = len(object_ids) + len(sensor_ids)
+        if acknowledged != deletions:
+            LOGGER.warning("Only %d of %d deletion(s) were acknowledged by the broker.", acknowledged, deletions)
+        if self._config.snapshot.enabled:
+            self._mqtt.delete_snapshot()
+        self._registry.clear()
         self._state.save()
 
 
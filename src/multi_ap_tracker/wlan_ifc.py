@@ -0,0 +1,196 @@
+"""
+WLAN interface of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import logging
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from fritzconnection.core.exceptions import FritzConnectionException
+
+from .clock import Clock
+from .config import Wlan
+from .mac import format_mac
+
+if TYPE_CHECKING:
+    from .fritz_ifc import Device
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+LOGGER = logging.getLogger(__name__)
+WLAN_SERVICE = "WLANConfiguration"
+MAX_WLAN_SERVICES = 3
+FREQUENCY_BANDS = {"2400": "2.4 GHz", "5000": "5 GHz", "6000": "6 GHz"}
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+@dataclass
+class WlanInfo:
+    """Wireless link information of a client."""
+
+    router_name: str
+    signal: Optional[int]
+    speed: Optional[int]
+    band: str
+    fetched: float
+
+
+# pylint: disable=too-few-public-methods
+class WlanEnricher:
+    """Enrich the wireless devices with signal strength, band and link speed.
+
+    The information is fetched using the `GetSpecificAssociatedDeviceInfo`
+    action of the WLANConfiguration services of the router a device is
+    connected to and cached per MAC address. Every cycle, at most `budget`
+    TR-064 calls are made. Devices without information or connected to another
+    router than the cached information are fetched first, followed by the
+    devices with the oldest information older than `refresh_interval` seconds.
+    The WLANConfiguration service of each client and the band of each service
+    are cached as well, so that a refresh normally costs a single call. Clients
+    not found by any service are not queried again before `refresh_interval`.
+    The caches are pruned when the clients or the routers disappear.
+    """
+
+    def __init__(self, config: Wlan, clock: Clock) -> None:
+        """Initialize this object."""
+        self.config = config
+        self._clock = clock
+        self._infos: Dict[int, WlanInfo] = {}
+        self._services: Dict[Tuple[str, int], int] = {}
+        self._bands: Dict[Tuple[str, int], str] = {}
+        self._calls = 0
+
+    def enrich(self, connections: Dict[str, Any], devices: Dict[int, "Device"]) -> None:
+        """Refresh the information within the budget and add it to the devices.
+
+        The `connections` dictionary maps the router names to their
+        FritzConnection objects, the `devices` dictionary maps the MAC
+        addresses to the devices.
+        """
+        now = self._clock.monotonic()
+        candidates: List[Tuple[int, float, int]] = []
+        for mac, device in devices.items():
+            if not (device.status and device.interface_type == "802.11" and device.connected_to in connections):
+                continue
+            info = self._infos.get(mac)
+            if info is None or info.router_name != device.connected_to:
+                candidates.append((0, 0.0, mac))
+            elif now - info.fetched >= self.config.refresh_interval:
+                candidates.append((1, info.fetched, mac))
+
+        self._calls = 0
+        num_refreshed = 0
+        for _, _, mac in sorted(candidates):
+            if self._calls >= self.config.budget:
+                break
+            router_name = devices[mac].connected_to
+            info = self._fetch(connections[router_name], router_name, mac, now)
+            if info:
+                self._infos[mac] = info
+                num_refreshed += 1
+        LOGGER.debug(
+            "Refreshed WLAN information of %d of %d client(s) using %d call(s).",
+            num_refreshed,
+            len(candidates),
+            self._calls,
+        )
+
+        self._prune(connections, devices)
+        for mac, info in self._infos.items():
+            device = devices[mac]
+            if device.status and info.router_name == device.connected_to:
+                device.signal = info.signal
+                device.speed = info.speed
+                device.band = info.band
+
+    def _prune(self, connections: Dict[str, Any], devices: Dict[int, "Device"]) -> None:
+        """Remove the cached information of disappeared clients and routers."""
+        for mac in list(self._infos):
+            if mac not in devices:
+                del self._infos[mac]
+        for router_name, mac in list(self._services):
+            if mac not in devices or router_name not in connections:
+                del self._services[(router_name, mac)]
+        for router_name, service in list(self._bands):
+            if router_name not in connections:
+                del self._bands[(router_name, service)]
+
+    def _call(self, connection: Any, service: int, action: str, **kwargs) -> Dict[str, Any]:
+        """Call an action of a WLANConfiguration service and count the call."""
+        self._calls += 1
+        return connection.call_action(f"{WLAN_SERVICE}{service}", action, **kwargs)
+
+    def _fetch(self, connection: Any, router_name: str, mac: int, now: float) -> Optional[WlanInfo]:
+        """Fetch the information of a client, starting with its last known service."""
+        last_service = self._services.get((router_name, mac))
+        services = list(range(1, MAX_WLAN_SERVICES + 1))
+        if last_service:
+            services.remove(last_service)
+            services.insert(0, last_service)
+
+        for service in services:
+            if self._calls >= self.config.budget:
+                return None
+            try:
+                result = self._call(
+                    connection,
+                    service,
+                    "GetSpecificAssociatedDeviceInfo",
+                    NewAssociatedDeviceMACAddress=format_mac(mac),
+                )
+            except (FritzConnectionException, OSError) as exception:
+                LOGGER.debug(
+                    "No WLAN information of %s at %s service %d: %s", format_mac(mac), router_name, service, exception
+                )
+                continue
+            self._services[(router_name, mac)] = service
+            return WlanInfo(
+                router_name=router_name,
+                signal=result.get("NewX_AVM-DE_SignalStrength"),
+                speed=result.get("NewX_AVM-DE_Speed"),
+                band=self._get_band(connection, router_name, service),
+                fetched=now,
+            )
+        return WlanInfo(router_name=router_name, signal=None, speed=None, band="", fetched=now)
+
+    def _get_band(self, connection: Any, router_name: str, service: int) -> str:
+        """Get the band of a WLANConfiguration service.
+
+        The frequency band reported by the router is used if available. Older
+        firmware versions report the channel only, which can't distinguish the
+        6 GHz band from the 2.4 GHz band.
+        """
+        key = (router_name, service)
+        if key not in self._bands:
+            try:
+                result = self._call(connection, service, "GetInfo")
+                frequency_band = str(result.get("NewX_AVM-DE_FrequencyBand") or "")
+                if frequency_band:
+                    band = FREQUENCY_BANDS.get(frequency_band, f"{int(frequency_band) / 1000:g} GHz")
+                else:
+                    band = "2.4 GHz" if int(result["NewChannel"]) <= 14 else "5 GHz"
+            except (FritzConnectionException, OSError, KeyError, ValueError):
+                return ""
+            self._bands[key] = band
+        return self._bands[key]
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
@@ -0,0 +1,342 @@
+"""
+Local MQTT broker stand-in of the ha_multi_ap_tracker tests.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import logging
+import socket
+import struct
+import time
+from threading import Lock, Thread
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+LOGGER = logging.getLogger(__name__)
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+PublishListener = Callable[[str, bytes, bool, str], None]
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """Check if the topic matches the topic filter with the wildcards `+` and `#`."""
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for index, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if index >= len(topic_levels) or level not in ("+", topic_levels[index]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def wait_for(condition: Callable[[], bool], timeout: float = 5.0) -> bool:
+    """Wait until the condition is met, e.g., a message arrived at the broker, and return False on a timeout."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def _encode_string(text: str) -> bytes:
+    """Encode a string with its length prefix."""
+    data = text.encode("utf-8")
+    return struct.pack("!H", len(data)) + data
+
+
+def _decode_string(data: bytes, offset: int) -> Tuple[str, int]:
+    """Decode a length prefixed string at the offset and return it with the offset after it."""
+    start = offset + 2
+    end = start + struct.unpack_from("!H", data, offset)[0]
+    return data[start:end].decode("utf-8"), end
+
+
+def _encode_packet(packet_type: int, flags: int, body: bytes) -> bytes:
+    """Encode a packet with the fixed header."""
+    header = bytearray([packet_type << 4 | flags])
+    length = len(body)
+    while True:
+        byte, length = length % 128, length // 128
+        header.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(header) + body
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+class _Session:
+    """Connection of a single client to the SimulatedBroker."""
+
+    def __init__(self, broker: "SimulatedBroker", connection: socket.socket) -> None:
+        """Initialize this object."""
+        self.client_id = ""
+        self.subscriptions: Set[str] = set()
+        self._broker = broker
+        self._connection = connection
+        self._send_lock = Lock()
+        self._will: Optional[Tuple[str, bytes, bool]] = None
+
+    def send(self, packet_type: int, flags: int, body: bytes) -> None:
+        """Send a packet to the client, ignoring errors of a closed connection."""
+        try:
+            with self._send_lock:
+                self._connection.sendall(_encode_packet(packet_type, flags, body))
+        except OSError:
+            pass
+
+    def send_publish(self, topic: str, payload: bytes, retain: bool) -> None:
+        """Deliver a message to the client with QoS 0."""
+        self.send(PUBLISH, 1 if retain else 0, _encode_string(topic) + payload)
+
+    def close(self) -> None:
+        """Close the connection."""
+        try:
+            self._connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._connection.close()
+
+    def _read_exact(self, size: int) -> bytes:
+        """Read the given number of bytes or raise a ConnectionError if the connection was closed."""
+        data = b""
+        while len(data) < size:
+            chunk = self._connection.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Connection closed")
+            data += chunk
+        return data
+
+    def _read_packet(self) -> Tuple[int, int, bytes]:
+        """Read a packet and return its type, flags and body."""
+        first = self._read_exact(1)[0]
+        length = 0
+        multiplier = 1
+        while True:
+            byte = self._read_exact(1)[0]
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+        return first >> 4, first & 0x0F, self._read_exact(length)
+
+    def _handle_connect(self, body: bytes) -> None:
+        """Handle the CONNECT packet."""
+        _, offset = _decode_string(body, 0)
+        flags = body[offset + 1]
+        self.client_id, offset = _decode_string(body, offset + 4)
+        if flags & 0x04:
+            will_topic, offset = _decode_string(body, offset)
+            start = offset + 2
+            end = start + struct.unpack_from("!H", body, offset)[0]
+            self._will = (will_topic, body[start:end], bool(flags & 0x20))
+        self.send(CONNACK, 0, b"\x00\x00")
+
+    def _handle_publish(self, flags: int, body: bytes) -> None:
+        """Handle a PUBLISH packet of the client."""
+        topic, offset = _decode_string(body, 0)
+        qos = (flags >> 1) & 0x03
+        if qos:
+            packet_id, offset = body[offset:][:2], offset + 2
+            self.send(PUBACK if qos == 1 else PUBREC, 0, packet_id)
+        self._broker.publish(topic, body[offset:], bool(flags & 0x01), self.client_id)
+
+    def _handle_subscribe(self, body: bytes) -> None:
+        """Handle a SUBSCRIBE packet granting QoS 0 and deliver the matching retained messages."""
+        offset = 2
+        topic_filters = []
+        while offset < len(body):
+            topic_filter, offset = _decode_string(body, offset)
+            topic_filters.append(topic_filter)
+            offset += 1
+        self.send(SUBACK, 0, body[:2] + bytes(len(topic_filters)))
+        for topic_filter in topic_filters:
+            self.subscriptions.add(topic_filter)
+            for topic, payload in self._broker.get_retained(topic_filter):
+                self.send_publish(topic, payload, True)
+
+    def _handle_unsubscribe(self, body: bytes) -> None:
+        """Handle an UNSUBSCRIBE packet."""
+        offset = 2
+        while offset < len(body):
+            topic_filter, offset = _decode_string(body, offset)
+            self.subscriptions.discard(topic_filter)
+        self.send(UNSUBACK, 0, body[:2])
+
+    def run(self) -> None:
+        """Process the packets of the client until the connection is closed."""
+        graceful = False
+        try:
+            while True:
+                packet_type, flags, body = self._read_packet()
+                if packet_type == CONNECT:
+                    self._handle_connect(body)
+                elif packet_type == PUBLISH:
+                    self._handle_publish(flags, body)
+                elif packet_type == PUBREL:
+                    self.send(PUBCOMP, 0, body[:2])
+                elif packet_type == SUBSCRIBE:
+                    self._handle_subscribe(body)
+                elif packet_type == UNSUBSCRIBE:
+                    self._handle_unsubscribe(body)
+                elif packet_type == PINGREQ:
+                    self.send(PINGRESP, 0, b"")
+                elif packet_type == DISCONNECT:
+                    graceful = True
+                    break
+        except (OSError, IndexError, struct.error, UnicodeDecodeError):
+            pass
+        self._broker.remove_session(self, None if graceful else self._will)
+        self.close()
+
+
+# pylint: disable=too-many-instance-attributes
+class SimulatedBroker:
+    """Minimal MQTT 3.1.1 broker on the loopback interface.
+
+    The broker supports everything the tracker and paho need: QoS 0 delivery
+    (higher QoS levels of published messages are acknowledged), retained
+    messages, wildcard subscriptions and last wills. Listeners are called for
+    every published message with the topic, the payload, the retain flag and the
+    client ID of the sender. Stopping the broker drops all connections, like a
+    restart of a real broker; the retained messages are lost unless the broker
+    is `persistent`. The number of accepted connections is counted in
+    `connections`.
+    """
+
+    def __init__(self, persistent: bool = False) -> None:
+        """Initialize this object."""
+        self.port = 0
+        self.persistent = persistent
+        self.running = False
+        self.connections = 0
+        self._lock = Lock()
+        self._retained: Dict[str, bytes] = {}
+        self._sessions: List[_Session] = []
+        self._listeners: List[PublishListener] = []
+        self._server: Optional[socket.socket] = None
+
+    def add_listener(self, listener: PublishListener) -> None:
+        """Add a listener called for every published message."""
+        self._listeners.append(listener)
+
+    def start(self) -> None:
+        """Start to accept connections, using the same port as before on a restart."""
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(("127.0.0.1", self.port))
+        self._server.listen()
+        self.port = self._server.getsockname()[1]
+        self.running = True
+        Thread(target=self._accept, args=(self._server,), daemon=True).start()
+        LOGGER.debug("Simulated broker listening on port %d.", self.port)
+
+    def stop(self) -> None:
+        """Stop the broker and drop all connections."""
+        self.running = False
+        if self._server:
+            try:
+                self._server.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._server.close()
+            self._server = None
+        with self._lock:
+            sessions = self._sessions
+            self._sessions = []
+            if not self.persistent:
+                self._retained = {}
+        for session in sessions:
+            session.close()
+        LOGGER.debug("Simulated broker stopped.")
+
+    def _accept(self, server: socket.socket) -> None:
+        """Accept connections until the server socket is closed."""
+        while True:
+            try:
+                connection, _ = server.accept()
+            except OSError:
+                return
+            session = _Session(self, connection)
+            with self._lock:
+                self._sessions.append(session)
+                self.connections += 1
+            Thread(target=session.run, daemon=True).start()
+
+    def remove_session(self, session: _Session, will: Optional[Tuple[str, bytes, bool]]) -> None:
+        """Remove a closed session and publish its last will if given."""
+        with self._lock:
+            if session not in self._sessions:
+                return
+            self._sessions.remove(session)
+        if will and self.running:
+            self.publish(will[0], will[1], will[2], session.client_id)
+
+    @property
+    def clients(self) -> List[str]:
+        """The client IDs of the connected clients."""
+        with self._lock:
+            return [session.client_id for session in self._sessions if session.client_id]
+
+    def drop(self, client_id: str) -> None:
+        """Drop the connection of a client without a DISCONNECT, so that its last will is published."""
+        with self._lock:
+            sessions = [session for session in self._sessions if session.client_id == client_id]
+        for session in sessions:
+            session.close()
+
+    def get_retained(self, topic_filter: str) -> List[Tuple[str, bytes]]:
+        """Get the retained messages matching the topic filter."""
+        with self._lock:
+            return [(topic, payload) for topic, payload in self._retained.items() if topic_matches(topic_filter, topic)]
+
+    def publish(self, topic: str, payload: bytes, retain: bool = False, client_id: str = "") -> None:
+        """Publish a message to all subscribed clients and the listeners."""
+        with self._lock:
+            if retain:
+                if payload:
+                    self._retained[topic] = payload
+                else:
+                    self._retained.pop(topic, None)
+            sessions = list(self._sessions)
+        for listener in self._listeners:
+            listener(topic, payload, retain, client_id)
+        for session in sessions:
+            if any(topic_matches(topic_filter, topic) for topic_filter in session.subscriptions):
+                session.send_publish(topic, payload, False)
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
@@ -0,0 +1,46 @@
+"""
+Configuration of the pytest suite of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import pytest
+
+
+# -----------------------------------------------------------------------------
+# Hooks
+# -----------------------------------------------------------------------------
+def pytest_addoption(parser):
+    """Add the --run-slow option."""
+    parser.addoption("--run-slow", action="store_true", default=False, help="Run the tests marked as slow.")
+
+
+def pytest_configure(config):
+    """Register the slow marker."""
+    config.addinivalue_line("markers", "slow: test running for a minute or longer, enabled by --run-slow")
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skip the tests marked as slow unless --run-slow is given."""
+    if config.getoption("--run-slow"):
+        return
+    skip_slow = pytest.mark.skip(reason="Slow test, enable it using --run-slow.")
+    for item in items:
+        if "slow" in item.keywords:
+            item.add_marker(skip_slow)
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
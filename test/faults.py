@@ -0,0 +1,463 @@
+"""
+Fault-injection harness of the ha_multi_ap_tracker tests.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import json
+import logging
+import random
+import tempfile
+import time
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from pathlib import Path
+from threading import Thread
+from typing import Dict, List, Optional, Tuple
+
+from broker import SimulatedBroker
+from multi_ap_tracker.clock import SYSTEM_CLOCK, Clock
+from multi_ap_tracker.config import Config, Mqtt, Repeater
+from multi_ap_tracker.fritz_ifc import get_router_configs
+from multi_ap_tracker.state import State
+from multi_ap_tracker.tracker import Tracker
+from simulator import SimulatedHosts, SimulatedRouter
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+LOGGER = logging.getLogger(__name__)
+FAULT_KINDS = ("repeater", "broker", "ha")
+TICK = 0.1
+
+View = Dict[str, Tuple[bool, str]]
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+@dataclass
+class Fault:
+    """A fault injected `start` seconds after the start of a run for `duration` seconds.
+
+    The kinds are a reboot of the first repeater (`repeater`), a restart of the
+    MQTT broker (`broker`) and a restart of home-assistant (`ha`).
+    """
+
+    kind: str
+    start: float
+    duration: float
+
+    @classmethod
+    def parse(cls, text: str) -> "Fault":
+        """Parse a fault given as `KIND@START+DURATION`, e.g., `broker@30+5`."""
+        kind, _, timing = text.partition("@")
+        start, _, duration = timing.partition("+")
+        if kind not in FAULT_KINDS or not start:
+            raise ValueError(f"Invalid fault {text}, expected KIND@START+DURATION with KIND one of {FAULT_KINDS}!")
+        return cls(kind, float(start), float(duration or 0))
+
+    @property
+    def end(self) -> float:
+        """The end of the fault in seconds after the start of the run."""
+        return self.start + self.duration
+
+    def __str__(self) -> str:
+        """Return the string representation of this object."""
+        return f"{self.kind}@{self.start:g}+{self.duration:g}"
+
+
+@dataclass
+class FaultResult:
+    """The measurements of a single fault.
+
+    The recovery time is measured from the end of the fault until the view of
+    home-assistant matches the simulated network again (None if it did not
+    recover before the next fault or the end of the run). The state changes
+    never seen by home-assistant are counted from the start of the fault until
+    the recovery. The messages not changing the view of home-assistant and the
+    MQTT messages and router calls above the baseline rates are counted from the
+    start of the fault until the next fault, as the tracker may still republish
+    after the view recovered.
+    """
+
+    fault: Fault
+    recovery: Optional[float] = None
+    lost: int = 0
+    duplicated: int = 0
+    extra_messages: float = 0.0
+    extra_calls: float = 0.0
+
+
+@dataclass
+class _SimulatedHost:
+    """A host of the SimulatedNetwork going online and offline at the `toggles`."""
+
+    name: str
+    mac: str
+    ip: str
+    router: str
+    online: bool
+    toggles: List[float] = field(default_factory=lambda: [])
+
+    def is_online(self, elapsed: float) -> bool:
+        """Check if the host is online at the given time."""
+        return self.online != bool(bisect_right(self.toggles, elapsed) % 2)
+
+
+class SimulatedNetwork:
+    """Hosts going online and offline at the simulated routers.
+
+    Every host is connected to one router and goes online and offline after
+    exponentially distributed dwell times. While a repeater is down, its hosts
+    are connected to the Fritz!Box. The Fritz!Box lists all hosts, the ones not
+    connected to it as offline. The network is the source of the replacements
+    of FritzHosts of the DeviceMonitor, like a trace replay.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self, router_names: List[str], *, num_hosts: int, mean_dwell: float, duration: float, latency: float, seed: int
+    ) -> None:
+        """Initialize this object."""
+        self.clock: Clock = SYSTEM_CLOCK
+        self.routers = {name: SimulatedRouter(0, latency) for name in router_names}
+        self._fritzbox = router_names[0]
+        self._view: Optional[View] = None
+        rng = random.Random(seed)
+        self.hosts: List[_SimulatedHost] = []
+        for index in range(num_hosts):
+            host = _SimulatedHost(
+                name=f"host-{index:03d}",
+                mac=f"00:11:22:00:{index // 256:02X}:{index % 256:02X}",
+                ip=f"192.168.178.{index + 20}",
+                router=router_names[index % len(router_names)],
+                online=rng.random() < 0.7,
+            )
+            toggle = rng.expovariate(1.0 / mean_dwell)
+            while toggle < duration:
+                host.toggles.append(toggle)
+                toggle += rng.expovariate(1.0 / mean_dwell)
+            self.hosts.append(host)
+
+    def create_hosts(self, router_name: str) -> SimulatedHosts:
+        """Create the replacement of FritzHosts of the given router."""
+        return self.routers[router_name].create_session()
+
+    def get_state_changes(self) -> List[Tuple[float, str, bool]]:
+        """Get all state changes of the hosts as tuples of time, host name and new state."""
+        return sorted((toggle, host.name, host.is_online(toggle)) for host in self.hosts for toggle in host.toggles)
+
+    def get_view(self, elapsed: float) -> View:
+        """Get the state and the connected router of all hosts at the given time."""
+        view = {}
+        for host in self.hosts:
+            online = host.is_online(elapsed)
+            router = host.router if not self.routers[host.router].down else self._fritzbox
+            view[host.name] = (online, router if online else "")
+        return view
+
+    def update(self, elapsed: float) -> None:
+        """Update the host tables of the routers if the view changed."""
+        view = self.get_view(elapsed)
+        if view == self._view:
+            return
+        self._view = view
+        for name, router in self.routers.items():
+            router.set_host_table(
+                [
+                    {
+                        "ip": host.ip,
+                        "name": host.name,
+                        "mac": host.mac,
+                        "status": view[host.name][1] == name,
+                        "interface_type": "802.11",
+                        "address_source": "DHCP",
+                        "lease_time_remaining": 0,
+                    }
+                    for host in self.hosts
+                    if name in (self._fritzbox, view[host.name][1])
+                ]
+            )
+
+    def get_calls(self) -> int:
+        """Get the total number of calls of all routers."""
+        return sum(router.calls for router in self.routers.values())
+
+
+# pylint: disable=too-many-instance-attributes
+class HomeAssistantObserver:
+    """Stand-in of home-assistant following the device trackers via the SimulatedBroker.
+
+    The device trackers are discovered by their retained configuration
+    messages. The observer keeps the state and the connected router of each
+    device tracker, and counts all messages of the tracker and the ones not
+    changing its view. A restart of home-assistant loses all states and
+    announces itself on the home-assistant state topic.
+    """
+
+    def __init__(self, broker: SimulatedBroker, config: Mqtt, start: float) -> None:
+        """Initialize this object."""
+        self.online = True
+        self.messages = 0
+        self.duplicates = 0
+        self.history: Dict[str, List[Tuple[float, bool]]] = {}
+        self._broker = broker
+        self._config = config
+        self._start = start
+        self._config_prefix = f"{config.discovery_prefix}/device_tracker/"
+        self._configs: Dict[str, bytes] = {}
+        self._state_topics: Dict[str, str] = {}
+        self._attributes_topics: Dict[str, str] = {}
+        self._states: Dict[str, Tuple[Optional[bool], str]] = {}
+        broker.add_listener(self._on_publish)
+
+    def _on_publish(self, topic: str, payload: bytes, _retain: bool, client_id: str) -> None:
+        """Process a message published on the broker."""
+        if not client_id:
+            return
+        self.messages += 1
+        if not self.online:
+            return
+        if topic.startswith(self._config_prefix):
+            self._on_config(topic, payload)
+        elif topic in self._state_topics:
+            self._on_state(self._state_topics[topic], payload)
+        elif topic in self._attributes_topics:
+            hostname = self._attributes_topics[topic]
+            state = self._states.get(hostname, (None, ""))
+            self._states[hostname] = (state[0], json.loads(payload).get("connected_to", ""))
+
+    def _on_config(self, topic: str, payload: bytes) -> None:
+        """Process the configuration message of a device tracker."""
+        if self._configs.get(topic) == payload:
+            self.duplicates += 1
+            return
+        self._configs[topic] = payload
+        if payload:
+            data = json.loads(payload)
+            prefix_length = len(self._config.name_prefix)
+            hostname = data["name"][prefix_length:]
+            self._state_topics[data["state_topic"]] = hostname
+            self._attributes_topics[data["json_attributes_topic"]] = hostname
+            self._states.setdefault(hostname, (None, ""))
+
+    def _on_state(self, hostname: str, payload: bytes) -> None:
+        """Process the state message of a device tracker."""
+        old_state = self._states.get(hostname, (None, ""))
+        if payload.startswith(b"{"):
+            data = json.loads(payload)
+            state = (data["state"] == "home", data["attributes"].get("connected_to", ""))
+        else:
+            state = (payload == b"home", old_state[1])
+        if state == old_state:
+            self.duplicates += 1
+        self._states[hostname] = state
+        self.history.setdefault(hostname, []).append((time.monotonic() - self._start, bool(state[0])))
+
+    def get_view(self) -> View:
+        """Get the state and the connected router of all device trackers with a known state."""
+        return {
+            hostname: (state, connected_to if state else "")
+            for hostname, (state, connected_to) in self._states.items()
+            if state is not None
+        }
+
+    def has_all_configs(self, hostnames: List[str]) -> bool:
+        """Check if the broker has retained the configurations of all given hosts."""
+        retained = {json.loads(payload)["name"] for _, payload in self._broker.get_retained(f"{self._config_prefix}#")}
+        return all(f"{self._config.name_prefix}{hostname}" in retained for hostname in hostnames)
+
+    def stop(self) -> None:
+        """Shut down home-assistant, losing all device trackers and states."""
+        self._broker.publish(self._config.ha_state_topic, b"offline")
+        self.online = False
+        self._configs = {}
+        self._state_topics = {}
+        self._attributes_topics = {}
+        self._states = {}
+
+    def start(self) -> None:
+        """Start home-assistant, discovering the device trackers by their retained configurations."""
+        self.online = True
+        for topic, payload in self._broker.get_retained(f"{self._config_prefix}#"):
+            self._on_config(topic, payload)
+        self._broker.publish(self._config.ha_state_topic, b"online")
+
+
+# pylint: disable=too-few-public-methods
+class FaultHarness:
+    """Run the tracker against local stand-ins of the routers, the broker and home-assistant.
+
+    The tracker is configured with a Fritz!Box and the given number of
+    repeaters of a SimulatedNetwork, a SimulatedBroker and a
+    HomeAssistantObserver. Faults are injected on a schedule while the view of
+    home-assistant is compared with the simulated network every 100 ms. Faults
+    of the kind `repeater` require at least one repeater.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        *,
+        num_hosts: int = 20,
+        num_repeaters: int = 2,
+        poll_interval: int = 2,
+        mean_dwell: float = 300.0,
+        latency: float = 0.002,
+        persistent: bool = False,
+        seed: int = 0,
+    ) -> None:
+        """Initialize this object."""
+        self.config = Config()
+        self.config.mqtt = Mqtt(address="127.0.0.1", client_id="ha_multi_ap_tracker-faults")
+        self.config.repeater = [Repeater(address=f"repeater{index + 1}") for index in range(num_repeaters)]
+        self.config.tracker.time_interval = poll_interval
+        self._num_hosts = num_hosts
+        self._mean_dwell = mean_dwell
+        self._latency = latency
+        self._persistent = persistent
+        self._seed = seed
+        self.initial_sync: Optional[float] = None
+
+    # pylint: disable=too-many-locals
+    def run(self, faults: List[Fault], duration: float) -> List[FaultResult]:
+        """Run the tracker for `duration` seconds, injecting the faults, and return the measurements."""
+        router_names = [name for name, _ in get_router_configs(self.config)]
+        if len(router_names) < 2 and any(fault.kind == "repeater" for fault in faults):
+            raise ValueError("Repeater faults require at least one repeater!")
+        network = SimulatedNetwork(
+            router_names,
+            num_hosts=self._num_hosts,
+            mean_dwell=self._mean_dwell,
+            duration=duration,
+            latency=self._latency,
+            seed=self._seed,
+        )
+        network.update(0.0)
+        broker = SimulatedBroker(self._persistent)
+        broker.start()
+        self.config.mqtt.port = broker.port
+        start = time.monotonic()
+        observer = HomeAssistantObserver(broker, self.config.mqtt, start)
+        hostnames = [host.name for host in network.hosts]
+
+        samples: List[Tuple[float, bool, int, int, int]] = []
+        with tempfile.TemporaryDirectory() as state_directory:
+            tracker = Tracker(self.config, State(Path(state_directory) / "state.yml"), replay=network)
+            thread = Thread(target=tracker.track, daemon=True)
+            thread.start()
+            events = sorted(
+                [(fault.start, True, fault) for fault in faults] + [(fault.end, False, fault) for fault in faults],
+                key=lambda event: event[0],
+            )
+            while True:
+                elapsed = time.monotonic() - start
+                if elapsed >= duration:
+                    break
+                while events and events[0][0] <= elapsed:
+                    _, begin, fault = events.pop(0)
+                    self._inject(fault, begin, network, broker, observer)
+                network.update(elapsed)
+                in_sync = observer.get_view() == network.get_view(elapsed) and observer.has_all_configs(hostnames)
+                samples.append((elapsed, in_sync, observer.messages, observer.duplicates, network.get_calls()))
+                time.sleep(TICK)
+            tracker.stop()
+            thread.join()
+            tracker.close()
+        broker.stop()
+        return self._evaluate(faults, duration, samples, network.get_state_changes(), observer.history)
+
+    @staticmethod
+    def _inject(
+        fault: Fault, begin: bool, network: SimulatedNetwork, broker: SimulatedBroker, observer: HomeAssistantObserver
+    ) -> None:
+        """Begin or end a fault."""
+        LOGGER.info("%s fault %s.", "Injecting" if begin else "Ending", fault)
+        if fault.kind == "repeater":
+            list(network.routers.values())[1].down = begin
+        elif fault.kind == "broker":
+            if begin:
+                broker.stop()
+            else:
+                broker.start()
+                # home-assistant reconnects and announces itself again
+                observer.start()
+        elif begin:
+            observer.stop()
+        else:
+            observer.start()
+
+    # pylint: disable=too-many-locals
+    def _evaluate(
+        self,
+        faults: List[Fault],
+        duration: float,
+        samples: List[Tuple[float, bool, int, int, int]],
+        state_changes: List[Tuple[float, str, bool]],
+        history: Dict[str, List[Tuple[float, bool]]],
+    ) -> List[FaultResult]:
+        """Evaluate the samples of a run.
+
+        The baseline rates of the counters are measured from the initial
+        synchronization to the start of the first fault.
+        """
+        times = [sample[0] for sample in samples]
+
+        def sample_at(elapsed: float) -> Tuple[float, bool, int, int, int]:
+            return samples[max(0, bisect_right(times, elapsed) - 1)]
+
+        def first_sync(begin: float, end: float) -> Optional[float]:
+            return next((sample[0] for sample in samples if begin <= sample[0] < end and sample[1]), None)
+
+        def get_counts(begin: float, end: float) -> List[float]:
+            begin_sample, end_sample = sample_at(begin), sample_at(end)
+            return [end_sample[index] - begin_sample[index] for index in (0, 2, 3, 4)]
+
+        starts = sorted(fault.start for fault in faults)
+        self.initial_sync = first_sync(0.0, starts[0] if starts else duration)
+        baseline = [0.0, 0.0, 0.0, 0.0]
+        if self.initial_sync is not None:
+            baseline = get_counts(self.initial_sync, starts[0] if starts else duration)
+        rates = [count / baseline[0] if baseline[0] > 0 else 0.0 for count in baseline[1:]]
+
+        next_changes: Dict[Tuple[float, str], float] = {}
+        last_change: Dict[str, float] = {}
+        for elapsed, hostname, _ in reversed(state_changes):
+            next_changes[(elapsed, hostname)] = last_change.get(hostname, duration)
+            last_change[hostname] = elapsed
+
+        results = []
+        for fault in faults:
+            limit = next((start for start in starts if start > fault.start), duration)
+            recovered = first_sync(fault.end, limit)
+            result = FaultResult(fault, None if recovered is None else recovered - fault.end)
+            length, messages, duplicates, calls = get_counts(fault.start, limit)
+            result.duplicated = round(duplicates - rates[1] * length)
+            result.extra_messages = messages - rates[0] * length
+            result.extra_calls = calls - rates[2] * length
+            window_end = limit if recovered is None else recovered
+            for elapsed, hostname, state in state_changes:
+                if fault.start <= elapsed < window_end and not any(
+                    elapsed <= seen < next_changes[(elapsed, hostname)] and seen_state == state
+                    for seen, seen_state in history.get(hostname, [])
+                ):
+                    result.lost += 1
+            results.append(result)
+        return results
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
@@ -0,0 +1,124 @@
+"""
+Local router simulator of the ha_multi_ap_tracker tests.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import logging
+import random
+import time
+from threading import BoundedSemaphore, Lock
+from typing import Any, Dict, List
+
+from multi_ap_tracker.host_table import HOST_ENTRY_KEYS, get_host_entries
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+LOGGER = logging.getLogger(__name__)
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+class SimulatedRouter:
+    """A simulated router with a host table of `num_hosts` entries.
+
+    Every TR-064 call takes `latency` seconds of router time. The router
+    processes at most `cpus` calls at the same time, further calls wait for a
+    free CPU, as a real Fritz!Box serializes the requests on its few cores.
+    The host table is generated from the `seed`, so that all runs of a
+    benchmark see the same table, and can be replaced by `set_host_table()`.
+    While the router is `down`, e.g., during a reboot, every call fails with a
+    ConnectionRefusedError.
+    """
+
+    def __init__(self, num_hosts: int, latency: float, cpus: int = 2, seed: int = 0) -> None:
+        """Initialize this object."""
+        self.latency = latency
+        self.calls = 0
+        self.down = False
+        self._cpus = BoundedSemaphore(cpus)
+        self._lock = Lock()
+        rng = random.Random(seed)
+        self._entries: List[Dict[str, Any]] = []
+        for index in range(num_hosts):
+            active = rng.random() < 0.3
+            self._entries.append(
+                {
+                    "NewIPAddress": f"192.168.{index // 250}.{index % 250 + 2}" if active else "",
+                    "NewHostName": f"host-{index:04d}",
+                    "NewMACAddress": ":".join(f"{rng.randrange(256):02X}" for _ in range(6)),
+                    "NewActive": active,
+                    "NewInterfaceType": rng.choice(["802.11", "Ethernet"]),
+                    "NewAddressSource": "DHCP",
+                    "NewLeaseTimeRemaining": 0,
+                }
+            )
+
+    def set_host_table(self, hosts: List[Dict[str, Any]]) -> None:
+        """Replace the host table by host entries in the format of `FritzHosts.get_hosts_info()`."""
+        self._entries = [{action_key: host[key] for key, action_key in HOST_ENTRY_KEYS.items()} for host in hosts]
+
+    def call(self, action: str, **kwargs) -> Dict[str, Any]:
+        """Process a single call taking the latency of the router."""
+        if self.down:
+            raise ConnectionRefusedError(f"Simulated router is down, call {action} refused")
+        with self._cpus:
+            with self._lock:
+                self.calls += 1
+            time.sleep(self.latency)
+        if action == "GetHostNumberOfEntries":
+            return {"NewHostNumberOfEntries": len(self._entries)}
+        if action == "GetGenericHostEntry":
+            index = kwargs["NewIndex"]
+            if index >= len(self._entries):
+                raise IndexError(f"Host index {index} out of range")
+            return dict(self._entries[index])
+        raise ValueError(f"Unsupported action {action}!")
+
+    def create_session(self) -> "SimulatedHosts":
+        """Create a new session (connection) to this router."""
+        return SimulatedHosts(self)
+
+
+class SimulatedHosts:
+    """Replacement of FritzHosts connected to a SimulatedRouter."""
+
+    def __init__(self, router: SimulatedRouter) -> None:
+        """Initialize this object."""
+        self._router = router
+
+    @property
+    def host_numbers(self) -> int:
+        """The number of known hosts."""
+        return self._router.call("GetHostNumberOfEntries")["NewHostNumberOfEntries"]
+
+    def get_generic_host_entry(self, index: int) -> Dict[str, Any]:
+        """Get the host entry at the given index."""
+        return self._router.call("GetGenericHostEntry", NewIndex=index)
+
+    def get_hosts_info(self) -> List[Dict[str, Any]]:
+        """Get all host entries one call at a time, like `FritzHosts.get_hosts_info()`."""
+        hosts: List[Dict[str, Any]] = []
+        while True:
+            entries = get_host_entries(self, len(hosts), len(hosts) + 1)
+            if not entries:
+                return hosts
+            hosts += entries
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
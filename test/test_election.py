@@ -0,0 +1,188 @@
+"""
+Unit tests of the leader election of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import json
+import time
+from threading import Thread
+from typing import Callable, Iterator, List
+
+import pytest
+
+from broker import SimulatedBroker, wait_for
+from faults import SimulatedNetwork
+from multi_ap_tracker.config import Config, HighAvailability, Mqtt
+from multi_ap_tracker.election import SETTLE_TIME, LeaderElection
+from multi_ap_tracker.mqtt_ifc import MqttInterface
+from multi_ap_tracker.state import State
+from multi_ap_tracker.tracker import Tracker
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+LOCK_TOPIC = "multi_ap_tracker/leader"
+CLAIM_DELAY = 0.2
+TIMEOUT = 5.0 + SETTLE_TIME
+
+
+# -----------------------------------------------------------------------------
+# Helpers
+# -----------------------------------------------------------------------------
+def create_config(broker: SimulatedBroker, client_id: str) -> Config:
+    """Create the configuration of an instance with high availability enabled."""
+    config = Config()
+    config.mqtt = Mqtt(address="127.0.0.1", port=broker.port, client_id=client_id)
+    config.high_availability = HighAvailability(enabled=True, claim_delay=CLAIM_DELAY)
+    return config
+
+
+@pytest.fixture(name="broker")
+def fixture_broker() -> Iterator[SimulatedBroker]:
+    """A running SimulatedBroker."""
+    broker = SimulatedBroker()
+    broker.start()
+    yield broker
+    broker.stop()
+
+
+@pytest.fixture(name="create_instance")
+def fixture_create_instance(broker) -> Iterator[Callable[[str], LeaderElection]]:
+    """Factory of started LeaderElection instances, which are closed at the end of the test."""
+    mqtt_interfaces: List[MqttInterface] = []
+
+    def create_instance(client_id: str) -> LeaderElection:
+        config = create_config(broker, client_id)
+        election = LeaderElection(config)
+        mqtt = MqttInterface(config, will=election.will, keepalive=config.high_availability.keepalive)
+        election.start(mqtt)
+        mqtt_interfaces.append(mqtt)
+        return election
+
+    yield create_instance
+    for mqtt in mqtt_interfaces:
+        mqtt.close()
+
+
+def wait_for_leader(election: LeaderElection) -> bool:
+    """Update the election until the instance is the leader."""
+    return wait_for(election.update, TIMEOUT)
+
+
+def get_lock_holder(broker: SimulatedBroker) -> str:
+    """Get the client ID of the holder of the lock retained by the broker."""
+    return b"".join(payload for _, payload in broker.get_retained(LOCK_TOPIC)).decode()
+
+
+# -----------------------------------------------------------------------------
+# Tests
+# -----------------------------------------------------------------------------
+def test_acquire_lock(broker, create_instance):
+    """A single instance claims the free lock and becomes the leader after the settle time."""
+    election = create_instance("instance-a")
+    assert wait_for(lambda: broker.get_retained(f"{LOCK_TOPIC}/instance-a"))
+    start = time.monotonic()
+    assert wait_for_leader(election)
+    assert time.monotonic() - start >= CLAIM_DELAY
+    assert election.is_leader
+    assert get_lock_holder(broker) == "instance-a"
+
+
+def test_standby(create_instance):
+    """A second instance stays in standby while the leader is online."""
+    leader = create_instance("instance-a")
+    assert wait_for_leader(leader)
+    standby = create_instance("instance-b")
+    assert not wait_for(standby.update, 3 * CLAIM_DELAY + SETTLE_TIME)
+    assert leader.update()
+
+
+def test_handover_on_last_will(broker, create_instance):
+    """The standby instance takes over when the last will of the leader clears its announcement.
+
+    The former leader reconnects, sees the new holder of the lock and is demoted.
+    """
+    leader = create_instance("instance-a")
+    assert wait_for_leader(leader)
+    standby = create_instance("instance-b")
+    assert wait_for(lambda: broker.get_retained(f"{LOCK_TOPIC}/instance-b"))
+    assert not standby.update()
+
+    broker.drop("instance-a")
+    assert wait_for(lambda: not broker.get_retained(f"{LOCK_TOPIC}/instance-a"))
+    assert wait_for_leader(standby)
+    assert get_lock_holder(broker) == "instance-b"
+    assert not leader.update()
+    assert wait_for(lambda: broker.get_retained(f"{LOCK_TOPIC}/instance-a"))
+    assert not wait_for(leader.update, 3 * CLAIM_DELAY)
+
+
+def test_demotion(broker, create_instance):
+    """The leader is demoted as soon as another instance holds the lock."""
+    leader = create_instance("instance-a")
+    assert wait_for_leader(leader)
+    broker.publish(f"{LOCK_TOPIC}/instance-b", b"online", retain=True)
+    broker.publish(LOCK_TOPIC, b"instance-b", retain=True)
+    assert wait_for(lambda: not leader.update())
+    assert not leader.is_leader
+
+
+def test_release(broker, create_instance):
+    """A released lock and announcement are cleared on the broker."""
+    leader = create_instance("instance-a")
+    assert wait_for_leader(leader)
+    leader.release()
+    assert wait_for(lambda: not broker.get_retained(f"{LOCK_TOPIC}/#"))
+
+
+def test_warm_view(broker, create_instance):
+    """The standby instance follows the device trackers and states published by the leader."""
+    standby = create_instance("instance-b")
+    assert wait_for(lambda: broker.get_retained(f"{LOCK_TOPIC}/instance-b"))
+    config_topic = "homeassistant/device_tracker/multi_ap_tracker/0123/config"
+    state_topic = "multi_ap_tracker/0123/state"
+    broker.publish(config_topic, json.dumps({"name": "mqtt_phone"}).encode(), retain=True)
+    broker.publish(state_topic, b"home")
+    assert wait_for(lambda: standby.get_warm_view() == {"phone": True})
+    broker.publish(state_topic, json.dumps({"state": "not_home", "attributes": {}}).encode())
+    assert wait_for(lambda: standby.get_warm_view() == {"phone": False})
+    broker.publish(config_topic, b"", retain=True)
+    assert wait_for(lambda: not standby.get_warm_view())
+
+
+def test_standby_tracker_stops(broker, tmp_path):
+    """A tracker waiting in standby stops without delay."""
+    broker.publish(f"{LOCK_TOPIC}/instance-a", b"online", retain=True)
+    broker.publish(LOCK_TOPIC, b"instance-a", retain=True)
+    config = create_config(broker, "instance-b")
+    config.repeater = []
+    network = SimulatedNetwork(["Fritz!Box"], num_hosts=1, mean_dwell=1e6, duration=1.0, latency=0.0, seed=0)
+    tracker = Tracker(config, State(tmp_path / "state.yml"), replay=network)
+    thread = Thread(target=tracker.track, daemon=True)
+    thread.start()
+    try:
+        time.sleep(1.5)
+        start = time.monotonic()
+        tracker.stop()
+        thread.join(2.0)
+        assert not thread.is_alive()
+        assert time.monotonic() - start < 0.25
+    finally:
+        tracker.close()
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
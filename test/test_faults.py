@@ -0,0 +1,87 @@
+"""
+Fault-injection tests of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import pytest
+
+from faults import Fault, FaultHarness
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+NUM_HOSTS = 10
+# One additional poll of the Fritz!Box and the repeater, each reading all host entries
+EXTRA_CALLS_BUDGET = 2 * (NUM_HOSTS + 1)
+# The configuration, state and attributes of every device tracker sent twice more,
+# e.g., when the hosts of a rebooting repeater move to the Fritz!Box and back
+EXTRA_MESSAGES_BUDGET = 6 * NUM_HOSTS
+
+
+# -----------------------------------------------------------------------------
+# Tests
+# -----------------------------------------------------------------------------
+def test_parse_fault():
+    """A fault is parsed from KIND@START+DURATION."""
+    fault = Fault.parse("broker@30+5")
+    assert fault == Fault("broker", 30.0, 5.0)
+    assert fault.end == 35.0
+    assert str(fault) == "broker@30+5"
+    assert Fault.parse("ha@10") == Fault("ha", 10.0, 0.0)
+
+
+@pytest.mark.parametrize("text", ["power@30+5", "broker", "broker@+5"])
+def test_parse_invalid_fault(text):
+    """Unknown kinds and missing start times are rejected."""
+    with pytest.raises(ValueError):
+        Fault.parse(text)
+
+
+def test_repeater_fault_without_repeater():
+    """A repeater fault is rejected before the run if no repeater is simulated."""
+    harness = FaultHarness(num_repeaters=0)
+    with pytest.raises(ValueError):
+        harness.run([Fault("repeater", 5, 1)], 10)
+
+
+@pytest.mark.slow
+def test_recovery():
+    """The tracker recovers from a repeater reboot, a broker restart and a home-assistant restart.
+
+    No state change is lost. The repeater reboot does not cause any duplicated
+    message, while the restarts of the broker and home-assistant duplicate at
+    most the configuration of every device tracker, which is republished to
+    restore the discovery. The messages and router calls above the baseline rates
+    stay within the budgets of two republishes and one additional poll.
+    """
+    harness = FaultHarness(num_hosts=NUM_HOSTS, num_repeaters=1, poll_interval=1, mean_dwell=300.0, seed=1)
+    faults = [Fault("repeater", 15, 3), Fault("broker", 23, 3), Fault("ha", 33, 2)]
+    results = harness.run(faults, 42)
+    print(f"Initial sync after {harness.initial_sync} s")
+    for result in results:
+        print(result)
+    assert harness.initial_sync is not None
+    assert [result.fault for result in results] == faults
+    for result in results:
+        assert result.recovery is not None, f"No recovery from {result.fault}"
+        assert result.lost == 0, f"Lost state changes during {result.fault}"
+        assert result.duplicated <= (0 if result.fault.kind == "repeater" else NUM_HOSTS)
+        assert result.extra_messages <= EXTRA_MESSAGES_BUDGET
+        assert result.extra_calls <= EXTRA_CALLS_BUDGET
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
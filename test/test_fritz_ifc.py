@@ -0,0 +1,194 @@
+"""
+Unit tests of the DeviceMonitor of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+from typing import Any, Dict, List, Optional
+
+import pytest
+
+from multi_ap_tracker.clock import Clock
+from multi_ap_tracker.config import Config, Repeater
+from multi_ap_tracker.fritz_ifc import DeviceMonitor
+from multi_ap_tracker.mac import parse_mac
+from multi_ap_tracker.state import State
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+FRITZBOX = "Fritz!Box"
+REPEATER = "Repeater repeater1"
+MAC = parse_mac("D8:A1:19:01:02:03")
+
+
+# -----------------------------------------------------------------------------
+# Helpers
+# -----------------------------------------------------------------------------
+class ManualClock(Clock):
+    """Clock advanced by the test."""
+
+    def __init__(self) -> None:
+        """Initialize this object."""
+        self.now = 1000.0
+
+    def time(self) -> float:
+        """Get the current time in seconds since the epoch."""
+        return self.now
+
+    def monotonic(self) -> float:
+        """Get the current value of a monotonic clock in seconds."""
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        """Advance the clock by the given number of seconds."""
+        self.now += seconds
+
+
+# pylint: disable=too-few-public-methods
+class FakeHosts:
+    """Replacement of FritzHosts returning a fixed host table or failing."""
+
+    def __init__(self) -> None:
+        """Initialize this object."""
+        self.hosts: List[Dict[str, Any]] = []
+        self.failing = False
+
+    def get_hosts_info(self) -> List[Dict[str, Any]]:
+        """Get the host table of the router."""
+        if self.failing:
+            raise OSError("Router unreachable")
+        return [dict(host) for host in self.hosts]
+
+
+class FakeNetwork:
+    """Source of the FakeHosts of the routers driven by a ManualClock."""
+
+    def __init__(self) -> None:
+        """Initialize this object."""
+        self.clock = ManualClock()
+        self.routers = {FRITZBOX: FakeHosts(), REPEATER: FakeHosts()}
+
+    def create_hosts(self, router_name: str) -> FakeHosts:
+        """Create the replacement of FritzHosts of the given router."""
+        return self.routers[router_name]
+
+
+def host_entry(name: str, status: bool, mac: str = "D8:A1:19:01:02:03") -> Dict[str, Any]:
+    """Create a host entry as returned by `get_hosts_info()`."""
+    return {"ip": "192.168.178.20", "name": name, "mac": mac, "status": status, "interface_type": "802.11"}
+
+
+def get_device(monitor: DeviceMonitor, mac: int = MAC) -> Optional[Any]:
+    """Run one cycle of the monitor and return the device of the given MAC."""
+    return monitor.get_device_stati().get(mac)
+
+
+@pytest.fixture(name="network")
+def fixture_network() -> FakeNetwork:
+    """A Fritz!Box and a repeater listing the same host."""
+    network = FakeNetwork()
+    network.routers[FRITZBOX].hosts = [host_entry("phone", False)]
+    network.routers[REPEATER].hosts = [host_entry("phone", True)]
+    return network
+
+
+@pytest.fixture(name="config")
+def fixture_config() -> Config:
+    """A configuration of a Fritz!Box and one repeater polled every 10 seconds."""
+    config = Config()
+    config.repeater = [Repeater(address="repeater1")]
+    config.tracker.time_interval = 10
+    return config
+
+
+# -----------------------------------------------------------------------------
+# Tests
+# -----------------------------------------------------------------------------
+def test_active_entry_wins(network, config, tmp_path):
+    """The active entry of the repeater wins over the inactive entry of the Fritz!Box."""
+    monitor = DeviceMonitor(config, State(tmp_path / "state.yml"), replay=network)
+    device = get_device(monitor)
+    assert device.status
+    assert device.connected_to == REPEATER
+    assert device.seen_by == [FRITZBOX, REPEATER]
+
+
+def test_failing_router_ages_out(network, config, tmp_path):
+    """The cached results of a router that keeps failing are used until they are older than the time interval."""
+    monitor = DeviceMonitor(config, State(tmp_path / "state.yml"), replay=network)
+    assert get_device(monitor).status
+    network.routers[REPEATER].failing = True
+
+    network.clock.sleep(10)
+    device = get_device(monitor)
+    assert device.status
+    assert device.connected_to == REPEATER
+
+    network.clock.sleep(1)
+    device = get_device(monitor)
+    assert not device.status
+    assert device.connected_to == FRITZBOX
+
+    network.clock.sleep(30)
+    assert not get_device(monitor).status
+
+    network.routers[REPEATER].failing = False
+    network.clock.sleep(10)
+    device = get_device(monitor)
+    assert device.status
+    assert device.connected_to == REPEATER
+
+
+def test_host_of_failing_router_ages_out(network, config, tmp_path):
+    """A host listed only by a failing router is considered inactive after the time interval."""
+    network.routers[FRITZBOX].hosts = []
+    monitor = DeviceMonitor(config, State(tmp_path / "state.yml"), replay=network)
+    assert get_device(monitor).status
+    network.routers[REPEATER].failing = True
+    network.clock.sleep(10)
+    assert get_device(monitor).status
+    network.clock.sleep(1)
+    assert not get_device(monitor).status
+
+
+def test_filtered_host_not_recorded(network, config, tmp_path):
+    """A host rejected by the host filter leaves the saved state unchanged."""
+    config.host_filter.exclude = [{"name": "printer*"}]
+    state_filepath = tmp_path / "state.yml"
+    monitor = DeviceMonitor(config, State(state_filepath), replay=network)
+    assert get_device(monitor).name == "phone"
+    saved_state = state_filepath.read_text(encoding="utf-8")
+
+    printer_mac = "D8:A1:19:0A:0B:0C"
+    network.routers[FRITZBOX].hosts.append(host_entry("printer", True, printer_mac))
+    network.clock.sleep(10)
+    assert parse_mac(printer_mac) not in monitor.get_device_stati()
+    assert state_filepath.read_text(encoding="utf-8") == saved_state
+    assert parse_mac(printer_mac) not in State(state_filepath).data["MacToDeviceNames"]
+
+
+def test_slow_router_keeps_hosts(network, config, tmp_path):
+    """The cached results of a slowly polled router keep its hosts active if the other routers don't object."""
+    network.routers[FRITZBOX].hosts = []
+    config.repeater[0].poll_interval = 60
+    monitor = DeviceMonitor(config, State(tmp_path / "state.yml"), replay=network)
+    assert get_device(monitor).status
+    network.clock.sleep(30)
+    assert get_device(monitor).status
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
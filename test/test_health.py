@@ -0,0 +1,96 @@
+"""
+Unit tests of the router health tracking of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import pytest
+
+from multi_ap_tracker.config import Throttling
+from multi_ap_tracker.health import RouterHealth
+
+
+# -----------------------------------------------------------------------------
+# Tests
+# -----------------------------------------------------------------------------
+def test_error_throttles():
+    """Every error doubles the poll interval and halves the parallelism."""
+    health = RouterHealth("router", 10, 4, Throttling(enabled=True))
+    health.record_error()
+    assert (health.interval, health.parallelism) == (20.0, 2)
+    health.record_error()
+    assert (health.interval, health.parallelism) == (40.0, 1)
+    assert (health.errors, health.consecutive_errors) == (2, 2)
+
+
+def test_max_interval():
+    """The poll interval is capped by the maximum interval."""
+    health = RouterHealth("router", 10, 1, Throttling(enabled=True, max_interval=30))
+    for _ in range(3):
+        health.record_error()
+    assert health.interval == 30.0
+    assert health.parallelism == 1
+
+
+def test_recovery():
+    """Healthy polls restore the configured rate additively."""
+    health = RouterHealth("router", 10, 4, Throttling(enabled=True, recovery_step=15))
+    health.record_error()
+    health.record_error()
+    health.record_success(1.0, 9)
+    assert (health.interval, health.parallelism) == (25.0, 2)
+    assert health.consecutive_errors == 0
+    for _ in range(3):
+        # The requests take 100 ms independent of the parallelism
+        health.record_success(1.0 / health.parallelism, 9)
+    assert (health.interval, health.parallelism) == (10.0, 4)
+
+
+def test_latency_throttles():
+    """A smoothed latency above the latency factor times the baseline throttles the router."""
+    health = RouterHealth("router", 10, 1, Throttling(enabled=True))
+    health.record_success(1.0, 9)
+    assert health.latency == pytest.approx(0.1)
+    assert health.baseline == pytest.approx(0.1)
+    assert health.interval == 10.0
+
+    health.record_success(10.0, 9)
+    assert health.latency == pytest.approx(0.37)
+    assert health.baseline == pytest.approx(0.101)
+    assert health.interval == 20.0
+
+
+def test_disabled():
+    """Without throttling, the configured rate is kept."""
+    health = RouterHealth("router", 10, 4, Throttling(enabled=False))
+    health.record_error()
+    health.record_success(10.0, 9)
+    assert (health.interval, health.parallelism) == (10.0, 4)
+    assert health.errors == 1
+
+
+def test_configure():
+    """Changed settings keep the throttled rate within the new limits."""
+    health = RouterHealth("router", 10, 4, Throttling(enabled=True))
+    health.record_error()
+    health.record_error()
+    health.configure(60, 8, Throttling(enabled=True))
+    assert (health.interval, health.parallelism) == (60.0, 1)
+    health.configure(60, 8, Throttling(enabled=False))
+    assert (health.interval, health.parallelism) == (60.0, 8)
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
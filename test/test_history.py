@@ -0,0 +1,130 @@
+"""
+Unit tests of the presence history of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+from datetime import datetime, timezone
+
+from multi_ap_tracker.history import NAMES_FILE, HistoryEvent, HistoryReader, HistoryWriter
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+DAY = 86400
+DAY1 = 1699920000  # 2023-11-14 00:00 UTC
+DAY3 = DAY1 + 2 * DAY
+
+
+# -----------------------------------------------------------------------------
+# Helper Functions
+# -----------------------------------------------------------------------------
+def to_datetime(timestamp: int) -> datetime:
+    """Convert a timestamp into a datetime."""
+    return datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+def get_all_events(directory):
+    """Get all events of the history."""
+    return list(HistoryReader(directory).get_events(to_datetime(DAY1), to_datetime(DAY3 + DAY)))
+
+
+# -----------------------------------------------------------------------------
+# Tests
+# -----------------------------------------------------------------------------
+def test_events(tmp_path):
+    """Only the changes of the states are recorded."""
+    writer = HistoryWriter(tmp_path, 0)
+    writer.record("phone", True, "Repeater", DAY1 + 100)
+    writer.record("phone", True, "Repeater", DAY1 + 200)
+    writer.record("phone", True, "Fritz!Box", DAY1 + 300)
+    writer.record("tv", True, "", DAY1 + 300)
+    writer.record("phone", False, "Fritz!Box", DAY1 + 400)
+    writer.flush()
+    assert get_all_events(tmp_path) == [
+        HistoryEvent(DAY1 + 100, "phone", True, "Repeater"),
+        HistoryEvent(DAY1 + 300, "phone", True, "Fritz!Box"),
+        HistoryEvent(DAY1 + 300, "tv", True, ""),
+        HistoryEvent(DAY1 + 400, "phone", False, ""),
+    ]
+    reader = HistoryReader(tmp_path)
+    events = reader.get_events(to_datetime(DAY1), to_datetime(DAY1 + 350), "tv")
+    assert [event.hostname for event in events] == ["tv"]
+
+
+def test_resume(tmp_path):
+    """A new writer continues with the states of the last segment."""
+    writer = HistoryWriter(tmp_path, 0)
+    writer.record("phone", True, "Repeater", DAY1 + 100)
+    writer.flush()
+    writer = HistoryWriter(tmp_path, 0)
+    writer.record("phone", True, "Repeater", DAY1 + 200)
+    writer.record("laptop", True, "Repeater", DAY1 + 200)
+    writer.flush()
+    assert [event.timestamp for event in get_all_events(tmp_path)] == [DAY1 + 100, DAY1 + 200]
+
+
+def test_departures(tmp_path):
+    """Hosts no longer reported by any router are recorded as departed."""
+    writer = HistoryWriter(tmp_path, 0)
+    writer.record("phone", True, "Repeater", DAY1 + 100)
+    writer.record("laptop", True, "Repeater", DAY1 + 100)
+    writer.record_departures(["phone", "unknown"], DAY1 + 200)
+    writer.flush()
+    assert get_all_events(tmp_path)[-1] == HistoryEvent(DAY1 + 200, "laptop", False, "")
+
+
+def test_who_was_home(tmp_path):
+    """The hosts being home are found using the snapshots, the indices and the events."""
+    writer = HistoryWriter(tmp_path, 0)
+    writer.record("phone", True, "Repeater", DAY1 + 100)
+    writer.record("laptop", True, "Repeater", DAY1 + 100)
+    writer.record("laptop", False, "", DAY1 + 200)
+    writer.record("tv", True, "", DAY3 + 100)
+    writer.flush()
+    reader = HistoryReader(tmp_path)
+    assert reader.who_was_home(to_datetime(DAY1 + DAY), to_datetime(DAY1 + DAY + 100)) == ["phone"]
+    assert reader.who_was_home(to_datetime(DAY1 + 150), to_datetime(DAY1 + 160)) == ["laptop", "phone"]
+    assert reader.who_was_home(to_datetime(DAY1), to_datetime(DAY3 + 200)) == ["laptop", "phone", "tv"]
+
+
+def test_retention(tmp_path):
+    """Segments older than the retention time are deleted."""
+    writer = HistoryWriter(tmp_path, 1)
+    writer.record("phone", True, "Repeater", DAY1 + 100)
+    writer.flush()
+    writer.record("phone", False, "", DAY3 + 100)
+    writer.flush()
+    assert sorted(path.name for path in tmp_path.glob("*.seg")) == ["20231116.seg"]
+    assert get_all_events(tmp_path) == [HistoryEvent(DAY3 + 100, "phone", False, "")]
+
+
+def test_names(tmp_path):
+    """Names containing line breaks are stored safely and a partial last line is dropped."""
+    writer = HistoryWriter(tmp_path, 0)
+    writer.record("phone\nof someone", True, "Repeater", DAY1 + 100)
+    writer.flush()
+    with open(tmp_path / NAMES_FILE, "ab") as file_handle:
+        file_handle.write(b'"partial')
+    assert get_all_events(tmp_path)[0].hostname == "phone\nof someone"
+
+    writer = HistoryWriter(tmp_path, 0)
+    writer.record("laptop", True, "Repeater", DAY1 + 200)
+    writer.flush()
+    assert [event.hostname for event in get_all_events(tmp_path)] == ["phone\nof someone", "laptop"]
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
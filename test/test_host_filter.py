@@ -0,0 +1,89 @@
+"""
+Unit tests of the host filter of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import pytest
+
+from multi_ap_tracker.config import HostFilterConfig
+from multi_ap_tracker.host_filter import FilterRule, HostFilter
+from multi_ap_tracker.mac import parse_mac
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+PI_MAC = parse_mac("B8:27:EB:01:02:03")
+PHONE_MAC = parse_mac("DA:A1:19:01:02:03")
+
+
+# -----------------------------------------------------------------------------
+# Tests
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize(
+    "rule, matches",
+    [
+        ({}, True),
+        ({"mac": "B8:27:EB"}, True),
+        ({"mac": "b8-27-ec"}, False),
+        ({"name": "rasp*"}, True),
+        ({"name": "*pi"}, True),
+        ({"name": "pi*"}, False),
+        ({"name_regex": "^r.sp"}, True),
+        ({"name_regex": "pi"}, False),
+        ({"interface_type": "Ethernet"}, True),
+        ({"interface_type": "802.11"}, False),
+        ({"ip": "192.168.178.0/24"}, True),
+        ({"ip": "192.168.178.7"}, True),
+        ({"ip": "10.0.0.0/8"}, False),
+        ({"mac": "B8:27:EB", "interface_type": "802.11"}, False),
+    ],
+)
+def test_rule_matches(rule, matches):
+    """A host matches a rule if all of its criteria match."""
+    assert FilterRule(rule).matches(PI_MAC, "raspberrypi", "Ethernet", "192.168.178.7") == matches
+
+
+def test_rule_without_ip_address():
+    """A host without a valid IP address never matches a rule with a network."""
+    assert not FilterRule({"ip": "192.168.178.0/24"}).matches(PI_MAC, "raspberrypi", "Ethernet", "")
+
+
+@pytest.mark.parametrize("rule", [{"hostname": "pi"}, {"ip": "bad"}, {"mac": "B8:27:EB:01:02:03:04"}])
+def test_invalid_rule(rule):
+    """Unknown keys and invalid criteria raise a ValueError."""
+    with pytest.raises(ValueError):
+        FilterRule(rule)
+
+
+def test_include_and_exclude():
+    """Hosts must match an include rule if given and no exclude rule."""
+    host_filter = HostFilter(HostFilterConfig(include=[{"interface_type": "802.11"}], exclude=[{"name": "tv*"}]))
+    assert host_filter.accepts(PHONE_MAC, "phone", "802.11", "192.168.178.8")
+    assert not host_filter.accepts(PHONE_MAC, "tv-livingroom", "802.11", "192.168.178.8")
+    assert not host_filter.accepts(PI_MAC, "raspberrypi", "Ethernet", "192.168.178.7")
+
+
+def test_exclude_pc_hosts():
+    """The placeholder names of the Fritz!Box are excluded in addition to the configured rules."""
+    host_filter = HostFilter(HostFilterConfig(exclude=[{"name": "tv*"}]))
+    assert not host_filter.accepts(PHONE_MAC, "PC-192-168-178-8", "802.11", "192.168.178.8")
+    assert not host_filter.accepts(PHONE_MAC, "tv", "802.11", "192.168.178.8")
+    host_filter = HostFilter(HostFilterConfig(exclude_pc_hosts=False))
+    assert host_filter.accepts(PHONE_MAC, "PC-192-168-178-8", "802.11", "192.168.178.8")
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
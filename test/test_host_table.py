@@ -0,0 +1,69 @@
+"""
+Unit tests of the host table enumeration of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import time
+
+import pytest
+
+from multi_ap_tracker.host_table import get_hosts_info_parallel, split_index_range
+from simulator import SimulatedRouter
+
+
+# -----------------------------------------------------------------------------
+# Tests
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize(
+    "num_entries, num_parts, expected",
+    [
+        (10, 1, [(0, 10)]),
+        (10, 3, [(0, 4), (4, 7), (7, 10)]),
+        (2, 4, [(0, 1), (1, 2)]),
+        (0, 4, [(0, 0)]),
+    ],
+)
+def test_split_index_range(num_entries, num_parts, expected):
+    """The index range is split into contiguous ranges of similar size."""
+    assert split_index_range(num_entries, num_parts) == expected
+
+
+@pytest.mark.parametrize("parallelism", [1, 2, 4, 8])
+def test_parallel_enumeration(parallelism):
+    """The parallel enumeration returns the host table in the order of the sequential enumeration."""
+    router = SimulatedRouter(50, 0.0)
+    expected = router.create_session().get_hosts_info()
+    sessions = [router.create_session() for _ in range(parallelism)]
+    assert get_hosts_info_parallel(sessions) == expected
+
+
+def test_parallel_enumeration_speedup():
+    """The parallel enumeration is faster than the sequential one as long as the router has free CPUs."""
+    router = SimulatedRouter(60, 0.005, cpus=2)
+    session = router.create_session()
+    start = time.perf_counter()
+    session.get_hosts_info()
+    sequential_time = time.perf_counter() - start
+
+    sessions = [router.create_session() for _ in range(2)]
+    start = time.perf_counter()
+    get_hosts_info_parallel(sessions)
+    parallel_time = time.perf_counter() - start
+    assert parallel_time < 0.8 * sequential_time
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
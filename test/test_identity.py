@@ -0,0 +1,97 @@
+"""
+Unit tests of the host identities of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+from multi_ap_tracker.identity import HostIdentityIndex
+from multi_ap_tracker.mac import parse_mac
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+MAC = parse_mac("D8:A1:19:01:02:03")
+RANDOM_MAC = parse_mac("DA:A1:19:0A:0B:0C")
+
+
+# -----------------------------------------------------------------------------
+# Tests
+# -----------------------------------------------------------------------------
+def test_first_name():
+    """The first reported name of a MAC is used and stored in the state."""
+    state_data = {}
+    index = HostIdentityIndex(state_data)
+    assert index.resolve(MAC, "phone", "Fritz!Box") == "phone"
+    assert state_data["MacToDeviceNames"] == {MAC: "phone"}
+    assert index.dirty
+
+
+def test_placeholder_name():
+    """Placeholder names never replace a real name, but are replaced by one."""
+    index = HostIdentityIndex({})
+    assert index.resolve(MAC, "PC-192-168-178-8", "Fritz!Box") == "PC-192-168-178-8"
+    assert index.resolve(MAC, "phone", "Repeater") == "phone"
+    assert index.resolve(MAC, "PC-192-168-178-8", "Fritz!Box") == "phone"
+
+
+def test_truncated_name():
+    """A truncated name keeps the full name of the same MAC."""
+    index = HostIdentityIndex({})
+    assert index.resolve(MAC, "phone-of-someone-long", "Fritz!Box") == "phone-of-someone-long"
+    assert index.resolve(MAC, "phone-of-someon", "Repeater") == "phone-of-someone-long"
+
+
+def test_truncated_name_of_new_mac():
+    """A truncated name of a new (randomized) MAC is resolved to the full name of another MAC."""
+    index = HostIdentityIndex({})
+    index.resolve(MAC, "phone-of-someone-long", "Fritz!Box")
+    assert index.resolve(RANDOM_MAC, "phone-of-someon", "Repeater") == "phone-of-someone-long"
+
+
+def test_renamed_host():
+    """A different name replaces the current name."""
+    index = HostIdentityIndex({})
+    index.resolve(MAC, "phone", "Fritz!Box")
+    index.dirty = False
+    assert index.resolve(MAC, "phone", "Fritz!Box") == "phone"
+    assert not index.dirty
+    assert index.resolve(MAC, "tablet", "Fritz!Box") == "tablet"
+    assert index.dirty
+
+
+def test_lookup():
+    """A lookup returns the resolved name without recording it."""
+    state_data = {}
+    index = HostIdentityIndex(state_data)
+    index.resolve(MAC, "phone-of-someone-long", "Fritz!Box")
+    index.dirty = False
+    assert index.lookup(MAC, "PC-192-168-178-8", "Repeater") == "phone-of-someone-long"
+    assert index.lookup(RANDOM_MAC, "phone-of-someon", "Repeater") == "phone-of-someone-long"
+    assert index.lookup(RANDOM_MAC, "printer", "Repeater") == "printer"
+    assert state_data["MacToDeviceNames"] == {MAC: "phone-of-someone-long"}
+    assert not index.dirty
+
+
+def test_load_state():
+    """The names are loaded from the state, converting MAC addresses given as strings."""
+    state_data = {"MacToDeviceNames": {"D8:A1:19:01:02:03": "phone-of-someone-long"}}
+    index = HostIdentityIndex(state_data)
+    assert index.dirty
+    assert state_data["MacToDeviceNames"] == {MAC: "phone-of-someone-long"}
+    assert index.resolve(RANDOM_MAC, "phone-of-someon", "Fritz!Box") == "phone-of-someone-long"
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
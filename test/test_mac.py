@@ -0,0 +1,75 @@
+"""
+Unit tests of the MAC address handling of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import pytest
+
+from multi_ap_tracker.mac import format_mac, is_locally_administered, load_mac_table, parse_mac, parse_mac_prefix
+
+
+# -----------------------------------------------------------------------------
+# Tests
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize("text", ["AA:BB:CC:DD:EE:FF", "aa-bb-cc-dd-ee-ff", "aabb.ccdd.eeff", "AABBCCDDEEFF"])
+def test_parse_mac(text):
+    """MAC addresses are parsed with any common separator and case."""
+    assert parse_mac(text) == 0xAABBCCDDEEFF
+
+
+@pytest.mark.parametrize("text", ["", "AA:BB:CC:DD:EE", "AA:BB:CC:DD:EE:FF:00", "GG:BB:CC:DD:EE:FF"])
+def test_parse_invalid_mac(text):
+    """Texts that are no MAC addresses raise a ValueError."""
+    with pytest.raises(ValueError):
+        parse_mac(text)
+
+
+def test_format_mac():
+    """Formatting is the inverse of parsing."""
+    assert format_mac(0x00AABB0102FF) == "00:AA:BB:01:02:FF"
+    assert format_mac(parse_mac("12:34:56:78:9a:bc")) == "12:34:56:78:9A:BC"
+
+
+def test_parse_mac_prefix():
+    """Prefixes are parsed into a value and a mask, also ending in the middle of a byte."""
+    assert parse_mac_prefix("B8:27:EB") == (0xB827EB000000, 0xFFFFFF000000)
+    assert parse_mac_prefix("B8:2") == (0xB82000000000, 0xFFF000000000)
+    assert parse_mac_prefix("") == (0, 0)
+    with pytest.raises(ValueError):
+        parse_mac_prefix("AA:BB:CC:DD:EE:FF:00")
+
+
+def test_is_locally_administered():
+    """The locally administered bit marks randomized MAC addresses."""
+    assert is_locally_administered(parse_mac("DA:A1:19:00:00:01"))
+    assert not is_locally_administered(parse_mac("D8:A1:19:00:00:01"))
+
+
+def test_load_mac_table():
+    """String keys of former versions are converted to integers, invalid ones are dropped."""
+    state_data = {"Table": {"AA:BB:CC:DD:EE:FF": "phone", "invalid": "tv", 0x010203040506: "laptop"}}
+    table, converted = load_mac_table(state_data, "Table")
+    assert converted
+    assert table == {0xAABBCCDDEEFF: "phone", 0x010203040506: "laptop"}
+    assert state_data["Table"] is table
+
+    table, converted = load_mac_table(state_data, "Table")
+    assert not converted
+    assert load_mac_table({}, "Table") == ({}, False)
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
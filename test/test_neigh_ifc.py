@@ -0,0 +1,263 @@
+"""
+Unit tests of the neighbour table interface of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import socket
+import struct
+import time
+from typing import List, Optional
+
+import pytest
+
+from multi_ap_tracker.mac import parse_mac
+from multi_ap_tracker.neigh_ifc import (
+    NDA_DST,
+    NDA_LLADDR,
+    NDMSG,
+    NLMSG_DONE,
+    NLMSG_HEADER,
+    NUD_FAILED,
+    NUD_REACHABLE,
+    RTATTR_HEADER,
+    RTM_DELNEIGH,
+    RTM_GETNEIGH,
+    RTM_NEWNEIGH,
+    NeighbourEvent,
+    NeighbourMonitor,
+    NetlinkNeighbourSource,
+)
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+NUD_STALE = 0x04
+MAC = parse_mac("D8:A1:19:01:02:03")
+OTHER_MAC = parse_mac("D8:A1:19:0A:0B:0C")
+
+
+# -----------------------------------------------------------------------------
+# Helpers
+# -----------------------------------------------------------------------------
+class FakeNetlinkSocket:
+    """Replacement of the rtnetlink socket returning the queued datagrams."""
+
+    datagrams: List[bytes] = []
+    sent: List[bytes] = []
+
+    def __init__(self, *_args) -> None:
+        """Initialize this object."""
+        self._datagrams = list(self.datagrams)
+
+    def bind(self, _address) -> None:
+        """Bind the socket."""
+
+    def send(self, data: bytes) -> None:
+        """Send a request."""
+        self.sent.append(data)
+
+    def recv(self, _size: int) -> bytes:
+        """Receive the next datagram or fail if there are none left, like a closed socket."""
+        if not self._datagrams:
+            raise OSError("Socket closed")
+        return self._datagrams.pop(0)
+
+    def close(self) -> None:
+        """Close the socket."""
+
+
+def rtattr(attr_type: int, value: bytes) -> bytes:
+    """Create a padded routing attribute."""
+    data = RTATTR_HEADER.pack(RTATTR_HEADER.size + len(value), attr_type) + value
+    return data + b"\0" * (-len(data) % 4)
+
+
+# pylint: disable=too-many-arguments
+def neighbour_message(
+    msg_type: int,
+    state: int,
+    ip_address: str,
+    mac: Optional[int] = None,
+    *,
+    ifindex: int = 2,
+    family: int = socket.AF_INET,
+) -> bytes:
+    """Create a RTM_NEWNEIGH or RTM_DELNEIGH message."""
+    payload = NDMSG.pack(family, 0, 0, ifindex, state, 0, 0) + rtattr(NDA_DST, socket.inet_pton(family, ip_address))
+    if mac is not None:
+        payload += rtattr(NDA_LLADDR, mac.to_bytes(6, "big"))
+    return NLMSG_HEADER.pack(NLMSG_HEADER.size + len(payload), msg_type, 0, 0, 0) + payload
+
+
+def parse(monkeypatch, datagrams: List[bytes], interface: str = "") -> List[NeighbourEvent]:
+    """Get all events of a NetlinkNeighbourSource receiving the given datagrams."""
+    monkeypatch.setattr(FakeNetlinkSocket, "datagrams", datagrams)
+    monkeypatch.setattr(FakeNetlinkSocket, "sent", [])
+    monkeypatch.setattr(socket, "socket", FakeNetlinkSocket)
+    source = NetlinkNeighbourSource(interface)
+    events = list(source)
+    source.close()
+    return events
+
+
+# -----------------------------------------------------------------------------
+# Tests of the NetlinkNeighbourSource
+# -----------------------------------------------------------------------------
+def test_dump_request(monkeypatch):
+    """The neighbour table is dumped first."""
+    parse(monkeypatch, [])
+    assert len(FakeNetlinkSocket.sent) == 1
+    _, msg_type, _, _, _ = NLMSG_HEADER.unpack_from(FakeNetlinkSocket.sent[0])
+    assert msg_type == RTM_GETNEIGH
+
+
+def test_parse_reachable(monkeypatch):
+    """A REACHABLE neighbour is reported as present with its link layer address."""
+    events = parse(monkeypatch, [neighbour_message(RTM_NEWNEIGH, NUD_REACHABLE, "192.168.178.20", MAC)])
+    assert len(events) == 1
+    assert events[0].ip == "192.168.178.20"
+    assert events[0].present
+    assert events[0].mac == MAC
+    assert events[0].timestamp > 0.0
+
+
+def test_parse_failed(monkeypatch):
+    """A FAILED neighbour is reported as gone, usually without a link layer address."""
+    events = parse(monkeypatch, [neighbour_message(RTM_NEWNEIGH, NUD_FAILED, "192.168.178.20")])
+    assert [(event.ip, event.present, event.mac) for event in events] == [("192.168.178.20", False, 0)]
+
+
+def test_parse_ipv6(monkeypatch):
+    """IPv6 neighbours are parsed as well."""
+    events = parse(
+        monkeypatch, [neighbour_message(RTM_NEWNEIGH, NUD_REACHABLE, "fe80::1", MAC, family=socket.AF_INET6)]
+    )
+    assert [(event.ip, event.present) for event in events] == [("fe80::1", True)]
+
+
+def test_parse_batch(monkeypatch):
+    """A datagram can contain several messages, terminated by NLMSG_DONE."""
+    done = NLMSG_HEADER.pack(NLMSG_HEADER.size + 4, NLMSG_DONE, 0, 0, 0) + struct.pack("=i", 0)
+    datagram = (
+        neighbour_message(RTM_NEWNEIGH, NUD_REACHABLE, "192.168.178.20", MAC)
+        + neighbour_message(RTM_NEWNEIGH, NUD_STALE, "192.168.178.21", OTHER_MAC)
+        + neighbour_message(RTM_NEWNEIGH, NUD_FAILED, "192.168.178.22")
+        + done
+    )
+    events = parse(monkeypatch, [datagram])
+    assert [(event.ip, event.present) for event in events] == [("192.168.178.20", True), ("192.168.178.22", False)]
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        neighbour_message(RTM_NEWNEIGH, NUD_STALE, "192.168.178.20", MAC),
+        neighbour_message(RTM_DELNEIGH, NUD_REACHABLE, "192.168.178.20", MAC),
+        NLMSG_HEADER.pack(NLMSG_HEADER.size + NDMSG.size, RTM_NEWNEIGH, 0, 0, 0)
+        + NDMSG.pack(socket.AF_INET, 0, 0, 2, NUD_REACHABLE, 0, 0),
+    ],
+    ids=["stale", "delneigh", "without-address"],
+)
+def test_parse_ignored(monkeypatch, message):
+    """States without presence information, deleted entries and entries without address are not reported."""
+    assert not parse(monkeypatch, [message])
+
+
+def test_parse_interface(monkeypatch):
+    """Only the neighbours of the configured interface are reported."""
+    ifindex = socket.if_nametoindex("lo")
+    events = parse(
+        monkeypatch,
+        [
+            neighbour_message(RTM_NEWNEIGH, NUD_REACHABLE, "192.168.178.20", MAC, ifindex=ifindex + 1),
+            neighbour_message(RTM_NEWNEIGH, NUD_REACHABLE, "192.168.178.21", OTHER_MAC, ifindex=ifindex),
+        ],
+        interface="lo",
+    )
+    assert [event.ip for event in events] == ["192.168.178.21"]
+
+
+# -----------------------------------------------------------------------------
+# Tests of the NeighbourMonitor
+# -----------------------------------------------------------------------------
+def test_transitions():
+    """The hints follow the REACHABLE and FAILED events, the callback is called on changes only."""
+    changes = []
+    monitor = NeighbourMonitor(on_change=lambda: changes.append(True))
+    monitor.feed(NeighbourEvent("192.168.178.20", True, MAC, 10.0))
+    assert monitor.get_hint("192.168.178.20", MAC, 5.0) is True
+    assert len(changes) == 1
+
+    monitor.feed(NeighbourEvent("192.168.178.20", True, MAC, 20.0))
+    assert len(changes) == 1
+
+    monitor.feed(NeighbourEvent("192.168.178.20", False, 0, 30.0))
+    assert monitor.get_hint("192.168.178.20", MAC, 25.0) is False
+    assert len(changes) == 2
+
+
+def test_stale_keeps_hint(monkeypatch):
+    """A STALE entry is not reported by the source, so the last REACHABLE hint stays."""
+    monitor = NeighbourMonitor()
+    datagrams = [
+        neighbour_message(RTM_NEWNEIGH, NUD_REACHABLE, "192.168.178.20", MAC),
+        neighbour_message(RTM_NEWNEIGH, NUD_STALE, "192.168.178.20", MAC),
+    ]
+    for event in parse(monkeypatch, datagrams):
+        monitor.feed(event)
+    assert monitor.get_hint("192.168.178.20", MAC, 0.0) is True
+
+
+def test_failed_keeps_mac():
+    """A FAILED event without link layer address keeps the MAC address of the previous event."""
+    monitor = NeighbourMonitor()
+    monitor.feed(NeighbourEvent("192.168.178.20", True, MAC, 10.0))
+    monitor.feed(NeighbourEvent("192.168.178.20", False, 0, 20.0))
+    assert monitor.get_hint("192.168.178.20", MAC, 15.0) is False
+    assert monitor.get_hint("192.168.178.20", OTHER_MAC, 15.0) is None
+
+
+def test_expired_hint():
+    """A hint not newer than the given time is not used."""
+    monitor = NeighbourMonitor()
+    monitor.feed(NeighbourEvent("192.168.178.20", True, MAC, 10.0))
+    assert monitor.get_hint("192.168.178.20", MAC, 10.0) is None
+    assert monitor.get_hint("192.168.178.20", MAC, 20.0) is None
+    assert monitor.get_hint("192.168.178.21", MAC, 0.0) is None
+
+
+def test_other_mac():
+    """A hint of an IP address belonging to a different MAC address is not used."""
+    monitor = NeighbourMonitor()
+    monitor.feed(NeighbourEvent("192.168.178.20", True, MAC, 10.0))
+    assert monitor.get_hint("192.168.178.20", OTHER_MAC, 0.0) is None
+    assert monitor.get_hint("192.168.178.20", 0, 0.0) is True
+
+
+def test_source_thread():
+    """The events of a source are consumed in the background."""
+    changes = []
+    monitor = NeighbourMonitor([NeighbourEvent("192.168.178.20", True, MAC, 10.0)], lambda: changes.append(True))
+    monitor.close()
+    for _ in range(100):
+        if changes:
+            break
+        time.sleep(0.01)
+    assert monitor.get_hint("192.168.178.20", MAC, 0.0) is True
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
@@ -0,0 +1,83 @@
+"""
+Unit tests of the record output of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import io
+import json
+
+import pytest
+
+from multi_ap_tracker.output import RecordWriter
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+FIELDS = ["name", "status", "seen_by"]
+RECORDS = [
+    {"name": "phone", "status": True, "seen_by": ["Fritz!Box", "Repeater"]},
+    {"name": "tablet", "status": False, "seen_by": []},
+]
+
+
+# -----------------------------------------------------------------------------
+# Tests
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize("num_records", [0, 1, 2])
+def test_json(num_records):
+    """The json format writes a single indented array."""
+    stream = io.StringIO()
+    writer = RecordWriter("json", FIELDS, stream)
+    for record in RECORDS[:num_records]:
+        writer.write(record)
+    writer.close()
+    assert stream.getvalue() == json.dumps(RECORDS[:num_records], indent=2) + "\n"
+
+
+@pytest.mark.parametrize("output_format", ["json", "jsonl", "csv"])
+def test_streaming(output_format):
+    """Every record is written before the writer is closed."""
+    stream = io.StringIO()
+    writer = RecordWriter(output_format, FIELDS, stream)
+    writer.write(RECORDS[0])
+    assert "phone" in stream.getvalue()
+    writer.write(RECORDS[1])
+    assert "tablet" in stream.getvalue()
+    writer.close()
+
+
+def test_jsonl():
+    """The jsonl format writes one line per record."""
+    stream = io.StringIO()
+    writer = RecordWriter("jsonl", FIELDS, stream)
+    for record in RECORDS:
+        writer.write(record)
+    writer.close()
+    assert [json.loads(line) for line in stream.getvalue().splitlines()] == RECORDS
+
+
+def test_csv():
+    """The csv format writes a header and joins list values by semicolons."""
+    stream = io.StringIO()
+    writer = RecordWriter("csv", FIELDS, stream)
+    for record in RECORDS:
+        writer.write(record)
+    writer.close()
+    assert stream.getvalue().splitlines() == ["name,status,seen_by", "phone,True,Fritz!Box;Repeater", "tablet,False,"]
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
@@ -0,0 +1,196 @@
+"""
+Unit tests of the ICMP prober of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import asyncio
+import errno
+import socket
+import time
+from typing import Iterable, Iterator, List, Tuple
+
+import pytest
+
+from multi_ap_tracker.config import Probe
+from multi_ap_tracker.probe import ICMP_ECHO_REPLY, ICMP_ECHO_REQUEST, ICMP_HEADER, Prober, _checksum, _TokenBucket
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+PRESENT = "192.168.178.20"
+SILENT = "192.168.178.21"
+UNREACHABLE = "192.168.178.22"
+
+
+# -----------------------------------------------------------------------------
+# Helpers
+# -----------------------------------------------------------------------------
+class FakeIcmpSocket:
+    """Replacement of the ICMP socket answering the echo requests to the `replying` addresses.
+
+    Echo requests to the `unreachable` addresses fail, all other requests are
+    dropped. The socket is readable whenever a reply is pending, as it uses a
+    socket pair to wake up the event loop.
+    """
+
+    def __init__(self, replying: Iterable[str], unreachable: Iterable[str] = (), is_raw: bool = False) -> None:
+        """Initialize this object."""
+        self.replying = set(replying)
+        self.unreachable = set(unreachable)
+        self.is_raw = is_raw
+        self.sent: List[Tuple[str, int, int]] = []
+        self._replies: List[Tuple[bytes, Tuple[str, int]]] = []
+        self._reader, self._writer = socket.socketpair()
+
+    def __enter__(self) -> "FakeIcmpSocket":
+        """Enter the context."""
+        return self
+
+    def __exit__(self, *_args) -> None:
+        """Leave the context, keeping the socket open for the next probes."""
+
+    def close(self) -> None:
+        """Close the socket."""
+        self._reader.close()
+        self._writer.close()
+
+    def fileno(self) -> int:
+        """Get the file descriptor signalling pending replies."""
+        return self._reader.fileno()
+
+    def setblocking(self, _flag: bool) -> None:
+        """Set the blocking mode."""
+
+    def sendto(self, packet: bytes, address: Tuple[str, int]) -> None:
+        """Send an echo request."""
+        icmp_type, _, checksum, ident, sequence = ICMP_HEADER.unpack_from(packet)
+        assert icmp_type == ICMP_ECHO_REQUEST
+        self.sent.append((address[0], sequence, checksum))
+        if address[0] in self.unreachable:
+            raise OSError(errno.EHOSTUNREACH, "No route to host")
+        if address[0] in self.replying:
+            header_size = ICMP_HEADER.size
+            reply = ICMP_HEADER.pack(ICMP_ECHO_REPLY, 0, 0, ident, sequence) + packet[header_size:]
+            if self.is_raw:
+                reply = b"\x45" + bytes(19) + reply
+            self._replies.append((reply, (address[0], 0)))
+            self._writer.send(b"\0")
+
+    def recvfrom(self, _size: int) -> Tuple[bytes, Tuple[str, int]]:
+        """Receive a pending reply."""
+        if not self._replies:
+            raise BlockingIOError(errno.EAGAIN, "No reply pending")
+        self._reader.recv(1)
+        return self._replies.pop(0)
+
+
+@pytest.fixture(name="icmp_socket")
+def fixture_icmp_socket(monkeypatch) -> Iterator[FakeIcmpSocket]:
+    """A FakeIcmpSocket used by the Prober."""
+    icmp_socket = FakeIcmpSocket([PRESENT], [UNREACHABLE])
+    monkeypatch.setattr("multi_ap_tracker.probe._open_icmp_socket", lambda: (icmp_socket, icmp_socket.is_raw))
+    yield icmp_socket
+    icmp_socket.close()
+
+
+async def acquire_all(bucket: _TokenBucket, count: int) -> List[float]:
+    """Acquire the given number of slots concurrently and return the times of the slots."""
+    loop = asyncio.get_running_loop()
+
+    async def acquire() -> float:
+        await bucket.acquire()
+        return loop.time()
+
+    return list(await asyncio.gather(*(acquire() for _ in range(count))))
+
+
+# -----------------------------------------------------------------------------
+# Tests
+# -----------------------------------------------------------------------------
+def test_checksum():
+    """The checksum of a packet including its checksum is zero."""
+    packet = ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, 0, 0x1234, 1) + b"odd"
+    checksum = _checksum(packet)
+    assert _checksum(ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, checksum, 0x1234, 1) + b"odd") == 0
+
+
+def test_token_bucket_rate():
+    """The slots of the token bucket are spaced by the inverse of the rate."""
+    times = asyncio.run(acquire_all(_TokenBucket(50.0), 5))
+    assert times[-1] - times[0] >= 4 / 50.0 - 0.001
+    assert all(later - earlier >= 1 / 50.0 - 0.001 for earlier, later in zip(times, times[1:]))
+
+
+def test_token_bucket_unlimited():
+    """A rate of zero disables the rate limit."""
+    times = asyncio.run(acquire_all(_TokenBucket(0.0), 100))
+    assert times[-1] - times[0] < 0.05
+
+
+def test_probe_results(icmp_socket):
+    """Only the addresses answering an echo request are reported as present."""
+    prober = Prober(Probe(enabled=True, timeout=0.1, attempts=2))
+    results = prober.probe([PRESENT, SILENT, UNREACHABLE, PRESENT, "fe80::1", "invalid"])
+    assert results == {PRESENT: True, SILENT: False, UNREACHABLE: False}
+    sent = [address for address, _, _ in icmp_socket.sent]
+    assert sent.count(PRESENT) == 1
+    assert sent.count(SILENT) == 2
+    assert sent.count(UNREACHABLE) == 2
+    assert all(checksum == 0 for _, _, checksum in icmp_socket.sent)
+
+
+def test_probe_timeout(icmp_socket):
+    """A silent address is given up after all attempts timed out, an unreachable one immediately."""
+    prober = Prober(Probe(enabled=True, timeout=0.2, attempts=2))
+    start = time.monotonic()
+    assert prober.probe([UNREACHABLE]) == {UNREACHABLE: False}
+    assert time.monotonic() - start < 0.2
+    start = time.monotonic()
+    assert prober.probe([SILENT]) == {SILENT: False}
+    assert time.monotonic() - start >= 0.4
+    assert len({sequence for address, sequence, _ in icmp_socket.sent if address == SILENT}) == 2
+
+
+def test_probe_raw_socket(icmp_socket):
+    """The replies on a raw socket are parsed behind the IP header, the requests carry a checksum."""
+    icmp_socket.is_raw = True
+    prober = Prober(Probe(enabled=True, timeout=0.1, attempts=1))
+    assert prober.probe([PRESENT, SILENT]) == {PRESENT: True, SILENT: False}
+    assert all(checksum != 0 for _, _, checksum in icmp_socket.sent)
+
+
+def test_probe_rate_limit(icmp_socket):
+    """The echo requests are limited by the configured rate."""
+    icmp_socket.replying = {f"192.168.1.{index}" for index in range(10)}
+    prober = Prober(Probe(enabled=True, timeout=0.5, attempts=1, rate=100))
+    start = time.monotonic()
+    results = prober.probe(sorted(icmp_socket.replying))
+    assert all(results.values())
+    assert time.monotonic() - start >= 9 / 100.0 - 0.001
+
+
+def test_probe_without_socket(monkeypatch):
+    """All probes fail if no ICMP socket can be opened."""
+
+    def open_icmp_socket():
+        raise PermissionError(errno.EPERM, "Operation not permitted")
+
+    monkeypatch.setattr("multi_ap_tracker.probe._open_icmp_socket", open_icmp_socket)
+    assert Prober(Probe(enabled=True)).probe([PRESENT]) == {PRESENT: False}
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
@@ -0,0 +1,111 @@
+"""
+Unit tests of the device tracker registry of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+from multi_ap_tracker.registry import LAST_SEEN_RESOLUTION, SECONDS_PER_DAY, TrackerRegistry
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+NOW = 1700000000
+
+
+# -----------------------------------------------------------------------------
+# Tests
+# -----------------------------------------------------------------------------
+def test_add():
+    """Created device trackers are stored in the state."""
+    state_data = {}
+    registry = TrackerRegistry(state_data, NOW)
+    assert not registry.dirty
+    registry.add("phone", NOW)
+    assert "phone" in registry
+    assert list(registry) == ["phone"]
+    assert len(registry) == 1
+    assert state_data["Trackers"] == {"phone": {"created": NOW, "last_seen": NOW}}
+    assert registry.dirty
+
+
+def test_migration():
+    """The former list of created host names is migrated."""
+    state_data = {"CreatedHostnames": ["phone", "laptop"]}
+    registry = TrackerRegistry(state_data, NOW)
+    assert sorted(registry) == ["laptop", "phone"]
+    assert "CreatedHostnames" not in state_data
+    assert registry.dirty
+
+
+def test_seen():
+    """The last seen time is only updated once per resolution."""
+    registry = TrackerRegistry({}, NOW)
+    registry.add("phone", NOW)
+    registry.dirty = False
+    registry.seen("phone", NOW + LAST_SEEN_RESOLUTION - 1)
+    assert not registry.dirty
+    registry.seen("phone", NOW + LAST_SEEN_RESOLUTION)
+    assert registry.dirty
+
+
+def test_expiry():
+    """Hosts not seen for the TTL are expired until they are added again."""
+    state_data = {}
+    registry = TrackerRegistry(state_data, NOW)
+    registry.add("phone", NOW)
+    registry.add("laptop", NOW + 2 * SECONDS_PER_DAY)
+    assert registry.pop_expired(0, NOW + 100 * SECONDS_PER_DAY) == []
+    assert registry.pop_expired(1, NOW + 2 * SECONDS_PER_DAY) == ["phone"]
+    assert "phone" not in registry
+    assert registry.is_expired("phone")
+    assert state_data["ExpiredTrackers"] == {"phone": NOW}
+
+    registry.add("phone", NOW + 3 * SECONDS_PER_DAY)
+    assert not registry.is_expired("phone")
+
+
+def test_expiry_check_interval():
+    """The registry is checked for expired hosts once per resolution."""
+    registry = TrackerRegistry({}, NOW)
+    registry.add("phone", NOW)
+    check_time = NOW + SECONDS_PER_DAY - 10
+    assert registry.pop_expired(1, check_time) == []
+    assert registry.pop_expired(1, check_time + 20) == []
+    assert registry.pop_expired(1, check_time + LAST_SEEN_RESOLUTION) == ["phone"]
+
+
+def test_forget_expired():
+    """Expired hosts not seen for twice the TTL are forgotten."""
+    registry = TrackerRegistry({}, NOW)
+    registry.add("phone", NOW)
+    registry.pop_expired(1, NOW + int(1.5 * SECONDS_PER_DAY))
+    assert registry.is_expired("phone")
+    registry.pop_expired(1, NOW + 3 * SECONDS_PER_DAY)
+    assert not registry.is_expired("phone")
+
+
+def test_clear():
+    """Clearing removes the created and the expired device trackers."""
+    registry = TrackerRegistry({}, NOW)
+    registry.add("phone", NOW)
+    registry.add("laptop", NOW + 2 * SECONDS_PER_DAY)
+    registry.pop_expired(1, NOW + 2 * SECONDS_PER_DAY)
+    registry.clear()
+    assert len(registry) == 0
+    assert not registry.is_expired("phone")
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
@@ -0,0 +1,83 @@
+"""
+Unit tests of the cycle timings of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import time
+from threading import Thread
+
+import pytest
+
+from multi_ap_tracker.timing import StageTimings
+
+
+# -----------------------------------------------------------------------------
+# Tests
+# -----------------------------------------------------------------------------
+def test_measure():
+    """Measuring the same stage accumulates the durations."""
+    timings = StageTimings()
+    for _ in range(2):
+        with timings.measure("merge"):
+            time.sleep(0.01)
+    timings.add("fetch", 0.5)
+    assert timings.durations["merge"] == pytest.approx(0.02, abs=0.01)
+    assert timings.durations["fetch"] == 0.5
+    assert not timings.spans
+    assert str(timings).endswith(f"merge={timings.durations['merge']:.3f}s, fetch=0.500s")
+
+
+def test_measure_exception():
+    """The duration is recorded if the measured block raises an exception."""
+    timings = StageTimings()
+    with pytest.raises(RuntimeError):
+        with timings.measure("fetch"):
+            raise RuntimeError("Router unreachable")
+    assert "fetch" in timings.durations
+
+
+def test_spans():
+    """Spans measured within another span of the same thread are nested into it."""
+    timings = StageTimings(record_spans=True)
+    with timings.span("router", {"name": "Fritz!Box"}):
+        with timings.measure("fetch"):
+            pass
+        timings.add("normalise", 0.001)
+    with timings.measure("diff"):
+        pass
+    assert [(span.name, span.parent) for span in timings.spans] == [
+        ("router", None),
+        ("fetch", 0),
+        ("normalise", 0),
+        ("diff", None),
+    ]
+    assert timings.spans[0].attributes == {"name": "Fritz!Box"}
+    assert timings.spans[0].duration >= timings.spans[1].duration
+    assert "router" not in timings.durations
+
+
+def test_spans_of_threads():
+    """Spans of other threads are not nested into the open spans of the main thread."""
+    timings = StageTimings(record_spans=True)
+    with timings.span("cycle"):
+        thread = Thread(target=timings.add, args=("fetch", 0.001))
+        thread.start()
+        thread.join()
+    assert [(span.name, span.parent) for span in timings.spans] == [("cycle", None), ("fetch", None)]
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
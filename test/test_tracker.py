@@ -0,0 +1,127 @@
+"""
+Unit tests of the Tracker of ha_multi_ap_tracker.
+
+Copyright:
+    2023 by Clemens Rabe <clemens.rabe@clemensrabe.de>
+
+    All rights reserved.
+
+    This file is part of powercounter (https://github.com/seeraven/ha_multi_ap_tracker)
+    and is released under the "BSD 3-Clause License". Please see the ``LICENSE`` file
+    that is included as part of this package.
+"""
+
+
+# -----------------------------------------------------------------------------
+# Module Import
+# -----------------------------------------------------------------------------
+import json
+from dataclasses import replace
+from typing import Iterator, List, Tuple
+
+import pytest
+
+from broker import SimulatedBroker, wait_for
+from faults import SimulatedNetwork
+from multi_ap_tracker.clock import Clock
+from multi_ap_tracker.config import Config, Mqtt, Roaming
+from multi_ap_tracker.state import State
+from multi_ap_tracker.timing import StageTimings
+from multi_ap_tracker.tracker import Tracker
+
+# -----------------------------------------------------------------------------
+# Module Variables
+# -----------------------------------------------------------------------------
+NUM_HOSTS = 3
+CONFIG_FILTER = "homeassistant/device_tracker/#"
+
+
+# -----------------------------------------------------------------------------
+# Helpers
+# -----------------------------------------------------------------------------
+class NoSleepClock(Clock):
+    """System clock skipping the sleeps of the tracker."""
+
+    def sleep(self, seconds: float) -> None:
+        """Do not sleep at all."""
+
+
+def get_tracker_names(broker: SimulatedBroker) -> List[str]:
+    """Get the names of the device trackers retained by the broker."""
+    return sorted(json.loads(payload)["name"] for _, payload in broker.get_retained(CONFIG_FILTER))
+
+
+@pytest.fixture(name="broker")
+def fixture_broker() -> Iterator[SimulatedBroker]:
+    """A running SimulatedBroker."""
+    broker = SimulatedBroker()
+    broker.start()
+    yield broker
+    broker.stop()
+
+
+@pytest.fixture(name="tracker")
+def fixture_tracker(broker, tmp_path) -> Iterator[Tuple[Tracker, Config]]:
+    """A tracker of a Fritz!Box with a few hosts connected to the broker, after the first cycle."""
+    network = SimulatedNetwork(["Fritz!Box"], num_hosts=NUM_HOSTS, mean_dwell=1e6, duration=1.0, latency=0.0, seed=0)
+    network.clock = NoSleepClock()
+    network.update(0.0)
+    config = Config()
+    config.mqtt = Mqtt(address="127.0.0.1", port=broker.port, client_id="ha_multi_ap_tracker-test")
+    config.repeater = []
+    tracker = Tracker(config, State(tmp_path / "state.yml"), replay=network)
+    assert wait_for(lambda: broker.clients)
+    tracker.track_cycle({}, StageTimings())
+    assert wait_for(lambda: len(get_tracker_names(broker)) == NUM_HOSTS)
+    yield tracker, config
+    tracker.close()
+
+
+# -----------------------------------------------------------------------------
+# Tests
+# -----------------------------------------------------------------------------
+def test_reload_new_broker(tracker):
+    """After a change of the broker, the device trackers are published to the new broker."""
+    tracker, config = tracker
+    new_broker = SimulatedBroker()
+    new_broker.start()
+    try:
+        tracker.reload(replace(config, mqtt=replace(config.mqtt, port=new_broker.port)))
+        assert wait_for(lambda: new_broker.clients)
+        tracker.track_cycle({}, StageTimings())
+        assert wait_for(lambda: len(get_tracker_names(new_broker)) == NUM_HOSTS)
+    finally:
+        new_broker.stop()
+
+
+def test_reload_new_topics(tracker, broker):
+    """After a change of the topics, the device trackers are published again."""
+    tracker, config = tracker
+    tracker.reload(replace(config, mqtt=replace(config.mqtt, name_prefix="test_")))
+    assert wait_for(lambda: broker.connections == 2 and broker.clients)
+    tracker.track_cycle({}, StageTimings())
+    assert wait_for(lambda: sum(name.startswith("test_") for name in get_tracker_names(broker)) == NUM_HOSTS)
+
+
+def test_reload_credentials(tracker, broker):
+    """A change of the credentials reconnects, but does not publish the device trackers again."""
+    tracker, config = tracker
+    messages = []
+    broker.add_listener(lambda topic, *_: messages.append(topic))
+    tracker.reload(replace(config, mqtt=replace(config.mqtt, password="changed")))
+    assert wait_for(lambda: broker.connections == 2 and broker.clients)
+    tracker.track_cycle({}, StageTimings())
+    assert not [topic for topic in messages if topic.startswith("homeassistant/device_tracker/")]
+
+
+def test_reload_roaming(tracker, broker):
+    """A change of the roaming section does not reconnect to the broker."""
+    tracker, config = tracker
+    tracker.reload(replace(config, roaming=Roaming(enabled=True, events_topic="test/roaming")))
+    tracker.track_cycle({}, StageTimings())
+    assert broker.connections == 1
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------